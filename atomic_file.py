@@ -0,0 +1,17 @@
+import os
+from contextlib import contextmanager
+
+# Open path for writing under a temp name and rename it into place once the
+# block finishes, so readers and a crash never see half a file. When the block
+# raises, the temp file is removed and path keeps its old content.
+@contextmanager
+def atomic_write(path, mode='w', **kwargs):
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, mode, **kwargs) as file:
+            yield file
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
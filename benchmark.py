@@ -0,0 +1,401 @@
+import argparse
+import contextlib
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from history_store import HISTORY_COLUMNS, HistoryStore
+from sms import (HISTORY_CATEGORY_COLUMNS, PROBLEM, AtmDirectory, ParseStats, create_messages_and_save_to_excel,
+                 days_in_indonesian, history_sheet_name, iter_report_records, normalize_history,
+                 process_text_file, save_messages_workbook)
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+# Imports that dominate startup, reported per command to show what it loaded
+HEAVY_MODULES = ['numpy', 'pandas', 'openpyxl', 'dotenv', 'selenium']
+# Runs cli.py with the given arguments, then names the heavy modules it imported on stderr
+STARTUP_PROBE = (
+    "import os, runpy, sys\n"
+    "sys.argv = sys.argv[1:]\n"
+    "sys.path.insert(0, os.path.dirname(sys.argv[0]))\n"
+    "try:\n"
+    "    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+    "finally:\n"
+    f"    print('loaded:', ' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)\n"
+)
+
+# Fixed clock for generated fixtures and pipeline runs, so results are comparable between runs
+BENCH_CLOCK = datetime(2024, 10, 15, 10, 5, 0)
+ATM_BRANDS = ['NCR', 'Hyosung', 'Wincor', 'Diebold']
+HARDWARE_FAULTS = ['Card Reader Fault', 'Dispenser Fault', 'Encrypting PIN Pad Fault', 'Journal Printer Fault']
+SUPPLY_FAULTS = ['Reject Bin Full', 'Currency Cassettes Low', 'Receipt Paper Out']
+
+# Build a directory of synthetic ATMs so the parser has something to match against
+def build_directory(atm_count):
+    atm_info = pd.DataFrame({
+        "ID_ATM": [10000000 + i for i in range(atm_count)],
+        "NAMA_ATM": [f"ATM Cabang {i}" for i in range(atm_count)],
+        "NAMA_CABANG": [f"Cabang {i // 10}" for i in range(atm_count)],
+        "PIC_NAME": [f"PIC {i // 10}" for i in range(atm_count)],
+        "PHONE": [f"+62812{i // 10:06d}" for i in range(atm_count)],
+        "MERK_ATM": ["NCR"] * atm_count,
+    })
+    return AtmDirectory.from_frame(atm_info, [])
+
+# Write a report.txt with every section, repeated until it has at least line_count lines
+def write_report(file, line_count, atm_count):
+    written = 0
+    while written < line_count:
+        rows = []
+        rows.append("Problem Hardware")
+        for i in range(50):
+            rows.append(f" {i + 1}. {10000000 + i % atm_count} | ATM Cabang {i % atm_count} | error dengan keterangan : ID ATM {10000000 + i % atm_count} Card Reader")
+        rows.append("monitoring_npm:")
+        for i in range(50):
+            rows.append(f"- ATM Cabang {i % atm_count}")
+        rows.append("Report Persentase Saldo di Bawah Pagu ATM BPD Bali")
+        for i in range(50):
+            rows.append(f" {i + 1}. {10000000 + i % atm_count} | ATM Cabang {i % atm_count} | 5000000 | {i % 20}.50% | 2024-10-01 08:00")
+        rows.append("Report Problem ATM BPD Bali")
+        for i in range(50):
+            rows.append(f" {i + 1}. {10000000 + i % atm_count} | ATM Cabang {i % atm_count} | 01/10/2024 08:00:00 | Receipt Paper Out")
+        file.write("\n".join(rows) + "\n")
+        written += len(rows)
+    return written
+
+def bench_parse(line_count, atm_count):
+    atm_directory = build_directory(atm_count)
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+        write_report(file, line_count, atm_count)
+    try:
+        stats = ParseStats()
+        for _ in iter_report_records(file.name, atm_directory, stats):
+            pass
+    finally:
+        os.remove(file.name)
+    print(f"parse: {stats.lines} lines, {stats.records} records in {stats.elapsed:.3f}s ({stats.lines_per_second:.0f} lines/s)")
+
+# A month sheet as read from history.xlsx: string timestamps, float IDs, and
+# one malformed UPDATED_AT in every thousand rows
+def build_history(row_count):
+    return pd.DataFrame({
+        "ID_ATM": [float(10000000 + i % 3000) for i in range(row_count)],
+        "UPDATED_AT": [
+            "not a date" if i % 1000 == 0 else f"{1 + i % 28:02d}/10/2024 {i % 24:02d}:{i % 60:02d}:00"
+            for i in range(row_count)
+        ],
+    })
+
+# The per-cell loop normalize_history replaced, kept here as the baseline
+def normalize_history_rowwise(history_df):
+    invalid_date_entries = []
+    for idx, date_str in history_df["UPDATED_AT"].items():
+        try:
+            history_df.at[idx, "UPDATED_AT"] = pd.to_datetime(date_str, format='%d/%m/%Y %H:%M:%S')
+        except ValueError:
+            invalid_date_entries.append((idx, date_str))
+    history_df["ID_ATM"] = history_df["ID_ATM"].apply(lambda x: f"{int(x)}")
+    return invalid_date_entries
+
+def bench_history(row_count):
+    history_df = build_history(row_count)
+
+    started = time.perf_counter()
+    invalid_rowwise = normalize_history_rowwise(history_df.copy())
+    rowwise_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    quarantine, _ = normalize_history(history_df.copy())
+    vectorized_elapsed = time.perf_counter() - started
+
+    print(f"history normalize, {row_count} rows: row loop {rowwise_elapsed:.3f}s ({len(invalid_rowwise)} invalid), "
+          f"vectorized {vectorized_elapsed:.3f}s ({len(quarantine)} quarantined), "
+          f"{rowwise_elapsed / vectorized_elapsed:.0f}x")
+
+# Synthetic info.xlsx: ATMs spread over branches, ten per branch, six per PIC
+def generate_atm_info(atm_count, rng):
+    ids = [10000000 + i * 7 for i in range(atm_count)]
+    names = [f"{'CRM' if i % 9 == 0 else 'ATM'} Cabang {i // 10} Unit {i}" for i in range(atm_count)]
+    atm_info = pd.DataFrame({
+        "ID_ATM": ids,
+        "NAMA_ATM": names,
+        "NAMA_CABANG": [f"Cabang {i // 10}" for i in range(atm_count)],
+        "PIC_NAME": [f"PIC {i // 6}" for i in range(atm_count)],
+        "PHONE": [f"+62812{i // 6:07d}" for i in range(atm_count)],
+        "MERK_ATM": [rng.choice(ATM_BRANDS) for _ in range(atm_count)],
+    })
+    exceptions = pd.DataFrame({"ID_ATM": ids[::97]})
+    return atm_info, exceptions
+
+# Synthetic report.txt with every section the parser knows about
+def generate_report_lines(atm_info, problem_count, rng):
+    ids = atm_info["ID_ATM"].tolist()
+    names = atm_info["NAMA_ATM"].tolist()
+    per_section = max(1, problem_count // 6)
+
+    def pick():
+        i = rng.randrange(len(ids))
+        return ids[i], names[i]
+
+    lines = []
+    for header, faults in (('Problem Hardware', HARDWARE_FAULTS), ('Problem Down', ['Down Node']), ('Problem Supply Out', SUPPLY_FAULTS)):
+        lines.append(f"*{header}*")
+        for n in range(per_section):
+            id_atm, nama_atm = pick()
+            lines.append(f" {n + 1}. {id_atm} | {nama_atm} | error dengan keterangan : ID ATM {id_atm} {rng.choice(faults)}")
+        lines.append("")
+
+    lines.append("monitoring_npm:")
+    for n in range(per_section):
+        _, nama_atm = pick()
+        # Some names come through in another case or are unknown to info.xlsx
+        if n % 10 == 0:
+            nama_atm = f"ATM Tidak Terdaftar {n}"
+        elif n % 3 == 0:
+            nama_atm = nama_atm.upper()
+        lines.append(f"- {nama_atm}")
+    lines.append("")
+
+    lines.append("Report Persentase Saldo di Bawah Pagu ATM BPD Bali")
+    for n in range(per_section):
+        id_atm, nama_atm = pick()
+        lines.append(
+            f" {n + 1}. {id_atm} | {nama_atm} | {rng.randrange(1, 40) * 1000000} | {rng.uniform(0.5, 20):.2f}% | "
+            f"{BENCH_CLOCK:%Y-%m-%d} {rng.randrange(0, 10):02d}:{rng.randrange(0, 60):02d}"
+        )
+    lines.append("")
+
+    lines.append("Report Problem ATM BPD Bali")
+    for header, faults in (('Problem Hardware', HARDWARE_FAULTS + SUPPLY_FAULTS), ('Problem Down', ['Comm Down'])):
+        lines.append(f"*{header}*")
+        for n in range(per_section // 2 or 1):
+            id_atm, nama_atm = pick()
+            lines.append(
+                f" {n + 1}. {id_atm} | {nama_atm} | {BENCH_CLOCK:%d/%m/%Y} {rng.randrange(0, 10):02d}:{rng.randrange(0, 60):02d}:00 | {rng.choice(faults)}"
+            )
+    return lines
+
+# Synthetic month sheet of history.xlsx. Problems repeat the report's wording so
+# part of the next run dedupes against them, and one row in a thousand has a bad UPDATED_AT.
+def generate_history(atm_info, row_count, rng):
+    ids = atm_info["ID_ATM"].tolist()
+    names = atm_info["NAMA_ATM"].tolist()
+    month_start = BENCH_CLOCK.replace(day=1, hour=0, minute=0, second=0)
+    month_hours = int((BENCH_CLOCK - month_start).total_seconds() // 3600)
+    rows = []
+    for n in range(row_count):
+        i = rng.randrange(len(ids))
+        updated_at = month_start + timedelta(hours=rng.randrange(0, month_hours + 1), minutes=rng.randrange(0, 60))
+        error_type, fault = rng.choice([
+            ('Problem Hardware', rng.choice(HARDWARE_FAULTS)), ('Problem Down', 'Down Node'), ('Problem Supply Out', rng.choice(SUPPLY_FAULTS))
+        ])
+        rows.append({
+            "TANGGAL INPUT": updated_at.strftime('%d/%m/%Y %H:%M:%S'),
+            "HARI": days_in_indonesian[updated_at.strftime('%A')],
+            "TANGGAL": updated_at.strftime('%d/%m/%Y'),
+            "JAM": updated_at.strftime('%H:%M:%S'),
+            "FREQUENCY": rng.randrange(1, 6),
+            "ID_ATM": ids[i],
+            "MERK_ATM": rng.choice(ATM_BRANDS),
+            "NAMA_ATM": names[i],
+            "TIPE_PERMASALAHAN": error_type,
+            "PERMASALAHAN": f"error dengan keterangan : ID ATM {ids[i]} {fault}",
+            "TINDAK LANJUT OFFICER FDS": "",
+            "TINDAK LANJUT PIC": "",
+            "KETERANGAN": rng.choice(["", "", "in progress", "sudah normal"]),
+            "PROGRES_PERBAIKAN_ATM": "",
+            "PIC": f"PIC {i // 6}",
+            "Unit Kerja": f"Cabang {i // 10}",
+            "Nomor Telepon": f"+62812{i // 6:07d}",
+            "UPDATED_AT": "-" if n % 1000 == 999 else updated_at.strftime('%d/%m/%Y %H:%M:%S'),
+            "STATUS": ""
+        })
+    return pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+
+# Write info.xlsx, history.xlsx and report.txt for the given sizes into out_dir
+def generate_fixtures(out_dir, atm_count, history_rows, problem_count, seed=1):
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    atm_info, exceptions = generate_atm_info(atm_count, rng)
+    with pd.ExcelWriter(os.path.join(out_dir, 'info.xlsx')) as writer:
+        atm_info.to_excel(writer, sheet_name='info', index=False)
+        exceptions.to_excel(writer, sheet_name='exception', index=False)
+    generate_history(atm_info, history_rows, rng).to_excel(
+        os.path.join(out_dir, 'history.xlsx'), sheet_name=history_sheet_name(BENCH_CLOCK), index=False
+    )
+    with open(os.path.join(out_dir, 'report.txt'), 'w') as file:
+        file.write("\n".join(generate_report_lines(atm_info, problem_count, rng)) + "\n")
+
+# Wall time and, while tracemalloc runs, peak traced memory of one stage.
+# The pipeline's own prints are silenced.
+@contextlib.contextmanager
+def measure(stage_name, measurements):
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if tracing else None
+    measurements.append((stage_name, elapsed, peak))
+
+# Tracing memory slows allocation-heavy stages (openpyxl most of all), so
+# compare timings only between runs with the same trace_memory setting
+def bench_pipeline(atm_count, history_rows, problem_count, keep_dir=None, trace_memory=True):
+    work_dir = keep_dir or tempfile.mkdtemp(prefix='sms-bench-')
+    generate_fixtures(work_dir, atm_count, history_rows, problem_count)
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    measurements = []
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with measure('reference load (info.xlsx)', measurements):
+            atm_directory = AtmDirectory.from_excel('info.xlsx', cache_dir=os.path.join(work_dir, '.refcache'))
+        with measure('history import (history.xlsx)', measurements):
+            history_store = HistoryStore(os.path.join(work_dir, 'history.db'))
+            history_store.import_excel('history.xlsx')
+        with measure('history load (month)', measurements):
+            history_df = history_store.load_month(history_sheet_name(BENCH_CLOCK))
+        with measure('parse', measurements):
+            parse_stats = ParseStats()
+            problems, not_found, above_ten_percent = process_text_file('report.txt', atm_directory, parse_stats)
+        with measure('match + history reconcile + messages', measurements):
+            message_run = create_messages_and_save_to_excel(
+                problems, not_found, above_ten_percent, atm_directory, None, history_df, history_store, BENCH_CLOCK
+            )
+        with measure('messages export (xlsx)', measurements):
+            save_messages_workbook(
+                'atm_problem_messages.xlsx', message_run.messages, message_run.not_found,
+                message_run.above_ten_percent, message_run.report_down_message
+            )
+        with measure('history export (xlsx)', measurements):
+            history_store.export_excel('history_export.xlsx')
+        history_store.close()
+    finally:
+        tracemalloc.stop()
+        os.chdir(previous_dir)
+        if keep_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"pipeline: {atm_count} ATMs, {history_rows} history rows, {len(problems)} problems, {parse_stats.lines} report lines")
+    print(f"{'stage':<40}{'seconds':>10}{'peak MiB':>12}")
+    for stage_name, elapsed, peak in measurements:
+        peak_text = f"{peak / 2 ** 20:.1f}" if peak is not None else "-"
+        print(f"{stage_name:<40}{elapsed:>10.3f}{peak_text:>12}")
+
+# Traced bytes still held by whatever build() returns
+def traced_size(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        held = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return size, held
+
+# Parsed problems as the dicts they used to be against ProblemRecords, and a
+# month-end history sheet with object columns against categorical ones
+def bench_memory(atm_count, history_rows, problem_count):
+    rng = random.Random(1)
+    atm_info, _ = generate_atm_info(atm_count, rng)
+    atm_directory = AtmDirectory.from_frame(atm_info, [])
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+        file.write("\n".join(generate_report_lines(atm_info, problem_count, rng)) + "\n")
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            # The first parse builds the directory's lookup caches, so the traced one only holds records
+            parse = lambda: [record for kind, record in iter_report_records(file.name, atm_directory) if kind == PROBLEM]
+            parse()
+            records_size, records = traced_size(parse)
+            dicts_size, _ = traced_size(lambda: [record.to_row() for record in parse()])
+    finally:
+        os.remove(file.name)
+    print(f"problems, {len(records)} records: dicts {dicts_size / 2 ** 20:.2f} MiB, "
+          f"records {records_size / 2 ** 20:.2f} MiB, {dicts_size / records_size:.1f}x")
+
+    history_df = generate_history(atm_info, history_rows, rng)
+    columns = [column for column in HISTORY_CATEGORY_COLUMNS if column in history_df.columns]
+    object_size = history_df[columns].memory_usage(deep=True, index=False).sum()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        normalize_history(history_df)
+    category_size = history_df[columns].memory_usage(deep=True, index=False).sum()
+    print(f"history, {history_rows} rows, {', '.join(columns)}: object {object_size / 2 ** 20:.1f} MiB, "
+          f"categorical {category_size / 2 ** 20:.1f} MiB, {object_size / category_size:.0f}x")
+
+# Wall time of a fresh interpreter running one cli.py command, best of
+# `repeats`, and the heavy modules it imported; None when the command failed
+def time_command(args, work_dir, repeats):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE, CLI_PATH, *args], cwd=work_dir, capture_output=True, text=True
+        )
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        best = elapsed if best is None else min(best, elapsed)
+    loaded = result.stderr.strip().splitlines()[-1].removeprefix('loaded:').strip()
+    return best, loaded or '-'
+
+# Startup of every cli.py subcommand (its --help, which imports the command's
+# module and builds its parser) and full `parse` runs of a small report.
+# The cold parse reads info.xlsx, the warm ones load the cached directory.
+def bench_startup(atm_count, problem_count, repeats=5):
+    work_dir = tempfile.mkdtemp(prefix='sms-startup-')
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            generate_fixtures(work_dir, atm_count, 0, problem_count)
+        runs = [
+            ('parse (cold cache)', ['parse'], 1),
+            ('parse', ['parse'], repeats),
+            *((f"{command} --help", [command, '--help'], repeats)
+              for command in ['parse', 'notify', 'report', 'resolve-phones', 'send'])
+        ]
+        print(f"startup: {atm_count} ATMs, {problem_count} problems in report.txt")
+        print(f"{'command':<28}{'seconds':>10}  imported")
+        for label, args, count in runs:
+            elapsed, loaded = time_command(args, work_dir, count)
+            elapsed_text = f"{elapsed:.3f}" if elapsed is not None else "failed"
+            print(f"{label:<28}{elapsed_text:>10}  {loaded}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the sms.py pipeline")
+    parser.add_argument('stage', choices=['parse', 'history', 'memory', 'pipeline', 'startup', 'generate'])
+    parser.add_argument('--lines', type=int, default=1_000_000, help="report lines for the parse stage")
+    parser.add_argument('--atms', type=int, default=3000, help="ATMs in info.xlsx, e.g. 1000 to 50000")
+    parser.add_argument('--rows', type=int, default=100_000, help="history rows, e.g. 10000 to 500000")
+    parser.add_argument('--problems', type=int, default=600, help="problem rows in the generated report.txt")
+    parser.add_argument('--out', help="keep generated fixtures in this directory")
+    parser.add_argument('--trace-memory', action=argparse.BooleanOptionalAction, default=True,
+                        help="record peak memory per pipeline stage (slows the Excel stages)")
+    args = parser.parse_args()
+
+    if args.stage == 'parse':
+        bench_parse(args.lines, args.atms)
+    elif args.stage == 'history':
+        bench_history(args.rows)
+    elif args.stage == 'memory':
+        bench_memory(args.atms, args.rows, args.problems)
+    elif args.stage == 'startup':
+        bench_startup(args.atms, args.problems)
+    elif args.stage == 'pipeline':
+        bench_pipeline(args.atms, args.rows, args.problems, args.out, args.trace_memory)
+    elif args.stage == 'generate':
+        generate_fixtures(args.out or 'bench_fixtures', args.atms, args.rows, args.problems)
+        print(f"Fixtures written to {args.out or 'bench_fixtures'}")
+
+if __name__ == "__main__":
+    main()
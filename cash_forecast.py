@@ -0,0 +1,135 @@
+import os
+import re
+
+import numpy as np
+
+from atomic_file import atomic_write
+
+NON_DIGIT_PATTERN = re.compile(r'[^\d]')
+
+# Cash left in an ATM as written in the report, e.g. "5000000" or "5.000.000"
+def parse_amount(value):
+    digits = NON_DIGIT_PATTERN.sub('', str(value))
+    return float(digits) if digits else np.nan
+
+def parse_percent(value):
+    try:
+        return float(str(value).strip().rstrip('%'))
+    except ValueError:
+        return np.nan
+
+# The last `capacity` (jml_uang, percent, time) observations of every ATM in
+# the Saldo di Bawah Pagu section, as one row per ATM in fixed-size NumPy
+# ring buffers saved to an .npz file between runs. Forecasts fit a
+# least-squares line through every ATM's observations in one vectorized pass.
+class CashForecast:
+    def __init__(self, path='cash_forecast.npz', capacity=12):
+        self.path = path
+        self.capacity = capacity
+        self.ids = np.empty(0, dtype=np.int64)
+        self.amounts = np.empty((0, capacity))
+        self.percents = np.empty((0, capacity), dtype=np.float32)
+        self.times = np.empty((0, capacity))  # epoch seconds, NaN for an empty slot
+        self.heads = np.empty(0, dtype=np.int64)  # slot the next observation goes to
+        self.rows = {}  # ID_ATM -> row
+
+    @classmethod
+    def load(cls, path='cash_forecast.npz', capacity=12):
+        forecast = cls(path, capacity)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if data['amounts'].shape[1] == capacity:
+                    forecast.ids = data['ids']
+                    forecast.amounts = data['amounts']
+                    forecast.percents = data['percents']
+                    forecast.times = data['times']
+                    forecast.heads = data['heads']
+            forecast.rows = {int(id_atm): row for row, id_atm in enumerate(forecast.ids)}
+        return forecast
+
+    def save(self):
+        with atomic_write(self.path, 'wb') as file:
+            np.savez(file, ids=self.ids, amounts=self.amounts, percents=self.percents, times=self.times, heads=self.heads)
+
+    def _rows_for(self, ids):
+        new_ids = [id_atm for id_atm in ids if id_atm not in self.rows]
+        if new_ids:
+            start = len(self.ids)
+            self.ids = np.concatenate([self.ids, np.array(new_ids, dtype=np.int64)])
+            self.amounts = np.vstack([self.amounts, np.full((len(new_ids), self.capacity), np.nan)])
+            self.percents = np.vstack([self.percents, np.full((len(new_ids), self.capacity), np.nan, dtype=np.float32)])
+            self.times = np.vstack([self.times, np.full((len(new_ids), self.capacity), np.nan)])
+            self.heads = np.concatenate([self.heads, np.zeros(len(new_ids), dtype=np.int64)])
+            self.rows.update((id_atm, start + i) for i, id_atm in enumerate(new_ids))
+        return np.array([self.rows[id_atm] for id_atm in ids], dtype=np.int64)
+
+    # Record one observation per ATM taken at `now`. An ATM whose cash went
+    # up was refilled, so its older observations no longer describe the
+    # current drain and are dropped.
+    def observe(self, observations, now):
+        if not observations:
+            return
+        ids = list(observations)
+        amounts = np.array([observations[id_atm][0] for id_atm in ids])
+        percents = np.array([observations[id_atm][1] for id_atm in ids], dtype=np.float32)
+        rows = self._rows_for(ids)
+
+        latest = self.amounts[rows, (self.heads[rows] - 1) % self.capacity]
+        refilled = rows[amounts > latest]
+        self.times[refilled] = np.nan
+        self.amounts[refilled] = np.nan
+
+        slots = self.heads[rows]
+        self.amounts[rows, slots] = amounts
+        self.percents[rows, slots] = percents
+        self.times[rows, slots] = now.timestamp()
+        self.heads[rows] = (slots + 1) % self.capacity
+
+    # ATMs among `ids` whose fitted drain empties them within horizon_hours of
+    # `now`, soonest first, as rows for the Cash Forecast sheet
+    def forecast(self, ids, now, horizon_hours, names=None):
+        ids = [id_atm for id_atm in ids if id_atm in self.rows]
+        if not ids:
+            return []
+        rows = np.array([self.rows[id_atm] for id_atm in ids], dtype=np.int64)
+        hours = (self.times[rows] - now.timestamp()) / 3600
+        amounts = self.amounts[rows]
+        valid = ~np.isnan(hours) & ~np.isnan(amounts)
+        counts = valid.sum(axis=1)
+
+        # Least-squares slope of cash over time, per row, ignoring empty slots
+        safe_counts = np.maximum(counts, 1)
+        mean_hours = np.where(valid, hours, 0).sum(axis=1) / safe_counts
+        mean_amounts = np.where(valid, amounts, 0).sum(axis=1) / safe_counts
+        hour_offsets = np.where(valid, hours - mean_hours[:, None], 0)
+        amount_offsets = np.where(valid, amounts - mean_amounts[:, None], 0)
+        variance = (hour_offsets ** 2).sum(axis=1)
+        slopes = np.divide(
+            (hour_offsets * amount_offsets).sum(axis=1), variance, out=np.zeros(len(rows)), where=variance > 0
+        )
+
+        latest_slots = (self.heads[rows] - 1) % self.capacity
+        latest_amounts = amounts[np.arange(len(rows)), latest_slots]
+        latest_percents = self.percents[rows, latest_slots]
+        hours_since_latest = -hours[np.arange(len(rows)), latest_slots]
+        draining = (counts >= 2) & (slopes < 0)
+        hours_to_empty = np.full(len(rows), np.inf)
+        hours_to_empty[draining] = np.maximum(
+            0, latest_amounts[draining] / -slopes[draining] - hours_since_latest[draining]
+        )
+
+        due = np.flatnonzero(hours_to_empty <= horizon_hours)
+        ranked = due[np.argsort(hours_to_empty[due], kind='stable')]
+        return [
+            {
+                "RANK": rank,
+                "ID_ATM": f"{ids[i]}",
+                "NAMA_ATM": (names or {}).get(ids[i]),
+                "JML_UANG": int(latest_amounts[i]),
+                "PERCENT": round(float(latest_percents[i]), 2),
+                "RATE_PER_HOUR": int(round(-slopes[i])),
+                "HOURS_TO_EMPTY": round(float(hours_to_empty[i]), 1),
+                "OBSERVATIONS": int(counts[i])
+            }
+            for rank, i in enumerate(ranked, start=1)
+        ]
@@ -0,0 +1,32 @@
+import argparse
+import importlib
+import sys
+
+# Subcommand -> (module whose main() runs it, summary). A module is imported
+# only when its subcommand runs, so `parse` never loads pandas or selenium.
+COMMANDS = {
+    'parse': ('report_parser', "parse report.txt against info.xlsx and print the records"),
+    'notify': ('sms', "build the PIC messages, update history and queue the messages"),
+    'report': ('genReport', "write the afternoon ATM status report from history"),
+    'resolve-phones': ('move_phone', "fill in branch PIC names and phones from the branch heads list"),
+    'send': ('dispatcher', "send the queued messages over WhatsApp Web")
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="ATM problem reporting tools",
+        epilog="\n".join(f"  {command:<16}{summary}" for command, (_, summary) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('command', choices=COMMANDS, metavar='command', help="one of the commands below")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="options of the command, see `cli.py COMMAND --help`")
+    args = parser.parse_args(argv)
+
+    module_name, _ = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    # The command's own parser names it in usage and error messages
+    sys.argv[0] = f"{parser.prog} {args.command}"
+    module.main(args.args)
+
+if __name__ == "__main__":
+    main()
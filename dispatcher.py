@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+from selenium import webdriver # type: ignore
+from selenium.common.exceptions import StaleElementReferenceException, WebDriverException # type: ignore
+from selenium.webdriver.common.by import By # type: ignore
+from selenium.webdriver.support import expected_conditions as EC # type: ignore
+from selenium.webdriver.support.ui import WebDriverWait # type: ignore
+
+from outbox import Outbox, dispatch_priority
+from phone_number import whatsapp_phone
+
+WHATSAPP_APP_URL = 'https://web.whatsapp.com'
+WHATSAPP_SEND_URL = 'https://web.whatsapp.com/send?phone={phone}&text={text}'
+SEND_BUTTON_XPATH = '//button[@data-icon="send"] | //span[@data-icon="send"]/ancestor::button'
+APP_READY_CSS = '#pane-side'  # the chat list, shown once the app is loaded and logged in
+LOGIN_QR_CSS = 'canvas[aria-label], div[data-ref]'  # the QR code of a logged-out profile
+COMPOSE_CSS = 'footer div[contenteditable="true"]'
+
+# How a message reached its chat
+IN_PAGE = 'in-page'  # the already-loaded app switched chats
+NAVIGATE = 'navigate'  # the send URL was loaded as a new page
+
+# Opens the chat of a link inside the running app: the app handles clicks on
+# links to a chat itself, as it does for links inside messages
+OPEN_CHAT_SCRIPT = (
+    "var link = document.createElement('a'); link.href = arguments[0];"
+    "document.body.appendChild(link); link.click(); link.remove();"
+)
+
+# Refills at `rate` tokens per second up to `capacity`; acquire() blocks until a token is free
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# A message as the compose box shows it: the box renders line breaks and
+# runs of spaces its own way, so only the words are compared
+def compose_text(text):
+    return ' '.join(text.split())
+
+# The page a session keeps open: WhatsApp Web itself, or the send URL
+# template without its query, e.g. the file:// URL of mock_whatsapp.html
+def app_url_for(send_url_template):
+    if send_url_template == WHATSAPP_SEND_URL:
+        return WHATSAPP_APP_URL
+    return send_url_template.split('?', 1)[0]
+
+# One logged-in WhatsApp Web window with its own Chrome profile. The app is
+# loaded once by start(); each message then switches chats inside that page
+# and only loads the send URL as a new page when switching fails.
+class BrowserSession:
+    def __init__(self, name, driver, send_url_template=WHATSAPP_SEND_URL, timeout=30, bucket=None, switch_timeout=10, app_url=None):
+        self.name = name
+        self.driver = driver
+        self.send_url_template = send_url_template
+        self.timeout = timeout
+        self.switch_timeout = switch_timeout  # seconds an in-page switch gets before falling back
+        self.bucket = bucket
+        self.app_url = app_url or app_url_for(send_url_template)
+        self.page_token = None  # set in the loaded page, gone after any reload
+
+    @classmethod
+    def open_chrome(cls, name, profile_dir, headless=False, **kwargs):
+        options = webdriver.ChromeOptions()
+        options.add_argument(f"--user-data-dir={os.path.abspath(profile_dir)}")
+        if headless:
+            options.add_argument('--headless=new')
+        return cls(name, webdriver.Chrome(options=options), **kwargs)
+
+    # Load the app once. The profile keeps its login between runs, so the QR
+    # code is only asked for when the app shows one.
+    def start(self):
+        self.driver.get(self.app_url)
+        WebDriverWait(self.driver, self.timeout).until(
+            lambda driver: driver.find_elements(By.CSS_SELECTOR, f"{APP_READY_CSS}, {LOGIN_QR_CSS}")
+        )
+        if not self.driver.find_elements(By.CSS_SELECTOR, APP_READY_CSS):
+            input(f"[{self.name}] Scan the QR code, then press Enter once the chats are shown")
+            WebDriverWait(self.driver, self.timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, APP_READY_CSS))
+            )
+        self._mark_page()
+
+    def _mark_page(self):
+        self.page_token = f"{self.name}-{time.time_ns()}"
+        self.driver.execute_script("window.dispatcherPageToken = arguments[0];", self.page_token)
+
+    def _page_marked(self):
+        return self.page_token is not None and self.driver.execute_script(
+            "return window.dispatcherPageToken === arguments[0];", self.page_token
+        )
+
+    # The send button once the compose box holds this message. A box that is
+    # merely non-empty may still show a draft left in the previous chat, and
+    # clicking then would send that draft to the wrong PIC.
+    def _wait_for_send_button(self, timeout, message):
+        expected = compose_text(message)
+        def ready(driver):
+            compose = driver.find_elements(By.CSS_SELECTOR, COMPOSE_CSS)
+            if not compose or compose_text(compose[0].text) != expected:
+                return False
+            return EC.element_to_be_clickable((By.XPATH, SEND_BUTTON_XPATH))(driver)
+        return WebDriverWait(self.driver, timeout, ignored_exceptions=(StaleElementReferenceException,)).until(ready)
+
+    # Send one message and return how its chat was opened, IN_PAGE or NAVIGATE
+    def send(self, phone, message):
+        # The 62... digits WhatsApp expects, whichever way info.xlsx wrote the number
+        url = self.send_url_template.format(phone=urllib.parse.quote(str(whatsapp_phone(phone))), text=urllib.parse.quote(message))
+        send_button = None
+        method = NAVIGATE
+        if self.page_token is not None:
+            switch_error = None
+            try:
+                self.driver.execute_script(OPEN_CHAT_SCRIPT, url)
+                send_button = self._wait_for_send_button(self.switch_timeout, message)
+            except WebDriverException as e:
+                switch_error = e
+            try:
+                navigated = not self._page_marked()
+            except WebDriverException:
+                navigated = True  # the new page is still loading
+            if navigated:
+                # A page that didn't handle the link loaded it instead, so the
+                # chat is already opening there; loading it again would only
+                # start over
+                if send_button is None:
+                    send_button = self._wait_for_send_button(self.timeout, message)
+            elif send_button is not None:
+                method = IN_PAGE
+            else:
+                print(f"[{self.name}] switching chats in the page failed, loading the send URL: {switch_error.__class__.__name__}")
+        if send_button is None:
+            self.driver.get(url)
+            send_button = self._wait_for_send_button(self.timeout, message)
+        # Click as soon as the send button is usable instead of sleeping a fixed time
+        send_button.click()
+        if method == NAVIGATE:
+            self._mark_page()
+        return method
+
+    def close(self):
+        self.driver.quit()
+
+# Spreads messages over a pool of sessions, highest priority first, under a
+# global rate limit and a per-session one
+class Dispatcher:
+    def __init__(self, sessions, global_rate, global_burst=1):
+        self.sessions = sessions
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+
+    def dispatch(self, messages, outbox=None):
+        pending = queue.PriorityQueue()
+        for sequence, message in enumerate(messages):
+            priority = dispatch_priority(message.get('TYPE'))
+            pending.put((priority, sequence, message))
+
+        results = []
+        results_lock = threading.Lock()
+
+        def work(session):
+            while True:
+                try:
+                    _, _, message = pending.get_nowait()
+                except queue.Empty:
+                    return
+                if session.bucket is not None:
+                    session.bucket.acquire()
+                self.global_bucket.acquire()
+
+                if outbox is not None:
+                    outbox.mark_sending(message['KEY'])
+                started = time.perf_counter()
+                method = None
+                try:
+                    method = session.send(message['PHONE'], message['Message'])
+                    status, error = 'sent', ''
+                except Exception as e:
+                    status, error = 'failed', str(e)
+                elapsed = time.perf_counter() - started
+                if outbox is not None:
+                    if status == 'sent':
+                        outbox.mark_sent(message['KEY'])
+                    else:
+                        outbox.mark_failed(message['KEY'], error)
+                print(f"[{session.name}] {status} {message['PIC_NAME']} ({message.get('TYPE')}) in {elapsed:.1f}s {method or ''} {error}")
+
+                with results_lock:
+                    results.append({
+                        "PIC_NAME": message['PIC_NAME'],
+                        "PHONE": message['PHONE'],
+                        "TYPE": message.get('TYPE'),
+                        "SESSION": session.name,
+                        "STATUS": status,
+                        "ERROR": error,
+                        "METHOD": method,
+                        "SECONDS": elapsed,
+                        "AT": time.time()
+                    })
+
+        threads = [threading.Thread(target=work, args=(session,), name=session.name) for session in self.sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    # Send everything due in the outbox, waiting out retry backoffs until no
+    # message is pending or waiting for a retry
+    def dispatch_outbox(self, outbox):
+        results = []
+        while True:
+            due = outbox.due()
+            if due:
+                results.extend(self.dispatch(due, outbox))
+                continue
+            retry_at = outbox.next_retry_at()
+            if retry_at is None:
+                return results
+            time.sleep(max(0.0, retry_at - time.time()))
+
+# Append one JSON line per send attempt, for latency tracking across runs
+def append_latency_log(path, results):
+    with open(path, 'a', encoding='utf-8') as file:
+        for result in results:
+            file.write(json.dumps(result, default=str, ensure_ascii=False) + "\n")
+
+# Median and 95th percentile send time of each way a chat was opened
+def summarize_latency(results):
+    by_method = {}
+    for result in results:
+        if result['STATUS'] == 'sent':
+            by_method.setdefault(result['METHOD'], []).append(result['SECONDS'])
+    lines = []
+    for method, seconds in sorted(by_method.items()):
+        seconds.sort()
+        p95 = seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))]
+        lines.append(f"{method}: {len(seconds)} sent, median {seconds[len(seconds) // 2]:.2f}s, p95 {p95:.2f}s")
+    return lines
+
+# Rows of the Found sheet written by sms.py; pandas is only needed for this
+def load_found_messages(messages_path):
+    import pandas as pd
+    return pd.read_excel(messages_path, sheet_name='Found').to_dict('records')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send the messages in atm_problem_messages.xlsx over WhatsApp Web")
+    parser.add_argument('--messages', default='atm_problem_messages.xlsx',
+                        help="workbook with a Found sheet, empty to send only what the outbox already holds")
+    parser.add_argument('--sessions', type=int, default=1, help="number of logged-in browser sessions")
+    parser.add_argument('--profile-dir', default='wa_profiles', help="directory holding one Chrome profile per session")
+    parser.add_argument('--send-url', default=WHATSAPP_SEND_URL, help="send URL template with {phone} and {text}, e.g. a file:// URL of mock_whatsapp.html")
+    parser.add_argument('--global-rate', type=float, default=12.0, help="messages per minute across all sessions")
+    parser.add_argument('--session-rate', type=float, default=6.0, help="messages per minute per session")
+    parser.add_argument('--burst', type=int, default=1, help="messages a bucket may send back to back")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for the app or the send button after a page load")
+    parser.add_argument('--switch-timeout', type=float, default=10.0, help="seconds an in-page chat switch gets before the send URL is loaded instead")
+    parser.add_argument('--latency-log', default='dispatch_latency.jsonl', help="JSON lines file that gets one entry per send attempt, empty to disable")
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--outbox', default='outbox.db', help="delivery log used to skip messages already sent")
+    parser.add_argument('--max-attempts', type=int, default=5, help="sends to try before giving up on a message")
+    parser.add_argument('--retry-base', type=float, default=30.0, help="seconds before the first retry, doubled after each failure")
+    args = parser.parse_args(argv)
+
+    # Recording is idempotent, so rerunning after a crash only queues what is new
+    outbox = Outbox(args.outbox, args.max_attempts, args.retry_base)
+    interrupted = outbox.requeue_interrupted()
+    if interrupted:
+        print(f"Requeued {interrupted} messages interrupted mid-send")
+    if args.messages:
+        queued = outbox.record(load_found_messages(args.messages))
+        print(f"Queued {queued} new messages, outbox: {outbox.counts()}")
+    sessions = [
+        BrowserSession.open_chrome(
+            f"session-{i + 1}", os.path.join(args.profile_dir, f"session-{i + 1}"), args.headless,
+            send_url_template=args.send_url, timeout=args.timeout,
+            bucket=TokenBucket(args.session_rate / 60, args.burst), switch_timeout=args.switch_timeout
+        )
+        for i in range(args.sessions)
+    ]
+    try:
+        for session in sessions:
+            session.start()
+
+        dispatcher = Dispatcher(sessions, args.global_rate / 60, args.burst)
+        results = dispatcher.dispatch_outbox(outbox)
+        sent = sum(1 for result in results if result['STATUS'] == 'sent')
+        print(f"Sent {sent} messages in {len(results)} attempts, outbox: {outbox.counts()}")
+        for line in summarize_latency(results):
+            print(line)
+        if args.latency_log:
+            append_latency_log(args.latency_log, results)
+    finally:
+        for session in sessions:
+            session.close()
+        outbox.close()
+
+if __name__ == "__main__":
+    main()
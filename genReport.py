@@ -1,51 +1,227 @@
-import pandas as pd
-
-# Load the Excel file
-file_path = 'HISTORY.xlsx'
-df = pd.read_excel(file_path)
-
-# Convert the 'TANGGAL INPUT' column to datetime
-df['TANGGAL INPUT'] = pd.to_datetime(df['TANGGAL INPUT'], format='%d/%m/%Y %H:%M:%S')
-
-# Filter data for today only
-today_date = pd.to_datetime('today').normalize()
-df_today = df[df['TANGGAL INPUT'].dt.normalize() == today_date]
-
-# Convert the 'KETERANGAN' and 'STATUS' columns to strings after handling NaNs
-df_today['KETERANGAN'] = df_today['KETERANGAN'].fillna('').astype(str)
-df_today['PROGRES_PERBAIKAN_ATM'] = df_today['PROGRES_PERBAIKAN_ATM'].fillna('').astype(str)
-
-# Define the sections
-sections = {
-    "*Berikut List ATM down hingga sore hari ini:*": df_today[
-        (df_today['TIPE_PERMASALAHAN'] == 'Problem Down') & (df_today['PROGRES_PERBAIKAN_ATM'].isnull())
-    ],
-    "*Berikut List ATM yang belum dapat respond dari pihak pengelola:*": df_today[
-        (df_today['KETERANGAN'] == '') & (df_today['PROGRES_PERBAIKAN_ATM'] == '')
-    ],
-    "*Berikut List ATM yang sedang dalam proses pengerjaan:*": df_today[
-        (df_today['KETERANGAN'].str.contains('in progress', case=False)) & (df_today['PROGRES_PERBAIKAN_ATM'] == '')
-    ],
-    "*Berikut List ATM yang mendapatkan error hingga sore ini namun setelah dilakukan pengecekan oleh pihak cabang, ATM berjalan normal:*": df_today[
-        (df_today['KETERANGAN'] != '') & (~df_today['KETERANGAN'].str.contains('in progress', case=False)) & (df_today['PROGRES_PERBAIKAN_ATM'] == '')
-    ]
-}
-
-# Construct the report
-report = "Selamat sore, izin untuk report status ATM hingga sore ini\n\n"
-
-for section_title, data in sections.items():
-    report += section_title + "\n\n"
-    if not data.empty:
-        for idx, (_, row) in enumerate(data.iterrows(), start=1):
-            report += f"{idx}. {row['NAMA_ATM']} {row['PERMASALAHAN']}\n"
+import argparse
+import os
+import pickle
+from datetime import date, datetime
+
+import numpy as np
+
+from atomic_file import atomic_write
+
+REPORT_GREETING = "Selamat sore, izin untuk report status ATM hingga sore ini"
+
+# Report sections in the order they are printed
+SECTION_TITLES = [
+    "*Berikut List ATM down hingga sore hari ini:*",
+    "*Berikut List ATM yang belum dapat respond dari pihak pengelola:*",
+    "*Berikut List ATM yang sedang dalam proses pengerjaan:*",
+    "*Berikut List ATM yang mendapatkan error hingga sore ini namun setelah dilakukan pengecekan oleh pihak cabang, ATM berjalan normal:*"
+]
+
+# The only history columns the report reads; a row is reclassified when one of them changes
+REPORT_COLUMNS = ['TANGGAL INPUT', 'NAMA_ATM', 'TIPE_PERMASALAHAN', 'PERMASALAHAN', 'KETERANGAN', 'PROGRES_PERBAIKAN_ATM']
+
+# Rows a month sheet of history.xlsx may hold; workbook rows are keyed past
+# every row of the months before theirs
+WORKBOOK_MONTH_ROWS = 10 ** 7
+
+# The report columns of the given months in the history store, indexed by row id
+def load_store_months(history_db_path, months):
+    from history_store import HistoryStore, history_sheet_name
+    history_store = HistoryStore(history_db_path)
+    try:
+        return [history_store.load_month(history_sheet_name(month))[REPORT_COLUMNS] for month in months]
+    finally:
+        history_store.close()
+
+# The report columns of the given months in history.xlsx, for running without
+# a store; rows are keyed by month and position, which keeps sheet order
+def load_workbook_months(history_xlsx_path, months):
+    import pandas as pd
+    from history_store import history_sheet_name
+    month_frames = []
+    with pd.ExcelFile(history_xlsx_path) as workbook:
+        for month in months:
+            if history_sheet_name(month) not in workbook.sheet_names:
+                continue
+            month_df = workbook.parse(history_sheet_name(month)).reindex(columns=REPORT_COLUMNS)
+            month_df.index = (month.year * 12 + month.month) * WORKBOOK_MONTH_ROWS + np.arange(len(month_df), dtype='int64')
+            month_frames.append(month_df)
+    return month_frames
+
+# Day and section membership of every history row, plus a hash per row so a
+# changed history source only costs reclassifying the rows that actually
+# changed. Rows are keyed by their id in the store, or by month and position
+# in the workbook, which also gives report order.
+class ReportIndex:
+    def __init__(self):
+        self.signature = None  # (path, mtime, size, months) of the history source last indexed
+        self.row_keys = np.array([], dtype='int64')
+        self.row_hashes = np.array([], dtype='uint64')
+        self.rows = {}  # row key -> (day, section numbers)
+        self.days = {}  # day -> section number -> {row key: report line}
+
+    # Only plain containers are pickled, so the file loads whether this module runs as a script or is imported
+    @classmethod
+    def load(cls, index_path):
+        index = cls()
+        try:
+            with open(index_path, 'rb') as file:
+                saved = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return index
+        # An index saved by an older layout is rebuilt from scratch
+        if saved.keys() == index.__dict__.keys():
+            index.__dict__.update(saved)
+        return index
+
+    def save(self, index_path):
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        with atomic_write(index_path, 'wb') as file:
+            pickle.dump(self.__dict__, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Re-read the months starting on the given dates with load_months, from
+    # the history store or the workbook at history_path, only when that file
+    # changed on disk; returns how many rows were reclassified. pandas is
+    # imported only then, so a report from an unchanged source starts fast.
+    def refresh(self, history_path, months, load_months=load_store_months):
+        file_stat = os.stat(history_path)
+        signature = (os.path.abspath(history_path), file_stat.st_mtime_ns, file_stat.st_size, tuple(months))
+        if signature == self.signature:
+            return 0
+        import pandas as pd
+        month_frames = [month_df for month_df in load_months(history_path, months) if len(month_df)]
+        if month_frames:
+            history_df = pd.concat(month_frames)
+        else:
+            history_df = pd.DataFrame(columns=REPORT_COLUMNS, index=pd.Index([], dtype='int64'))
+        updated = self.update(history_df)
+        self.signature = signature
+        return updated
+
+    # history_df is indexed by store id
+    def update(self, history_df):
+        import pandas as pd
+        keys = history_df.index.to_numpy(dtype='int64')
+        hashes = pd.util.hash_pandas_object(history_df[REPORT_COLUMNS], index=False).to_numpy()
+        previous = pd.Index(self.row_keys).get_indexer(keys)
+        known = previous >= 0
+        changed = np.flatnonzero(~known)
+        changed = np.union1d(changed, np.flatnonzero(known)[hashes[known] != self.row_hashes[previous[known]]])
+
+        # Rows gone from the store, or from the months now reported, leave the index
+        for key in self.row_keys[~np.isin(self.row_keys, keys)].tolist():
+            self._remove(key)
+
+        if len(changed):
+            days, membership, lines = classify_rows(history_df.iloc[changed])
+            for key, day, sections, line in zip(keys[changed].tolist(), days, membership, lines):
+                self._remove(key)
+                section_numbers = tuple(np.flatnonzero(sections).tolist())
+                if day is None or not section_numbers:
+                    continue
+                self.rows[key] = (day, section_numbers)
+                day_sections = self.days.setdefault(day, {})
+                for section_number in section_numbers:
+                    day_sections.setdefault(section_number, {})[key] = line
+
+        self.row_keys = keys
+        self.row_hashes = hashes
+        return len(changed)
+
+    def _remove(self, key):
+        entry = self.rows.pop(key, None)
+        if entry is None:
+            return
+        day, section_numbers = entry
+        for section_number in section_numbers:
+            del self.days[day][section_number][key]
+
+    # Report lines of each section for rows input between start and end, inclusive, in sheet order
+    def sections(self, start, end):
+        section_lines = [[] for _ in SECTION_TITLES]
+        for day, day_sections in self.days.items():
+            if start <= day <= end:
+                for section_number, lines in day_sections.items():
+                    section_lines[section_number].extend(lines.items())
+        return [[line for _, line in sorted(lines)] for lines in section_lines]
+
+# Input day, section membership matrix and report line of each row, computed
+# column-wise over the frame
+def classify_rows(history_df):
+    import pandas as pd
+    input_at = pd.to_datetime(history_df['TANGGAL INPUT'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+    days = [None if pd.isna(value) else value.date() for value in input_at]
+
+    keterangan = history_df['KETERANGAN'].fillna('').astype(str)
+    no_progress = history_df['PROGRES_PERBAIKAN_ATM'].fillna('').astype(str) == ''
+    in_progress = keterangan.str.contains('in progress', case=False, regex=False)
+    membership = np.column_stack([
+        ((history_df['TIPE_PERMASALAHAN'] == 'Problem Down') & no_progress).to_numpy(),
+        ((keterangan == '') & no_progress).to_numpy(),
+        (in_progress & no_progress).to_numpy(),
+        ((keterangan != '') & ~in_progress & no_progress).to_numpy()
+    ])
+    lines = (history_df['NAMA_ATM'].astype(str) + ' ' + history_df['PERMASALAHAN'].astype(str)).tolist()
+    return days, membership, lines
+
+# First day of every month from start to end, inclusive
+def months_between(start, end):
+    months = []
+    month = date(start.year, start.month, 1)
+    while month <= end:
+        months.append(month)
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return months
+
+# Afternoon report text, assembled from parts and joined once
+def build_report(section_lines):
+    parts = [REPORT_GREETING, "\n\n"]
+    for section_title, lines in zip(SECTION_TITLES, section_lines):
+        parts += [section_title, "\n\n"]
+        if lines:
+            parts += [f"{idx}. {line}\n" for idx, line in enumerate(lines, start=1)]
+        else:
+            parts.append("Tidak ada data.\n")
+        parts.append("\n")
+    return "".join(parts)
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the afternoon ATM status report from the history store or workbook")
+    parser.add_argument('--date', type=parse_date, default=date.today(), help="first input day to report, YYYY-MM-DD (default today)")
+    parser.add_argument('--until', type=parse_date, help="last input day to report, YYYY-MM-DD (default --date)")
+    parser.add_argument('--history-db', default='history.db', help="history store written by sms.py, empty to read --history-xlsx")
+    parser.add_argument('--history-xlsx', default='history.xlsx', help="history workbook, read when there is no history store")
+    parser.add_argument('--output', default='ATM_Report.txt', help="report text file")
+    parser.add_argument('--index', default=os.path.join('.refcache', 'report_index.pkl'), help="saved section index")
+    args = parser.parse_args(argv)
+
+    # sms.py keeps history in the store, or in the workbook alone when run with --history-db ''
+    if args.history_db and os.path.exists(args.history_db):
+        history_path, load_months = args.history_db, load_store_months
+    elif os.path.exists(args.history_xlsx):
+        history_path, load_months = args.history_xlsx, load_workbook_months
     else:
-        report += "Tidak ada data.\n"
-    report += "\n"
+        parser.error(f"no history found: neither the store {args.history_db or '(none)'} nor the workbook {args.history_xlsx} exists")
+
+    # The saved index is brought up to date with only the rows changed since the last run
+    index = ReportIndex.load(args.index)
+    indexed_signature = index.signature
+    until = args.until or args.date
+    updated = index.refresh(history_path, months_between(args.date, until), load_months)
+    if index.signature != indexed_signature:
+        index.save(args.index)
+    print(f"Reclassified {updated} history rows")
+
+    report = build_report(index.sections(args.date, until))
+
+    # Save the report to a text file
+    with open(args.output, 'w') as file:
+        file.write(report)
 
-# Save the report to a text file
-report_path = 'ATM_Report.txt'
-with open(report_path, 'w') as file:
-    file.write(report)
+    print(f"Report saved to {args.output}")
 
-print(f"Report saved to {report_path}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Columns of a month sheet in history.xlsx, in workbook order
+HISTORY_COLUMNS = [
+    "TANGGAL INPUT", "HARI", "TANGGAL", "JAM", "FREQUENCY", "ID_ATM", "MERK_ATM", "NAMA_ATM",
+    "TIPE_PERMASALAHAN", "PERMASALAHAN", "TINDAK LANJUT OFFICER FDS", "TINDAK LANJUT PIC",
+    "KETERANGAN", "PROGRES_PERBAIKAN_ATM", "PIC", "Unit Kerja", "Nomor Telepon", "UPDATED_AT", "STATUS"
+]
+
+months_in_indonesian = {
+    '01': 'Januari',
+    '02': 'Februari',
+    '03': 'Maret',
+    '04': 'April',
+    '05': 'Mei',
+    '06': 'Juni',
+    '07': 'Juli',
+    '08': 'Agustus',
+    '09': 'September',
+    '10': 'Oktober',
+    '11': 'November',
+    '12': 'Desember'
+}
+
+# Month sheet of history.xlsx, and BULAN in the store, that holds records for the given time
+def history_sheet_name(now):
+    return f"{months_in_indonesian[now.strftime('%m')]} {now.strftime('%Y')}"
+
+# Columns only officers fill in; sms.py itself only ever sets PROGRES_PERBAIKAN_ATM to DONE
+MANUAL_COLUMNS = ["TINDAK LANJUT OFFICER FDS", "TINDAK LANJUT PIC", "KETERANGAN", "PROGRES_PERBAIKAN_ATM"]
+
+# Store id of each row in an exported workbook, to match officer edits back to it
+ROW_ID_COLUMN = 'id'
+
+# UPDATED_AT is stored sortable; values that never parsed are kept as written
+STORED_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+SHEET_DATETIME_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+INSERT_SQL = (
+    f"INSERT INTO history (BULAN, {', '.join(_quote(column) for column in HISTORY_COLUMNS)}) "
+    f"VALUES (?{', ?' * len(HISTORY_COLUMNS)})"
+)
+
+# ID_ATM of a history.xlsx cell as digits. A blank cell is NULL, and text
+# that isn't a number is kept as written, like an unparseable UPDATED_AT.
+def _sheet_id_atm(value):
+    if pd.isna(value) or not str(value).strip():
+        return None
+    try:
+        return f"{int(value)}"
+    except ValueError:
+        return value
+
+# Convert a pandas/numpy cell into something sqlite3 can bind
+def _sql_value(column, value):
+    if value is None:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if value is pd.NaT:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime(STORED_DATETIME_FORMAT if column == "UPDATED_AT" else SHEET_DATETIME_FORMAT)
+    if isinstance(value, np.generic):
+        return _sql_value(column, value.item())
+    return value
+
+# History rows of every month in one SQLite file. Each run reads its month,
+# then inserts new problems and updates changed rows in a single transaction
+# instead of rewriting the whole workbook.
+class HistoryStore:
+    def __init__(self, path='history.db'):
+        self.path = path
+        # Reference data is prefetched on a worker thread, so the connection may cross threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._create_schema()
+
+    def _create_schema(self):
+        columns = ", ".join(
+            f"{_quote(column)} INTEGER" if column == "FREQUENCY" else f"{_quote(column)} TEXT"
+            for column in HISTORY_COLUMNS
+        )
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, BULAN TEXT NOT NULL, {columns})")
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS history_problem_key '
+                'ON history (BULAN, ID_ATM, TIPE_PERMASALAHAN, PERMASALAHAN, UPDATED_AT)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS history_problem_name '
+                'ON history (BULAN, NAMA_ATM, TIPE_PERMASALAHAN, PERMASALAHAN)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS history_updated_at ON history (UPDATED_AT)')
+
+    def close(self):
+        self.connection.close()
+
+    # Changes whenever another connection, e.g. another process, commits to
+    # the store; this connection's own commits leave it as it is
+    def data_version(self):
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def is_empty(self):
+        return self.connection.execute("SELECT 1 FROM history LIMIT 1").fetchone() is None
+
+    def months(self):
+        return [row[0] for row in self.connection.execute("SELECT BULAN FROM history GROUP BY BULAN ORDER BY MIN(id)")]
+
+    # One month as a DataFrame indexed by row id, shaped like a history.xlsx sheet
+    def load_month(self, month):
+        history_df = pd.read_sql_query(
+            "SELECT * FROM history WHERE BULAN = ? ORDER BY id",
+            self.connection, params=(month,), index_col='id'
+        ).drop(columns=["BULAN"])
+        updated_at = pd.to_datetime(history_df["UPDATED_AT"], format=STORED_DATETIME_FORMAT, errors='coerce')
+        history_df["UPDATED_AT"] = updated_at.astype(object).where(updated_at.notna(), history_df["UPDATED_AT"])
+        history_df.index.name = None
+        return history_df
+
+    # Apply one run's changes atomically and return the ids given to the new rows
+    def apply_changes(self, month, new_records, frequency_updates, done_ids):
+        new_ids = []
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE history SET FREQUENCY = ?, UPDATED_AT = ? WHERE id = ?",
+                [(_sql_value("FREQUENCY", frequency), _sql_value("UPDATED_AT", updated_at), int(row_id))
+                 for row_id, frequency, updated_at in frequency_updates]
+            )
+            self.connection.executemany(
+                "UPDATE history SET PROGRES_PERBAIKAN_ATM = 'DONE' WHERE id = ?",
+                [(int(row_id),) for row_id in done_ids]
+            )
+            for record in new_records:
+                values = [month] + [_sql_value(column, record.get(column)) for column in HISTORY_COLUMNS]
+                new_ids.append(self.connection.execute(INSERT_SQL, values).lastrowid)
+        return new_ids
+
+    # One-time import of every month sheet in an existing history.xlsx
+    def import_excel(self, excel_path):
+        sheets = pd.read_excel(excel_path, sheet_name=None)
+        imported = 0
+        with self.connection:
+            for month, sheet_df in sheets.items():
+                sheet_df = sheet_df.reindex(columns=HISTORY_COLUMNS)
+                updated_at = pd.to_datetime(sheet_df["UPDATED_AT"], format=SHEET_DATETIME_FORMAT, errors='coerce')
+                sheet_df["UPDATED_AT"] = updated_at.astype(object).where(updated_at.notna(), sheet_df["UPDATED_AT"])
+                sheet_df["ID_ATM"] = sheet_df["ID_ATM"].map(_sheet_id_atm)
+                rows = (
+                    [month] + [_sql_value(column, value) for column, value in zip(HISTORY_COLUMNS, row)]
+                    for row in sheet_df.itertuples(index=False, name=None)
+                )
+                self.connection.executemany(INSERT_SQL, rows)
+                imported += len(sheet_df)
+        return imported
+
+    # Write every month to its own sheet, on demand, with each row's store id first
+    def export_excel(self, excel_path):
+        with pd.ExcelWriter(excel_path) as writer:
+            for month in self.months():
+                self.load_month(month).to_excel(writer, sheet_name=month, index_label=ROW_ID_COLUMN)
+
+    # Take the officer columns of a workbook written by export_excel back into
+    # the store, matched by row id. Blank cells are skipped, so an export made
+    # before a later run marked a row DONE can't clear it again. Returns how
+    # many cells changed.
+    def import_manual_columns(self, excel_path):
+        sheets = pd.read_excel(excel_path, sheet_name=None)
+        changed = 0
+        with self.connection:
+            for month, sheet_df in sheets.items():
+                if ROW_ID_COLUMN not in sheet_df.columns:
+                    continue
+                row_ids = pd.to_numeric(sheet_df[ROW_ID_COLUMN], errors='coerce')
+                for column in MANUAL_COLUMNS:
+                    if column not in sheet_df.columns:
+                        continue
+                    values = sheet_df[column]
+                    filled = row_ids.notna() & values.notna() & (values.astype(str).str.strip() != '')
+                    changed += self.connection.executemany(
+                        f"UPDATE history SET {_quote(column)} = ? WHERE id = ? AND BULAN = ? AND {_quote(column)} IS NOT ?",
+                        [(_sql_value(column, value), int(row_id), month, _sql_value(column, value))
+                         for row_id, value in zip(row_ids[filled], values[filled])]
+                    ).rowcount
+        return changed
@@ -0,0 +1,105 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from atomic_file import atomic_write
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module
+    resource = None
+
+# Highest resident set size of this process so far, or None where the platform can't tell
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Wall time, memory and item counts for each stage of one sms.py run, written
+# as a line of a JSON run log and as a Prometheus textfile
+class RunMetrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.stages = []
+        self.tracemalloc_top = []
+
+    # Time one stage; the yielded dict collects its counts (lines, rows, not found, ...)
+    @contextmanager
+    def stage(self, name):
+        counts = {}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.stages.append({
+                "stage": name,
+                "seconds": time.perf_counter() - started,
+                "peak_rss_bytes": peak_rss_bytes(),
+                "traced_peak_bytes": tracemalloc.get_traced_memory()[1] if tracing else None,
+                "counts": counts
+            })
+
+    # Keep the biggest allocation sites when tracemalloc was switched on for this run
+    def capture_tracemalloc_top(self, limit=10):
+        if tracemalloc.is_tracing():
+            statistics = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+            self.tracemalloc_top = [str(statistic) for statistic in statistics]
+
+    def to_dict(self):
+        return {
+            "started_at": self.started_at,
+            "seconds": sum(stage["seconds"] for stage in self.stages),
+            "stages": self.stages,
+            "tracemalloc_top": self.tracemalloc_top
+        }
+
+    def append_json_log(self, path):
+        with open(path, 'a') as file:
+            file.write(json.dumps(self.to_dict(), default=str) + "\n")
+
+    # Written to a temp file and renamed so node_exporter never reads half a file
+    def write_prometheus(self, path):
+        lines = [
+            "# HELP sms_last_run_timestamp_seconds Start time of the last sms.py run.",
+            "# TYPE sms_last_run_timestamp_seconds gauge",
+            f"sms_last_run_timestamp_seconds {self.started_at:.3f}",
+            "# HELP sms_stage_duration_seconds Wall time of each stage in the last run.",
+            "# TYPE sms_stage_duration_seconds gauge"
+        ]
+        lines += [f'sms_stage_duration_seconds{{stage="{stage["stage"]}"}} {stage["seconds"]:.6f}' for stage in self.stages]
+
+        lines += [
+            "# HELP sms_stage_peak_rss_bytes Process peak resident memory at the end of each stage.",
+            "# TYPE sms_stage_peak_rss_bytes gauge"
+        ]
+        lines += [
+            f'sms_stage_peak_rss_bytes{{stage="{stage["stage"]}"}} {stage["peak_rss_bytes"]}'
+            for stage in self.stages if stage["peak_rss_bytes"] is not None
+        ]
+
+        lines += [
+            "# HELP sms_stage_traced_peak_bytes Peak Python heap during each stage, with --trace-memory.",
+            "# TYPE sms_stage_traced_peak_bytes gauge"
+        ]
+        lines += [
+            f'sms_stage_traced_peak_bytes{{stage="{stage["stage"]}"}} {stage["traced_peak_bytes"]}'
+            for stage in self.stages if stage["traced_peak_bytes"] is not None
+        ]
+
+        lines += [
+            "# HELP sms_stage_items Items handled by each stage in the last run.",
+            "# TYPE sms_stage_items gauge"
+        ]
+        lines += [
+            f'sms_stage_items{{stage="{stage["stage"]}",item="{item}"}} {value}'
+            for stage in self.stages for item, value in stage["counts"].items()
+        ]
+
+        with atomic_write(path) as file:
+            file.write("\n".join(lines) + "\n")
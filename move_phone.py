@@ -1,40 +1,51 @@
-import pandas as pd
-
-# Load the Excel files
-master_cabang_df = pd.read_excel('master_cabang_demo.xlsx')
-head_cabang_df = pd.read_excel('head_cabang_demo.xlsx')
-
-# Clean the NAMA_CABANG column in master_cabang_df, strip and convert to lowercase
-master_cabang_df['cleaned_nama_cabang'] = master_cabang_df['NAMA_CABANG'].str.split('/').str[0].str.strip().str.lower()
-
-# Strip and convert the cabang column to lowercase
-head_cabang_df['cabang'] = head_cabang_df['cabang'].str.strip().str.lower()
-
-# Create a function to get the correct PIC_NAME and PHONE based on the cabang type
-def get_pic_and_phone(row):
-    cabang_name = row['cleaned_nama_cabang']
-    if pd.isna(cabang_name):
-        return pd.Series(['not found', 'not found'])
-    if 'capem' in cabang_name:
-        pic_name = row['PIC_NAME_CAPEM']
-        phone = row['PHONE_CAPEM']
-    else:
-        pic_name = row['PIC_NAME_CABANG']
-        phone = row['PHONE_CABANG']
-    return pd.Series([pic_name if pd.notna(pic_name) else 'not found', phone if pd.notna(phone) else 'not found'])
+import argparse
 
-# Merge the dataframes on the cleaned_nama_cabang and cabang columns
-merged_df = pd.merge(master_cabang_df, head_cabang_df, left_on='cleaned_nama_cabang', right_on='cabang', how='left')
-
-# Apply the function to get the correct PIC_NAME and PHONE
-master_cabang_df[['PIC_NAME', 'PHONE']] = merged_df.apply(get_pic_and_phone, axis=1)
-
-# Convert PHONE to string and add '+62' if it does not already start with '+62' and if it's not 'not found'
-master_cabang_df['PHONE'] = master_cabang_df['PHONE'].astype(str).apply(lambda x: f'+62{x}' if x != 'not found' and not x.startswith('+62') else x)
-
-# Drop the temporary cleaned_nama_cabang column
-master_cabang_df.drop(columns=['cleaned_nama_cabang'], inplace=True)
+import pandas as pd
 
-# Save the updated master_cabang_df to a new Excel file
-output_path = 'updated_master_cabang_new.xlsx'
-master_cabang_df.to_excel(output_path, index=False)
+from phone_number import normalize_phones
+
+# Set PIC_NAME and PHONE of every branch in the master list from the branch
+# heads list: CAPEM branches take the CAPEM columns, the rest the CABANG ones.
+# Selection is done with masks over whole columns rather than row by row.
+def resolve_branch_pics(master_cabang_df, head_cabang_df):
+    # Clean the NAMA_CABANG column in master_cabang_df, strip and convert to lowercase
+    cleaned_nama_cabang = master_cabang_df['NAMA_CABANG'].str.split('/').str[0].str.strip().str.lower()
+
+    # Strip and convert the cabang column to lowercase; the first row wins for a branch listed twice
+    head_cabang_df = head_cabang_df.assign(cabang=head_cabang_df['cabang'].str.strip().str.lower())
+    head_cabang_df = head_cabang_df.drop_duplicates('cabang')
+
+    # Merge the dataframes on the cleaned_nama_cabang and cabang columns
+    merged_df = pd.merge(
+        cleaned_nama_cabang.rename('cleaned_nama_cabang').to_frame(), head_cabang_df,
+        left_on='cleaned_nama_cabang', right_on='cabang', how='left'
+    )
+
+    is_capem = merged_df['cleaned_nama_cabang'].str.contains('capem', regex=False, na=False)
+    has_cabang = merged_df['cleaned_nama_cabang'].notna()
+    pic_name = merged_df['PIC_NAME_CAPEM'].where(is_capem, merged_df['PIC_NAME_CABANG'])
+    phone = normalize_phones(merged_df['PHONE_CAPEM'].where(is_capem, merged_df['PHONE_CABANG']))
+
+    master_cabang_df['PIC_NAME'] = pic_name.where(has_cabang & pic_name.notna(), 'not found').to_numpy()
+    master_cabang_df['PHONE'] = phone.where(has_cabang & phone.notna(), 'not found').to_numpy()
+    return master_cabang_df
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill in PIC_NAME and PHONE of every branch from the branch heads list")
+    parser.add_argument('--master', default='master_cabang_demo.xlsx', help="branch master list")
+    parser.add_argument('--heads', default='head_cabang_demo.xlsx', help="branch heads list")
+    parser.add_argument('--output', default='updated_master_cabang_new.xlsx', help="updated branch master list")
+    args = parser.parse_args(argv)
+
+    # Load the Excel files
+    master_cabang_df = pd.read_excel(args.master)
+    head_cabang_df = pd.read_excel(args.heads)
+
+    resolve_branch_pics(master_cabang_df, head_cabang_df)
+
+    # Save the updated master_cabang_df to a new Excel file
+    master_cabang_df.to_excel(args.output, index=False)
+    print(f"Branch PICs saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import math
+import re
+from collections import defaultdict
+
+NON_ALNUM_PATTERN = re.compile(r'[^0-9a-z]+')
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# Casefolded, punctuation as spaces, runs of spaces collapsed
+def normalize_name(name):
+    return NON_ALNUM_PATTERN.sub(' ', name.casefold()).strip()
+
+# Trigrams of each word padded like pg_trgm: "bpd" -> "  b", " bp", "bpd", "pd "
+def trigrams(normalized_name):
+    grams = set()
+    for word in normalized_name.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+# Numbers in a name tell ATMs apart ("Cabang 22" vs "Cabang 222"), so they must agree exactly
+def numbers(normalized_name):
+    return NUMBER_PATTERN.findall(normalized_name)
+
+# Edit distance of a and b, or None as soon as it must exceed max_distance.
+# Only the diagonal band of width 2 * max_distance + 1 is filled in.
+def bounded_levenshtein(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        low = max(1, i - max_distance)
+        high = min(len(b), i + max_distance)
+        current = [math.inf] * (len(b) + 1)
+        current[0] = i if i <= max_distance else math.inf
+        for j in range(low, high + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != b[j - 1])
+            )
+        if min(current[low - 1:high + 1]) > max_distance:
+            return None
+        previous = current
+    distance = previous[len(b)]
+    return distance if distance <= max_distance else None
+
+# Outcome of a fuzzy lookup: the record when one name clearly wins, and the
+# scored candidates either way so near misses can be reported
+class NameMatch:
+    def __init__(self, record, candidates):
+        self.record = record
+        self.candidates = candidates  # [(NAMA_ATM, score)], best first
+
+    @property
+    def ambiguous(self):
+        return self.record is None and bool(self.candidates)
+
+    def describe(self):
+        return ', '.join(f"{name} ({score:.2f})" for name, score in self.candidates)
+
+# Trigram postings over NAMA_ATM. A lookup only reads the postings of the
+# query's rarest trigrams (enough of them that any name above min_overlap
+# must share one), filters those candidates on trigram Jaccard, and rescores
+# the best few with an edit distance that gives up past the score floor.
+# A feed name with words appended, e.g. "ATM X (node down)", is also scored
+# on its leading words against a shorter NAMA_ATM. Names whose numbers
+# differ are never matched, however close the rest is.
+class TrigramIndex:
+    def __init__(self, records, min_overlap=0.5, min_score=0.8, margin=0.05, rescore_limit=10, report_limit=3):
+        self.min_overlap = min_overlap  # trigram Jaccard a candidate needs
+        self.min_score = min_score  # 1 - edit distance / length a match needs
+        self.margin = margin  # the best match must beat the runner-up by more than this, unless it is exact
+        self.rescore_limit = rescore_limit
+        self.report_limit = report_limit  # candidates kept for reporting
+        self.names = []  # normalized name per entry
+        self.word_counts = []
+        self.grams = []  # trigram set per entry
+        self.records = []
+        self.postings = defaultdict(list)  # trigram -> entry numbers
+        self.by_normalized = defaultdict(list)
+
+        for record in records:
+            nama_atm = record['NAMA_ATM']
+            if not isinstance(nama_atm, str):
+                continue
+            normalized = normalize_name(nama_atm)
+            entry = len(self.records)
+            self.names.append(normalized)
+            self.word_counts.append(len(normalized.split()))
+            self.grams.append(trigrams(normalized))
+            self.records.append(record)
+            self.by_normalized[normalized].append(entry)
+            for gram in self.grams[entry]:
+                self.postings[gram].append(entry)
+
+    def _candidates(self, query_grams):
+        known = sorted((gram for gram in query_grams if gram in self.postings), key=lambda gram: len(self.postings[gram]))
+        required = math.ceil(self.min_overlap * len(query_grams))
+        if not required or len(known) < required:
+            return set()
+        candidates = set()
+        for gram in known[:len(known) - required + 1]:
+            candidates.update(self.postings[gram])
+        return candidates
+
+    # 1 - edit distance / length, or None below min_score
+    def _similarity(self, a, b):
+        length = max(len(a), len(b))
+        distance = bounded_levenshtein(a, b, int((1 - self.min_score) * length + 1e-9))
+        return None if distance is None else 1 - distance / length
+
+    def lookup(self, atm_name):
+        normalized = normalize_name(atm_name)
+        exact = self.by_normalized.get(normalized, [])
+        if len(exact) == 1:
+            return NameMatch(self.records[exact[0]], [(self.records[exact[0]]['NAMA_ATM'], 1.0)])
+
+        query_words = normalized.split()
+        query_grams = trigrams(normalized)
+        overlaps = []
+        for entry in self._candidates(query_grams):
+            shared = len(query_grams & self.grams[entry])
+            jaccard = shared / (len(query_grams) + len(self.grams[entry]) - shared)
+            if jaccard >= self.min_overlap:
+                overlaps.append((jaccard, entry))
+        overlaps.sort(key=lambda item: (-item[0], item[1]))
+
+        # Numbers are compared on the whole feed name, so dropping trailing
+        # words can never drop the number that tells two ATMs apart
+        query_numbers = numbers(normalized)
+        scored = []
+        for _, entry in overlaps[:self.rescore_limit]:
+            if numbers(self.names[entry]) != query_numbers:
+                continue
+            targets = [normalized]
+            if len(query_words) > self.word_counts[entry]:
+                targets.append(' '.join(query_words[:self.word_counts[entry]]))
+            scores = [self._similarity(target, self.names[entry]) for target in targets]
+            scores = [score for score in scores if score is not None]
+            if scores:
+                scored.append((max(scores), entry))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+
+        candidates = [(self.records[entry]['NAMA_ATM'], score) for score, entry in scored[:self.report_limit]]
+        if scored and (len(scored) == 1 or scored[0][0] - scored[1][0] > self.margin or scored[1][0] < scored[0][0] == 1.0):
+            return NameMatch(self.records[scored[0][1]], candidates)
+        return NameMatch(None, candidates)
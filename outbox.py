@@ -0,0 +1,145 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from phone_number import whatsapp_phone
+
+# Delivery states of an outbox row
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'  # will be retried after its backoff
+DEAD = 'dead'  # gave up after max_attempts
+
+# Lower sends first; types not listed go last. A message for several
+# problems is sent as its most urgent one.
+DISPATCH_PRIORITY = {
+    'Problem Down': 0,
+    'NPM Problem': 1,
+    'Problem Hardware': 2,
+    'Problem Supply Out': 3,
+    'Saldo di Bawah Pagu': 4
+}
+
+def dispatch_priority(error_type):
+    return DISPATCH_PRIORITY.get(error_type, len(DISPATCH_PRIORITY))
+
+# Same PIC, phone and message text within one batch (one sms.py run) always
+# map to the same key, so recording a batch twice never queues a second copy.
+# The same text in a later batch is a new message: most texts carry no date,
+# and a problem that comes back must reach its PIC again. Rows without a
+# batch, from a Found sheet older than the BATCH column, keep the old key.
+# The phone is keyed as WhatsApp digits: the same PHONE cell comes back from
+# Excel as 628120000010.0 or 628120000010 depending on its column's blanks.
+def idempotency_key(pic_name, phone, message, batch=None):
+    body_hash = hashlib.sha256(message.encode('utf-8')).hexdigest()
+    scope = f"{pic_name}\x1f{whatsapp_phone(phone)}\x1f{body_hash}"
+    if batch is not None:
+        scope = f"{scope}\x1f{batch}"
+    return hashlib.sha256(scope.encode('utf-8')).hexdigest()
+
+# BATCH as read back from a Found sheet; an empty cell is NaN
+def clean_batch(batch):
+    if batch is None or (isinstance(batch, float) and batch != batch):
+        return None
+    return str(batch)
+
+# Every generated message with its delivery state, in SQLite, so a crashed or
+# interrupted send run resumes with only the messages not yet delivered
+class Outbox:
+    def __init__(self, path='outbox.db', max_attempts=5, retry_base=30.0, retry_cap=900.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base  # seconds before the first retry, doubled after each failure
+        self.retry_cap = retry_cap
+        # Dispatcher workers share the connection, one statement at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "key TEXT PRIMARY KEY, pic_name TEXT, phone TEXT, type TEXT, message TEXT, "
+                "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0, "
+                "last_error TEXT, created_at REAL NOT NULL, sent_at REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_attempt_at)")
+
+    def close(self):
+        self.connection.close()
+
+    # A row left in 'sending' by a dispatcher that crashed mid-send goes back
+    # to pending, rather than risk losing it. Only for a dispatcher starting
+    # up: anything else opening the outbox may run beside one that is sending.
+    def requeue_interrupted(self):
+        with self.lock, self.connection:
+            return self.connection.execute("UPDATE outbox SET state = ? WHERE state = ?", (PENDING, SENDING)).rowcount
+
+    # Queue messages shaped like the Found sheet; returns how many were new
+    def record(self, messages):
+        now = time.time()
+        rows = [
+            (idempotency_key(message['PIC_NAME'], message['PHONE'], message['Message'], clean_batch(message.get('BATCH'))),
+             message['PIC_NAME'], str(message['PHONE']), message.get('TYPE'), message['Message'], PENDING, now)
+            for message in messages
+        ]
+        with self.lock, self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO outbox (key, pic_name, phone, type, message, state, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            return self.connection.total_changes - before
+
+    # Messages ready to send now, oldest first, shaped like Found rows plus their KEY
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, pic_name, phone, type, message FROM outbox "
+                "WHERE state IN (?, ?) AND next_attempt_at <= ? ORDER BY created_at, rowid",
+                (PENDING, FAILED, now)
+            ).fetchall()
+        return [
+            {"KEY": key, "PIC_NAME": pic_name, "PHONE": phone, "TYPE": type_, "Message": message}
+            for key, pic_name, phone, type_, message in rows
+        ]
+
+    # Earliest time a failed message becomes due again, or None if nothing is waiting
+    def next_retry_at(self):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE state = ?", (FAILED,)
+            ).fetchone()
+        return row[0]
+
+    def mark_sending(self, key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE outbox SET state = ?, attempts = attempts + 1 WHERE key = ?", (SENDING, key)
+            )
+
+    def mark_sent(self, key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE outbox SET state = ?, sent_at = ?, last_error = NULL WHERE key = ?", (SENT, time.time(), key)
+            )
+
+    def mark_failed(self, key, error):
+        with self.lock, self.connection:
+            (attempts,) = self.connection.execute("SELECT attempts FROM outbox WHERE key = ?", (key,)).fetchone()
+            if attempts >= self.max_attempts:
+                self.connection.execute(
+                    "UPDATE outbox SET state = ?, last_error = ? WHERE key = ?", (DEAD, error, key)
+                )
+            else:
+                backoff = min(self.retry_cap, self.retry_base * 2 ** (attempts - 1))
+                self.connection.execute(
+                    "UPDATE outbox SET state = ?, last_error = ?, next_attempt_at = ? WHERE key = ?",
+                    (FAILED, error, time.time() + backoff, key)
+                )
+
+    def counts(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
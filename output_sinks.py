@@ -0,0 +1,180 @@
+import csv
+import json
+import math
+import sys
+
+from atomic_file import atomic_write
+
+# Output sheets and their columns, in workbook order. Rows are streamed, so
+# columns are fixed up front instead of discovered from the records.
+FOUND_SHEET = 'Found'
+NOT_FOUND_SHEET = 'Not Found'
+ABOVE_TEN_PERCENT_SHEET = 'Above 10 Percent'
+REPORT_DOWN_SHEET = 'report_down'
+CASH_FORECAST_SHEET = 'Cash Forecast'
+SHEET_COLUMNS = {
+    FOUND_SHEET: ['PIC_NAME', 'Message', 'PHONE', 'WhatsApp_URL', 'TYPE', 'BATCH'],
+    NOT_FOUND_SHEET: ['ATM_NAME', 'ID_ATM', 'NAMA_ATM', 'PROBLEM', 'Problem Details', 'TYPE', 'CANDIDATES'],
+    ABOVE_TEN_PERCENT_SHEET: ['ID_ATM', 'NAMA_ATM', 'PROBLEM', 'START_TIME', 'TYPE'],
+    REPORT_DOWN_SHEET: ['Report Down'],
+    CASH_FORECAST_SHEET: ['RANK', 'ID_ATM', 'NAMA_ATM', 'JML_UANG', 'PERCENT', 'RATE_PER_HOUR', 'HOURS_TO_EMPTY', 'OBSERVATIONS']
+}
+
+# NaN becomes an empty cell / null rather than the string "nan"
+def clean_value(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+def sheet_slug(sheet):
+    return sheet.lower().replace(' ', '_')
+
+# Receives output records one at a time as sms.py produces them
+class OutputSink:
+    def write(self, sheet, record):
+        raise NotImplementedError
+
+    def write_many(self, sheet, records):
+        for record in records:
+            self.write(sheet, record)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# The atm_problem_messages.xlsx workbook, written with openpyxl's write-only
+# mode so rows go straight to disk instead of through DataFrames
+class ExcelSink(OutputSink):
+    def __init__(self, path):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {}
+        for sheet, columns in SHEET_COLUMNS.items():
+            self.sheets[sheet] = self.workbook.create_sheet(sheet)
+            self.sheets[sheet].append(columns)
+
+    def write(self, sheet, record):
+        self.sheets[sheet].append([clean_value(record.get(column)) for column in SHEET_COLUMNS[sheet]])
+
+    # Readers never see half a workbook, see atomic_write
+    def close(self):
+        with atomic_write(self.path, 'wb') as file:
+            self.workbook.save(file)
+        print(f"Messages saved to {self.path}")
+
+# One CSV file per sheet: <prefix>.found.csv, <prefix>.not_found.csv, ...
+class CsvSink(OutputSink):
+    def __init__(self, prefix):
+        self.files = {}
+        self.writers = {}
+        for sheet, columns in SHEET_COLUMNS.items():
+            self.files[sheet] = open(f"{prefix}.{sheet_slug(sheet)}.csv", 'w', newline='', encoding='utf-8')
+            self.writers[sheet] = csv.DictWriter(self.files[sheet], fieldnames=columns, extrasaction='ignore')
+            self.writers[sheet].writeheader()
+
+    def write(self, sheet, record):
+        self.writers[sheet].writerow({column: clean_value(value) for column, value in record.items()})
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+# Every record as one JSON object per line, tagged with its sheet
+class JsonlSink(OutputSink):
+    def __init__(self, path=None, stream=None):
+        self.owns_stream = stream is None
+        self.stream = open(path, 'w', encoding='utf-8') if stream is None else stream
+
+    def write(self, sheet, record):
+        row = {"SHEET": sheet}
+        row.update((column, clean_value(value)) for column, value in record.items())
+        self.stream.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+
+    def close(self):
+        if self.owns_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+# JSON lines on the process's real stdout for piping; sms.py sends its
+# progress output to stderr while this sink is in use
+class StdoutSink(JsonlSink):
+    def __init__(self):
+        super().__init__(stream=sys.__stdout__)
+
+# One Parquet file per sheet, written a row group at a time. Every column is
+# stored as a nullable string so batches always share one schema.
+class ParquetSink(OutputSink):
+    def __init__(self, prefix, batch_size=1000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.batches = {sheet: [] for sheet in SHEET_COLUMNS}
+        self.writers = {}
+
+    def write(self, sheet, record):
+        self.batches[sheet].append(record)
+        if len(self.batches[sheet]) >= self.batch_size:
+            self._flush(sheet)
+
+    def _flush(self, sheet):
+        columns = SHEET_COLUMNS[sheet]
+        if sheet not in self.writers:
+            schema = self.pa.schema([(column, self.pa.string()) for column in columns])
+            self.writers[sheet] = self.pq.ParquetWriter(f"{self.prefix}.{sheet_slug(sheet)}.parquet", schema)
+        batch = self.batches[sheet]
+        table = self.pa.table(
+            {
+                column: [None if clean_value(record.get(column)) is None else str(record[column]) for record in batch]
+                for column in columns
+            },
+            schema=self.writers[sheet].schema
+        )
+        self.writers[sheet].write_table(table)
+        self.batches[sheet] = []
+
+    def close(self):
+        for sheet in SHEET_COLUMNS:
+            if self.batches[sheet] or sheet not in self.writers:
+                self._flush(sheet)
+            self.writers[sheet].close()
+
+# Fans every record out to several sinks
+class SinkGroup(OutputSink):
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, sheet, record):
+        for sink in self.sinks:
+            sink.write(sheet, record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+# Build a sink from a --sink spec of the form kind[:path]; csv and parquet
+# take a file name prefix, e.g. "csv:out/messages" -> out/messages.found.csv
+def open_sink(spec, default_stem='atm_problem_messages'):
+    kind, _, path = spec.partition(':')
+    if kind == 'xlsx':
+        return ExcelSink(path or f"{default_stem}.xlsx")
+    if kind == 'csv':
+        return CsvSink(path or default_stem)
+    if kind == 'jsonl':
+        return JsonlSink(path or f"{default_stem}.jsonl")
+    if kind == 'parquet':
+        return ParquetSink(path or default_stem)
+    if kind == 'stdout':
+        return StdoutSink()
+    raise ValueError(f"Unknown sink {spec!r}, expected xlsx, csv, jsonl, parquet or stdout")
@@ -0,0 +1,31 @@
+import re
+from functools import lru_cache
+
+# Optional +62 or 62 country code, an optional trunk 0, the national number
+# with any spacing, and a trailing .0 left by Excel storing the number as a float
+PHONE_PATTERN = re.compile(r'^(?:\+?62)?[\s\-()]*0?(\d[\d\s\-()]*?)(?:\.0+)?$')
+PHONE_SEPARATORS = re.compile(r'[\s\-()]')
+
+# Phone number as +62 followed by the national number, e.g. 0812-3456 or
+# 6281234.0 -> +628123456; None when the value holds no usable number.
+# Cached because the same PIC phone shows up on many rows.
+@lru_cache(maxsize=None)
+def normalize_phone(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    match = PHONE_PATTERN.match(str(value).strip())
+    if match is None:
+        return None
+    return '+62' + PHONE_SEPARATORS.sub('', match.group(1))
+
+# normalize_phone over a column, running the parse once per distinct value
+def normalize_phones(values):
+    return values.map({value: normalize_phone(value) for value in values.dropna().unique()})
+
+# Digits only, as the phone parameter of a WhatsApp send URL expects;
+# falls back to the value as written when it can't be normalized
+def whatsapp_phone(value):
+    phone = normalize_phone(value)
+    return phone[1:] if phone is not None else value
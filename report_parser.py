@@ -0,0 +1,417 @@
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+from name_index import TrigramIndex
+from workbook_cache import cached_for_workbook
+
+# ID_ATM as a digit string, e.g. 10000007.0 -> "10000007"
+def id_atm_string(value):
+    return f"{int(float(value)) if isinstance(value, (float, str)) else int(value)}"
+
+# Rows of the info sheet, with column names stripped and uppercased, and the
+# IDs on the exception sheet. The only place parsing needs pandas.
+def read_directory_sheets(atm_info_path):
+    import pandas as pd
+    sheets = pd.read_excel(atm_info_path, sheet_name=['info', 'exception'])
+    atm_info = sheets['info']
+    atm_info.columns = atm_info.columns.str.strip()  # Remove extra spaces in column names
+    atm_info.columns = atm_info.columns.str.upper()  # Convert columns to uppercase to avoid case issues
+    return atm_info.to_dict('records'), sheets['exception']['ID_ATM'].tolist()
+
+# Lookup maps over the info and exception sheets, built once per run so that
+# matching a problem to its ATM is a dict lookup instead of a DataFrame scan.
+# Rows are plain dicts, so a cached directory loads without pandas.
+class AtmDirectory:
+    def __init__(self, records, exceptions):
+        self.records = records  # rows of the info sheet
+        self.exceptions = set(exceptions)
+        self.by_name = {}  # stripped, casefolded NAMA_ATM -> record
+        self.by_exact_name = {}  # NAMA_ATM as written in info.xlsx -> record
+        self.by_id = {}  # ID_ATM as a digit string -> record
+        self.name_index = None  # trigram index over NAMA_ATM, built on the first fuzzy lookup
+
+        # setdefault keeps the first row on duplicates, same as iloc[0] on a filtered frame
+        for record in records:
+            nama_atm = record['NAMA_ATM']
+            if isinstance(nama_atm, str):
+                self.by_name.setdefault(nama_atm.strip().casefold(), record)
+                self.by_exact_name.setdefault(nama_atm, record)
+            self.by_id.setdefault(id_atm_string(record['ID_ATM']), record)
+
+    @classmethod
+    def from_frame(cls, atm_info, exceptions):
+        return cls(atm_info.to_dict('records'), exceptions)
+
+    # The sheets are read only when info.xlsx changed since the cached rows were taken
+    @classmethod
+    def from_excel(cls, atm_info_path, cache_dir='.refcache'):
+        records, exceptions = cached_for_workbook(
+            atm_info_path, 'directory', lambda: read_directory_sheets(atm_info_path), cache_dir
+        )
+        return cls(records, exceptions)
+
+    def find_by_name(self, atm_name):
+        return self.by_name.get(atm_name.casefold())
+
+    # Closest NAMA_ATM for a name the monitoring feed spelled differently
+    def find_by_similar_name(self, atm_name):
+        if self.name_index is None:
+            self.name_index = TrigramIndex(self.records)
+        return self.name_index.lookup(atm_name)
+
+    def find_by_exact_name(self, atm_name):
+        return self.by_exact_name.get(atm_name)
+
+    def find_by_id(self, id_atm):
+        return self.by_id.get(id_atm)
+
+    def is_exception(self, id_atm):
+        return id_atm in self.exceptions
+
+# Section headers and row layouts of report.txt, compiled once per process
+SECTION_HEADER_PATTERN = re.compile(
+    r'Problem Hardware|Problem Down|Problem Supply Out|ATM Warning|monitoring_npm:'
+    r'|Report Persentase Saldo di Bawah Pagu ATM BPD Bali|Report Problem ATM BPD Bali'
+)
+ATM_NAME_PATTERNS = (
+    re.compile(r'ATM\s[\w\s\d\(\)-]+'),
+    re.compile(r'CRM\s[\w\s\d\(\)-]+')
+)
+SALDO_PAGU_ROW_PATTERN = re.compile(r'\s*\d+\.\s*(\d+)\s*\|\s*([^|]+)\s*\|\s*(\d+)\s*\|\s*([\d.]+%)\s*\|\s*(.*)')
+ATM_PROBLEM_ROW_PATTERN = re.compile(r'\s*\d+\.\s*(\d+)\s*\|\s*([^|]+)\s*\|\s*(.*)\s*\|\s*(.*)')
+PROBLEM_ROW_PATTERN = re.compile(r'\s*\d+\.\s*(\d+)\s*\|\s*([^|]+)\s*\|\s*(.*)')
+
+# Record kinds yielded by iter_report_records
+PROBLEM = 'problem'
+NOT_FOUND = 'not_found'
+ABOVE_TEN_PERCENT = 'above_ten_percent'
+
+# PROBLEM texts, formatted with the ATM ID followed by the record's details
+NPM_PROBLEM_TEXT = "error dengan keterangan : ID ATM {0} Down Node - No further details"
+NPM_NOT_FOUND_TEXT = "Down Node - No further details"
+SALDO_PAGU_TEXT = (
+    "saldo dibawah pagu dengan jumlah uang {1}, nilai tersebut {2} dari total saldo, "
+    "saldo dibawah pagu mulai pukul {3} pada ATM ID {0}"
+)
+ATM_PROBLEM_TEXT = "error dengan keterangan : ID ATM {0} {1} sejak jam {2}"
+RAW_PROBLEM_TEXT = "{1}"
+
+# One parsed report row. Slotted so a large report doesn't pay for a dict per
+# row; ID_ATM is kept as an int and the PROBLEM text is only formatted when
+# asked for. Rows the monitoring feed names but the directory lacks have no ID.
+class ProblemRecord:
+    __slots__ = ('id_atm', 'nama_atm', 'type', 'template', 'details', 'start_time', 'candidates')
+
+    def __init__(self, id_atm, nama_atm, error_type, template, details=(), start_time=None, candidates=None):
+        self.id_atm = id_atm
+        self.nama_atm = nama_atm
+        self.type = error_type
+        self.template = template  # one of the *_TEXT constants, shared by every record
+        self.details = details
+        self.start_time = start_time
+        self.candidates = candidates  # scored names behind a fuzzy match, or near misses of an unresolved name
+
+    @property
+    def id_atm_str(self):
+        return None if self.id_atm is None else f"{self.id_atm}"
+
+    @property
+    def problem(self):
+        return self.template.format(self.id_atm, *self.details)
+
+    # The output row this record used to be: ID_ATM/NAMA_ATM or ATM_NAME, PROBLEM, START_TIME, TYPE,
+    # plus CANDIDATES when the name was fuzzy-matched or left unresolved
+    def to_row(self):
+        if self.id_atm is None:
+            row = {"ATM_NAME": self.nama_atm, "PROBLEM": self.problem, "TYPE": self.type}
+            if self.candidates:
+                row["CANDIDATES"] = self.candidates
+            return row
+        row = {"ID_ATM": self.id_atm_str, "NAMA_ATM": self.nama_atm, "PROBLEM": self.problem}
+        if self.start_time is not None:
+            row["START_TIME"] = self.start_time
+        row["TYPE"] = self.type
+        if self.candidates:
+            row["CANDIDATES"] = self.candidates
+        return row
+
+# Line and timing counters for one parse, to measure throughput
+class ParseStats:
+    def __init__(self):
+        self.lines = 0
+        self.records = 0
+        self.elapsed = 0.0
+        self.header_hits = 0  # lines that matched the section header alternation
+        self.row_hits = 0  # section rows matched by their row pattern
+        self.row_misses = 0  # section rows no pattern matched
+        self.skipped = 0  # matched rows dropped as malformed
+        self.fuzzy_matches = 0  # monitoring names resolved by similarity
+        self.ambiguous = 0  # monitoring names with close candidates but no clear match
+
+    def counts(self):
+        return {
+            "lines": self.lines,
+            "records": self.records,
+            "header_hits": self.header_hits,
+            "row_hits": self.row_hits,
+            "row_misses": self.row_misses,
+            "skipped": self.skipped,
+            "fuzzy_matches": self.fuzzy_matches,
+            "ambiguous": self.ambiguous
+        }
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.elapsed if self.elapsed else 0.0
+
+# Section and error type in effect at the current line, kept between calls
+# so a report read in pieces parses the same as one read whole
+class ParserState:
+    def __init__(self, section=None, error_type=""):
+        self.section = section  # 'monitoring_npm', 'saldo_pagu', 'atm_problem' or None
+        self.error_type = error_type
+
+# Top-level sections in the order a monitoring dump lists them; None is the
+# problem list the dump opens with
+SECTION_ORDER = {None: 0, 'monitoring_npm': 1, 'saldo_pagu': 2, 'atm_problem': 3}
+ATM_PROBLEM_SUBHEADERS = ('Problem Hardware', 'Problem Down')
+
+# Section a header line opens, or None for a problem list header
+def header_section(line):
+    if 'monitoring_npm:' in line:
+        return 'monitoring_npm'
+    if 'Report Persentase Saldo di Bawah Pagu ATM BPD Bali' in line:
+        return 'saldo_pagu'
+    if 'Report Problem ATM BPD Bali' in line:
+        return 'atm_problem'
+    return None
+
+# Where each dump starts in a report that holds several, fed one line at a
+# time with a position (line number or byte offset) to record. A header that
+# goes back to an earlier section, or opens the section it is in again,
+# starts the next dump. Inside atm_problem, Problem Hardware and Problem Down
+# are also subheaders, so such a header starts a dump only when the row after
+# it is a problem list row rather than an atm_problem row.
+class ReportBlocks:
+    def __init__(self):
+        self.starts = []  # positions of every dump start after the first
+        self.section = None
+        self.content = False  # the current dump has a line that isn't blank
+        self.maybe_start = None  # position of a subheader that may open the next dump
+
+    # True once the current dump has reached its last section and nothing
+    # in it is waiting on the next line to be placed
+    @property
+    def complete(self):
+        return self.section == 'atm_problem' and self.maybe_start is None
+
+    def _start(self, position):
+        if self.content:
+            self.starts.append(position)
+        self.section = None
+
+    def feed(self, line, position):
+        if not line.strip():
+            return
+        if SECTION_HEADER_PATTERN.search(line):
+            section = header_section(line)
+            if section is None and self.section == 'atm_problem' and any(header in line for header in ATM_PROBLEM_SUBHEADERS):
+                if self.maybe_start is None:
+                    self.maybe_start = position
+                self.content = True
+                return
+            if self.maybe_start is not None:
+                # Only a problem list header can follow a subheader that opened a dump
+                self._start(self.maybe_start)
+                self.maybe_start = None
+            elif SECTION_ORDER[section] < SECTION_ORDER[self.section] or (section is not None and section == self.section):
+                self._start(position)
+            if section is not None:
+                self.section = section
+        elif self.maybe_start is not None:
+            if not ATM_PROBLEM_ROW_PATTERN.match(line):
+                self._start(self.maybe_start)
+            self.maybe_start = None
+        self.content = True
+
+# Accept a path, an open file object, or '-' for stdin
+@contextmanager
+def open_report(source):
+    if source == '-':
+        yield sys.stdin
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'r') as file:
+            yield file
+    else:
+        yield source
+
+# Stream (kind, record) pairs from a report, reading one line at a time
+def iter_report_records(source, atm_directory, stats=None, state=None):
+    stats = stats if stats is not None else ParseStats()
+    state = state if state is not None else ParserState()
+    started = time.perf_counter()
+    section = state.section
+    error_type = state.error_type
+
+    try:
+        with open_report(source) as file:
+            for line in file:
+                stats.lines += 1
+
+                # Only lines that hit the header alternation need the keyword checks
+                if SECTION_HEADER_PATTERN.search(line):
+                    stats.header_hits += 1
+                    if 'Problem Hardware' in line:
+                        error_type = 'Problem Hardware'
+                    elif 'Problem Down' in line:
+                        error_type = 'Problem Down'
+                    elif 'Problem Supply Out' in line:
+                        error_type = 'Problem Supply Out'
+                    elif 'ATM Warning' in line:
+                        error_type = 'ATM Warning'
+                    elif 'Report Persentase Saldo di Bawah Pagu ATM BPD Bali' in line:
+                        error_type = 'Saldo di Bawah Pagu'
+                        section = 'saldo_pagu'
+                        continue
+
+                    if 'monitoring_npm:' in line:
+                        error_type = 'NPM Problem'
+                        section = 'monitoring_npm'
+                        continue
+
+                    if 'Report Problem ATM BPD Bali' in line:
+                        section = 'atm_problem'
+                        continue
+
+                # Process lines differently based on the section
+                if section == 'monitoring_npm':
+                    for pattern in ATM_NAME_PATTERNS:
+                        match = pattern.search(line)
+                        if match:
+                            stats.row_hits += 1
+                            atm_name = match.group().strip()
+                            # Match atm_name with NAMA_ATM from the directory, ignoring case and trailing spaces
+                            atm_match = atm_directory.find_by_name(atm_name)
+                            name_match = None
+                            if atm_match is None:
+                                # Extra spaces, punctuation or a suffix in the feed; take the name only on a clear win
+                                name_match = atm_directory.find_by_similar_name(atm_name)
+                                atm_match = name_match.record
+                                if atm_match is not None:
+                                    stats.fuzzy_matches += 1
+                                    print(f"Matched {atm_name} to {atm_match['NAMA_ATM']} out of {name_match.describe()}")
+                                    atm_name = atm_match['NAMA_ATM']
+                            if atm_match is not None:
+                                id_atm = atm_match['ID_ATM']
+                                # Check if id_atm is in exceptions
+                                if not atm_directory.is_exception(id_atm):
+                                    stats.records += 1
+                                    # A fuzzy match keeps the names it was scored against, for audit
+                                    candidates = name_match.describe() if name_match is not None else None
+                                    yield PROBLEM, ProblemRecord(int(id_atm), atm_name, error_type, NPM_PROBLEM_TEXT, candidates=candidates)
+                            else:
+                                stats.records += 1
+                                candidates = None
+                                if name_match.ambiguous:
+                                    stats.ambiguous += 1
+                                    candidates = name_match.describe()
+                                yield NOT_FOUND, ProblemRecord(None, atm_name, error_type, NPM_NOT_FOUND_TEXT, candidates=candidates)
+                            break
+                    else:
+                        stats.row_misses += 1
+                elif section == 'saldo_pagu':
+                    match = SALDO_PAGU_ROW_PATTERN.match(line)
+                    if match:
+                        stats.row_hits += 1
+                        try:
+                            id_atm = int(match.group(1).strip())
+                            nama_atm = match.group(2).strip()
+                            jml_uang = match.group(3).strip()
+                            percent = match.group(4).strip()
+                            start_pagu = match.group(5).strip()
+                            percent_value = float(percent.strip('%'))
+                            if not atm_directory.is_exception(id_atm):
+                                record = ProblemRecord(
+                                    id_atm, nama_atm, error_type, SALDO_PAGU_TEXT, (jml_uang, percent, start_pagu), start_pagu
+                                )
+                                stats.records += 1
+                                yield (ABOVE_TEN_PERCENT if percent_value > 10 else PROBLEM), record
+                        except ValueError:
+                            stats.skipped += 1
+                            print(f"Skipping line (ID_ATM not digit or malformed): {line.strip()}")
+                    else:
+                        stats.row_misses += 1
+                elif section == 'atm_problem':
+                    match = ATM_PROBLEM_ROW_PATTERN.match(line)
+                    if match:
+                        stats.row_hits += 1
+                        try:
+                            id_atm = int(match.group(1).strip())
+                            nama_atm = match.group(2).strip()
+                            start_error = match.group(3).strip()
+                            ket = match.group(4).strip()
+                            if not atm_directory.is_exception(id_atm):
+                                if "Reject Bin" in ket or "Currency Cassettes" in ket or "Receipt Paper" in ket:
+                                    error_type = 'Problem Supply Out'
+                                stats.records += 1
+                                yield PROBLEM, ProblemRecord(id_atm, nama_atm, error_type, ATM_PROBLEM_TEXT, (ket, start_error), start_error)
+                        except ValueError:
+                            stats.skipped += 1
+                            print(f"Skipping line (ID_ATM not digit or malformed): {line.strip()}")
+                    else:
+                        stats.row_misses += 1
+                else:
+                    match = PROBLEM_ROW_PATTERN.match(line)
+                    if match:
+                        stats.row_hits += 1
+                        try:
+                            id_atm = int(match.group(1).strip())
+                            nama_atm = match.group(2).strip()
+                            if not atm_directory.is_exception(id_atm):
+                                stats.records += 1
+                                yield PROBLEM, ProblemRecord(id_atm, nama_atm, error_type, RAW_PROBLEM_TEXT, (match.group(3).strip(),))
+                        except ValueError:
+                            stats.skipped += 1
+                            print(f"Skipping line (ID_ATM not digit or malformed): {line.strip()}")
+                    else:
+                        stats.row_misses += 1
+    finally:
+        state.section = section
+        state.error_type = error_type
+        stats.elapsed += time.perf_counter() - started
+
+# Function to read and process the text file
+def process_text_file(text_file_path, atm_directory, stats=None, state=None):
+    buckets = {PROBLEM: [], NOT_FOUND: [], ABOVE_TEN_PERCENT: []}
+    for kind, record in iter_report_records(text_file_path, atm_directory, stats, state):
+        buckets[kind].append(record)
+    return buckets[PROBLEM], buckets[NOT_FOUND], buckets[ABOVE_TEN_PERCENT]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse report.txt against info.xlsx without building messages")
+    parser.add_argument('--report', default='report.txt', help="report text file, '-' for stdin")
+    parser.add_argument('--info', default='info.xlsx', help="ATM info workbook with info and exception sheets")
+    parser.add_argument('--cache-dir', default='.refcache', help="where the parsed ATM directory is cached")
+    parser.add_argument('--jsonl', action='store_true', help="print every record as a JSON line, with the counts on stderr")
+    args = parser.parse_args(argv)
+
+    records_out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr) if args.jsonl else contextlib.nullcontext():
+        atm_directory = AtmDirectory.from_excel(args.info, args.cache_dir)
+        stats = ParseStats()
+        counts = {PROBLEM: 0, NOT_FOUND: 0, ABOVE_TEN_PERCENT: 0}
+        for kind, record in iter_report_records(args.report, atm_directory, stats):
+            counts[kind] += 1
+            if args.jsonl:
+                records_out.write(json.dumps({"KIND": kind, **record.to_row()}, default=str) + "\n")
+        print(f"Parsed {stats.lines} lines in {stats.elapsed:.3f}s ({stats.lines_per_second:.0f} lines/s)")
+        print(f"Parsed problems: {counts[PROBLEM]}, not found: {counts[NOT_FOUND]}, above 10 percent: {counts[ABOVE_TEN_PERCENT]}")
+
+if __name__ == "__main__":
+    main()
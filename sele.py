@@ -1,27 +1,30 @@
-from selenium import webdriver # type: ignore
-from selenium.webdriver.common.keys import Keys # type: ignore
+import argparse
 import time
 
-# Path to your WebDriver
-driver_path = '/chromedriver-win64/chromedriver-win64'
-driver = webdriver.Chrome(driver_path)
+from dispatcher import BrowserSession
 
-# Open WhatsApp Web
-driver.get('https://web.whatsapp.com')
-input("Press Enter after scanning QR code and WhatsApp Web is loaded completely")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send one WhatsApp message to a few numbers from a logged-in browser")
+    parser.add_argument('--phone', action='append', help="number to message; repeatable")
+    parser.add_argument('--message', default='Hello, this is a test message from Selenium!')
+    # Chrome profile kept between runs, so WhatsApp Web stays logged in and the
+    # QR code only has to be scanned the first time
+    parser.add_argument('--profile-dir', default='wa_profiles/sele', help="Chrome profile of the session")
+    parser.add_argument('--delay', type=float, default=5.0, help="seconds between messages")
+    args = parser.parse_args(argv)
+    phone_numbers = args.phone or ['+6285847624457']
 
-def send_message(phone_number, message):
-    driver.get(f'https://web.whatsapp.com/send?phone={phone_number}&text={message}')
-    time.sleep(10)  # Wait for the page to load
-    send_button = driver.find_element_by_xpath('//button[@data-icon="send"]')
-    send_button.click()
+    # Open WhatsApp Web once; every message switches chats inside that page
+    session = BrowserSession.open_chrome('sele', args.profile_dir)
+    try:
+        session.start()
+        for number in phone_numbers:
+            started = time.perf_counter()
+            method = session.send(number, args.message)
+            print(f"Sent to {number} ({method}) in {time.perf_counter() - started:.1f}s")
+            time.sleep(args.delay)  # Wait between messages to avoid detection
+    finally:
+        session.close()
 
-# Example usage
-phone_numbers = ['+6285847624457']  # Add more phone numbers as needed
-message = 'Hello, this is a test message from Selenium!'
-
-for number in phone_numbers:
-    send_message(number, message)
-    time.sleep(5)  # Wait between messages to avoid detection
-
-driver.quit()
+if __name__ == "__main__":
+    main()
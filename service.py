@@ -0,0 +1,179 @@
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from history_store import HistoryStore
+from metrics import RunMetrics
+from outbox import Outbox
+from output_sinks import clean_value
+from sms import (AtmDirectory, MessageOptions, ParseStats, add_message_options, create_messages_and_save_to_excel, history_sheet_name,
+                 process_text_file, queue_messages)
+
+# Keeps the ATM directory and this month's history in memory between
+# requests, so a report costs only its parse and message build. Parsing runs
+# concurrently; the history step is serialized because every report reads
+# and updates the same history. `options` are the same stages sms.py runs,
+# so a report gets the same messages either way.
+class ReportService:
+    def __init__(self, atm_info_path, history_store, outbox=None, cache_dir='.refcache', options=None):
+        self.atm_info_path = atm_info_path
+        self.history_store = history_store
+        self.outbox = outbox
+        self.cache_dir = cache_dir
+        self.options = options if options is not None else MessageOptions()
+        self.reference_lock = threading.Lock()
+        self.history_lock = threading.Lock()
+        self.atm_directory = None
+        self.info_signature = None
+        self.history_df = None
+        self.history_sheet = None
+        self.history_version = None  # data_version of the store when history_df was last in step with it
+        self.current_directory()
+
+    def _info_signature(self):
+        file_stat = os.stat(self.atm_info_path)
+        return (file_stat.st_mtime_ns, file_stat.st_size)
+
+    # The directory for a request, rebuilt first when info.xlsx changed on disk.
+    # A workbook caught mid-save fails to load; the old directory is kept and
+    # the reload is retried on the next request.
+    def current_directory(self):
+        signature = self._info_signature()
+        if signature != self.info_signature:
+            with self.reference_lock:
+                if signature != self.info_signature:
+                    try:
+                        self.atm_directory = AtmDirectory.from_excel(self.atm_info_path, self.cache_dir)
+                        self.info_signature = signature
+                        print(f"Loaded {len(self.atm_directory.records)} ATMs from {self.atm_info_path}")
+                    except Exception as e:
+                        if self.atm_directory is None:
+                            raise
+                        print(f"Keeping the previous ATM directory, reloading {self.atm_info_path} failed: {e}")
+        return self.atm_directory
+
+    def handle_report(self, report_text):
+        started = time.perf_counter()
+        metrics = RunMetrics()
+        # One directory for the whole request, even if a reload swaps it meanwhile
+        atm_directory = self.current_directory()
+
+        parse_stats = ParseStats()
+        with metrics.stage('parse') as stage:
+            problems, not_found, above_ten_percent = process_text_file(io.StringIO(report_text), atm_directory, parse_stats)
+            stage.update(parse_stats.counts())
+
+        with self.history_lock:
+            # Reload history when the month sheet changes or another process,
+            # such as sms.py, wrote to the store since the frame was loaded
+            history_sheet = history_sheet_name(datetime.now())
+            history_version = self.history_store.data_version()
+            if self.history_sheet != history_sheet or self.history_version != history_version:
+                self.history_df = None
+            try:
+                message_run = create_messages_and_save_to_excel(
+                    problems, not_found, above_ten_percent, atm_directory, None, self.history_df, self.history_store,
+                    metrics=metrics, options=self.options
+                )
+            except Exception:
+                # The frame may hold bumps and DONE marks the store never got
+                self.history_df = None
+                raise
+            self.history_df = message_run.history_df
+            self.history_sheet = history_sheet
+            self.history_version = history_version
+            # Queued under the lock, so the next report's suppression check sees these sends
+            queued = queue_messages(message_run, self.outbox, self.options.suppression)
+        return {
+            "messages": [clean_record(message) for message in message_run.messages],
+            "report_down": message_run.report_down_message,
+            "not_found": [clean_record(record) for record in message_run.not_found],
+            "above_ten_percent": [clean_record(record) for record in message_run.above_ten_percent],
+            "queued": queued,
+            "timings": {stage["stage"]: stage["seconds"] for stage in metrics.stages},
+            "seconds": time.perf_counter() - started
+        }
+
+    def health(self):
+        return {
+            "atms": len(self.atm_directory.records),
+            "history_sheet": self.history_sheet,
+            "history_rows": None if self.history_df is None else len(self.history_df)
+        }
+
+def clean_record(record):
+    return {column: clean_value(value) for column, value in record.items()}
+
+# POST /report with the report as the body (text/plain, or JSON {"report": ...})
+# returns the messages as JSON; GET /health describes the loaded data
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/report':
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        try:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                body = json.loads(body)['report']
+            result = self.server.service.handle_report(body)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"expected the report text or JSON with a report field: {e}"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, result)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        self._send_json(200, self.server.service.health())
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, default=str, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve sms.py over HTTP with the reference data kept in memory")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--info', default='info.xlsx', help="ATM directory workbook, reloaded when it changes")
+    parser.add_argument('--history-db', default='history.db', help="history store")
+    parser.add_argument('--history-xlsx', '--history-excel', dest='history_xlsx', default='history.xlsx',
+                        help="workbook imported once into an empty history store")
+    parser.add_argument('--outbox', default='outbox.db', help="outbox the messages are queued in, empty to skip")
+    add_message_options(parser)
+    args = parser.parse_args()
+
+    history_store = HistoryStore(args.history_db)
+    if history_store.is_empty() and os.path.exists(args.history_xlsx):
+        imported = history_store.import_excel(args.history_xlsx)
+        print(f"Imported {imported} history rows from {args.history_xlsx} into {args.history_db}")
+    outbox = Outbox(args.outbox) if args.outbox else None
+    service = ReportService(args.info, history_store, outbox, options=MessageOptions.from_args(args))
+
+    server = ThreadingHTTPServer((args.host, args.port), ReportRequestHandler)
+    server.service = service
+    print(f"Listening on http://{args.host}:{args.port}/report")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        history_store.close()
+        if outbox is not None:
+            outbox.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,128 +1,197 @@
+import numpy as np
 import pandas as pd
 import re
+import argparse
+import cProfile
+import json
+import locale
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
 from datetime import datetime, timedelta
 import urllib.parse
 from collections import defaultdict
 from dotenv import load_dotenv, find_dotenv
 import os
 
+from atomic_file import atomic_write
+from history_store import HISTORY_COLUMNS, HistoryStore, history_sheet_name, months_in_indonesian
+from metrics import RunMetrics
+from outbox import Outbox, dispatch_priority
+from cash_forecast import CashForecast, parse_amount, parse_percent
+from output_sinks import (ABOVE_TEN_PERCENT_SHEET, CASH_FORECAST_SHEET, FOUND_SHEET, NOT_FOUND_SHEET, REPORT_DOWN_SHEET, ExcelSink,
+                          SinkGroup, open_sink)
+from phone_number import whatsapp_phone
+from report_parser import (ABOVE_TEN_PERCENT, NOT_FOUND, PROBLEM, SALDO_PAGU_TEXT, AtmDirectory, ParseStats, ReportBlocks,
+                           ProblemRecord, iter_report_records, process_text_file)
+from snapshot import ReportSnapshot, key_hash
+from suppression import SuppressionCache, parse_ttl_overrides
+
 # Load environment variables from .env file if it exists
 load_dotenv(find_dotenv())
 
-# Function to read and process the text file
-def process_text_file(text_file_path, atm_info, exceptions):
-    problems = []
-    not_found = []
-    above_ten_percent = []
-    atm_name_patterns = [
-        r'ATM\s[\w\s\d\(\)-]+',
-        r'CRM\s[\w\s\d\(\)-]+'
-    ]
-
-    with open(text_file_path, 'r') as file:
-        lines = file.readlines()
-        monitoring_npm_section = False
-        saldo_pagu_section = False
-        atm_problem_section = False
-        error_type = ""
-
-        for line in lines:
-            if 'Problem Hardware' in line:
-                error_type = 'Problem Hardware'
-            elif 'Problem Down' in line:
-                error_type = 'Problem Down'
-            elif 'Problem Supply Out' in line:
-                error_type = 'Problem Supply Out'
-            elif 'ATM Warning' in line:
-                error_type = 'ATM Warning'
-            elif 'Report Persentase Saldo di Bawah Pagu ATM BPD Bali' in line:
-                error_type = 'Saldo di Bawah Pagu'
-                saldo_pagu_section = True
-                monitoring_npm_section = False
-                atm_problem_section = False
-                continue
-
-            if 'monitoring_npm:' in line:
-                error_type = 'NPM Problem'
-                monitoring_npm_section = True
-                saldo_pagu_section = False
-                atm_problem_section = False
-                continue
-            
-            if 'Report Problem ATM BPD Bali' in line:
-                atm_problem_section = True
-                monitoring_npm_section = False
-                saldo_pagu_section = False
-                continue
+# Columns that identify a problem in history
+HISTORY_KEY_COLUMNS = ["ID_ATM", "TIPE_PERMASALAHAN", "PERMASALAHAN"]
+
+# Latest history row per problem key, so dedupe and frequency bumps don't
+# refilter and resort the whole month sheet for every problem. Given `labels`,
+# only those rows are indexed, while bumps still go to history_df.
+class HistoryIndex:
+    def __init__(self, history_df, key_columns, labels=None):
+        self.history_df = history_df
+        self.key_columns = key_columns
+        self.latest = {}  # problem key -> (row label, UPDATED_AT)
+        self.bumped_labels = set()  # rows whose FREQUENCY/UPDATED_AT changed
+        self.done_labels = []  # rows newly marked DONE
+
+        # Invalid dates sort last, and a stable sort keeps the first row on ties
+        rows = history_df if labels is None else history_df.loc[sorted(labels)]
+        updated_at = pd.to_datetime(rows["UPDATED_AT"], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+        ordered = rows[key_columns].assign(UPDATED_AT=updated_at).sort_values(
+            by="UPDATED_AT", ascending=False, kind="stable", na_position="last"
+        )
+        latest_rows = ordered.drop_duplicates(subset=key_columns, keep="first")
+        keys = zip(*(latest_rows[column] for column in key_columns))
+        for key, label, updated in zip(keys, latest_rows.index, latest_rows["UPDATED_AT"]):
+            self.latest[key] = (label, updated)
+
+    def find_latest(self, key):
+        return self.latest.get(key)
+
+    def bump_frequency(self, key, now):
+        label, _ = self.latest[key]
+        self.history_df.at[label, "FREQUENCY"] = self.history_df.at[label, "FREQUENCY"] + 1
+        self.history_df.at[label, "UPDATED_AT"] = now
+        self.latest[key] = (label, now)
+        self.bumped_labels.add(label)
+
+    def mark_done_except(self, active_keys):
+        # One membership test over the whole sheet instead of iterrows()
+        if active_keys:
+            history_keys = pd.MultiIndex.from_frame(self.history_df[self.key_columns])
+            active = history_keys.isin(list(active_keys))
+        else:
+            active = np.zeros(len(self.history_df), dtype=bool)
+        newly_done = ~active & (self.history_df["PROGRES_PERBAIKAN_ATM"] != "DONE").to_numpy()
+        self.done_labels = self.history_df.index[newly_done].tolist()
+        self.history_df.loc[~active, "PROGRES_PERBAIKAN_ATM"] = "DONE"
+
+    # Mark just these rows DONE, for problems known to have left the report
+    def mark_done(self, labels):
+        labels = sorted(labels)
+        newly_done = (self.history_df.loc[labels, "PROGRES_PERBAIKAN_ATM"] != "DONE").to_numpy()
+        self.done_labels = [label for label, done in zip(labels, newly_done) if done]
+        self.history_df.loc[labels, "PROGRES_PERBAIKAN_ATM"] = "DONE"
+
+# Whether every snapshot label is still a history row with the key it was
+# recorded under, i.e. history wasn't edited outside this script
+def snapshot_labels_match(history_df, labels_by_key):
+    labels = [label for key_labels in labels_by_key.values() for label in key_labels]
+    rows = history_df.reindex(labels)[HISTORY_KEY_COLUMNS]
+    row_hashes = iter(key_hash(key) for key in zip(*(rows[column] for column in HISTORY_KEY_COLUMNS)))
+    return all(next(row_hashes) == key for key, key_labels in labels_by_key.items() for _ in key_labels)
+
+# History row labels of every problem key in history_df, by key hash
+def history_key_labels(history_df):
+    groups = history_df.groupby(HISTORY_KEY_COLUMNS, observed=True, sort=False).indices
+    return {key_hash(key): [int(history_df.index[position]) for position in positions] for key, positions in groups.items()}
+
+# Day names in Indonesian
+days_in_indonesian = {
+    'Monday': 'Senin',
+    'Tuesday': 'Selasa',
+    'Wednesday': 'Rabu',
+    'Thursday': 'Kamis',
+    'Friday': 'Jumat',
+    'Saturday': 'Sabtu',
+    'Sunday': 'Minggu'
+}
+
+# This month's sheet of the history workbook; a month without a sheet yet starts empty
+def load_history(now, history_path='history.xlsx'):
+    sheet_name = history_sheet_name(now)
+    if os.path.exists(history_path):
+        with pd.ExcelFile(history_path) as workbook:
+            if sheet_name in workbook.sheet_names:
+                return workbook.parse(sheet_name)
+    return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+# Replace one month's sheet of the history workbook, keeping every other month
+def write_history_sheet(history_path, month, history_df):
+    if not os.path.exists(history_path):
+        history_df.to_excel(history_path, sheet_name=month, index=False)
+        return
+    with pd.ExcelWriter(history_path, mode='a', if_sheet_exists='replace') as writer:
+        history_df.to_excel(writer, sheet_name=month, index=False)
+
+# Read info.xlsx and this month's history at the same time. Both sources are
+# independent, and the workbook side is served from the pickle cache when unchanged.
+def load_reference_data(atm_info_path, history_store=None, cache_dir='.refcache', history_path='history.xlsx'):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        directory_future = executor.submit(AtmDirectory.from_excel, atm_info_path, cache_dir)
+        if history_store is not None:
+            history_future = executor.submit(history_store.load_month, history_sheet_name(datetime.now()))
+        else:
+            history_future = executor.submit(load_history, datetime.now(), history_path)
+        return directory_future.result(), history_future.result()
+
+# ID_ATM as a digit string, e.g. 10000007.0 -> "10000007". Values that
+# aren't a number (blank, None, text) keep their raw value; the second
+# result marks them.
+def normalize_id_atm(values):
+    numbers = pd.to_numeric(values, errors='coerce')
+    invalid = numbers.isna()
+    if not invalid.any():
+        return numbers.astype('int64').astype(str), invalid
+    digits = numbers[~invalid].astype('int64').astype(str)
+    return digits.reindex(values.index).astype(object).where(~invalid, values), invalid
+
+# History columns that repeat a handful of values over the whole month
+HISTORY_CATEGORY_COLUMNS = ["TIPE_PERMASALAHAN", "MERK_ATM", "Unit Kerja", "PIC", "HARI"]
+
+# Parse UPDATED_AT with one coerced pass and cast ID_ATM in one go. Rows whose
+# UPDATED_AT is filled but unparseable keep their raw value and are returned
+# as a quarantine frame so they can be written back unchanged. Rows whose
+# ID_ATM isn't a number keep it as it is too, so they never match a report
+# problem, and are returned as a second quarantine frame.
+def normalize_history(history_df):
+    raw_updated_at = history_df["UPDATED_AT"]
+    parsed = pd.to_datetime(raw_updated_at, format='%d/%m/%Y %H:%M:%S', errors='coerce')
+    # Only the values that failed to parse are checked for blanks, not the whole column
+    invalid = parsed.isna() & raw_updated_at.notna()
+    blank = (raw_updated_at[invalid].astype(str).str.strip() == '').to_numpy(dtype=bool)
+    invalid[invalid.index[invalid.to_numpy()][blank]] = False
+    quarantine = history_df.loc[invalid, ["UPDATED_AT"]].copy()
+
+    if invalid.any():
+        history_df["UPDATED_AT"] = parsed.astype(object).where(~invalid, raw_updated_at)
+    else:
+        history_df["UPDATED_AT"] = parsed
 
-            # Process lines differently based on the section
-            if monitoring_npm_section:
-                for pattern in atm_name_patterns:
-                    match = re.search(pattern, line)
-                    if match:
-                        atm_name = match.group().strip()
-                        # Match atm_name with NAMA_ATM from atm_info DataFrame, ignoring case and trailing spaces
-                        atm_match = atm_info[atm_info['NAMA_ATM'].str.strip().str.casefold() == atm_name.casefold()]
-                        if not atm_match.empty:
-                            id_atm = atm_match.iloc[0]['ID_ATM']
-                            id_atm_str = f"{int(id_atm)}"  # Ensure ATM ID is 8 digits
-                            # Check if id_atm is in exceptions
-                            if id_atm not in exceptions:
-                                problems.append({"ID_ATM": id_atm_str, "NAMA_ATM": atm_name, "PROBLEM": f"error dengan keterangan : ID ATM {id_atm_str} Down Node - No further details", "TYPE": error_type})
-                        else:
-                            not_found.append({"ATM_NAME": atm_name, "PROBLEM": "Down Node - No further details", "TYPE": error_type})
-                        break
-            elif saldo_pagu_section:
-                match = re.match(r'\s*\d+\.\s*(\d+)\s*\|\s*([^|]+)\s*\|\s*(\d+)\s*\|\s*([\d.]+%)\s*\|\s*(.*)', line)
-                if match:
-                    try:
-                        id_atm = int(match.group(1).strip())
-                        id_atm_str = f"{id_atm}"  # Ensure ATM ID is 8 digits
-                        nama_atm = match.group(2).strip()
-                        jml_uang = match.group(3).strip()
-                        percent = match.group(4).strip()
-                        start_pagu = match.group(5).strip()
-                        percent_value = float(percent.strip('%'))
-                        if id_atm not in exceptions:
-                            problem_details = (
-                                f"saldo dibawah pagu dengan jumlah uang {jml_uang}, nilai tersebut {percent} dari total saldo, "
-                                f"saldo dibawah pagu mulai pukul {start_pagu} pada ATM ID {id_atm_str}"
-                            )
-                            if percent_value > 10:
-                                above_ten_percent.append({"ID_ATM": id_atm_str, "NAMA_ATM": nama_atm, "PROBLEM": problem_details, "START_TIME": start_pagu, "TYPE": error_type})
-                            else:
-                                problems.append({"ID_ATM": id_atm_str, "NAMA_ATM": nama_atm, "PROBLEM": problem_details, "START_TIME": start_pagu, "TYPE": error_type})
-                    except ValueError:
-                        print(f"Skipping line (ID_ATM not digit or malformed): {line.strip()}")
-            elif atm_problem_section:
-                match = re.match(r'\s*\d+\.\s*(\d+)\s*\|\s*([^|]+)\s*\|\s*(.*)\s*\|\s*(.*)', line)
-                if match:
-                    try:
-                        id_atm = int(match.group(1).strip())
-                        id_atm_str = f"{id_atm}"  # Ensure ATM ID is 8 digits
-                        nama_atm = match.group(2).strip()
-                        start_error = match.group(3).strip()
-                        ket = match.group(4).strip()
-                        if id_atm not in exceptions:
-                            problem_details = f"error dengan keterangan : ID ATM {id_atm_str} {ket} sejak jam {start_error}"
-                            if "Reject Bin" in ket or "Currency Cassettes" in ket or "Receipt Paper" in ket:
-                                error_type = 'Problem Supply Out'
-                            problems.append({"ID_ATM": id_atm_str, "NAMA_ATM": nama_atm, "PROBLEM": problem_details, "START_TIME": start_error, "TYPE": error_type})
-                    except ValueError:
-                        print(f"Skipping line (ID_ATM not digit or malformed): {line.strip()}")
-            else:
-                match = re.match(r'\s*\d+\.\s*(\d+)\s*\|\s*([^|]+)\s*\|\s*(.*)', line)
-                if match:
-                    try:
-                        id_atm = int(match.group(1).strip())
-                        id_atm_str = f"{id_atm}"  # Ensure ATM ID is 8 digits
-                        nama_atm = match.group(2).strip()
-                        if id_atm not in exceptions:
-                            problem_details = match.group(3).strip()
-                            problems.append({"ID_ATM": id_atm_str, "NAMA_ATM": nama_atm, "PROBLEM": problem_details, "TYPE": error_type})
-                    except ValueError:
-                        print(f"Skipping line (ID_ATM not digit or malformed): {line.strip()}")
-    return problems, not_found, above_ten_percent
+    # Ensure all ID_ATM values are 8 digits with trailing zeros
+    history_df["ID_ATM"], invalid_id = normalize_id_atm(history_df["ID_ATM"])
+    id_quarantine = history_df.loc[invalid_id, ["ID_ATM"]].copy()
+    for column in HISTORY_CATEGORY_COLUMNS:
+        if column in history_df.columns and not isinstance(history_df[column].dtype, pd.CategoricalDtype):
+            history_df[column] = history_df[column].astype('category')
+    return quarantine, id_quarantine
+
+# Append new history rows, widening the categories first so the categorical
+# columns stay categorical instead of falling back to object on concat
+def append_history(history_df, new_history_df, ignore_index=False):
+    for column in HISTORY_CATEGORY_COLUMNS:
+        if column not in new_history_df.columns or column not in history_df.columns:
+            continue
+        if not isinstance(history_df[column].dtype, pd.CategoricalDtype):
+            continue
+        new_values = new_history_df[column].dropna().unique()
+        missing = [value for value in new_values if value not in history_df[column].cat.categories]
+        if missing:
+            history_df[column] = history_df[column].cat.add_categories(missing)
+        new_history_df[column] = pd.Categorical(new_history_df[column], categories=history_df[column].cat.categories)
+    return pd.concat([history_df, new_history_df], ignore_index=ignore_index)
 
 def bulatkanwaktu(dt):
     dt = dt.replace(minute=0, second=0, microsecond=0)
@@ -131,392 +200,810 @@ def bulatkanwaktu(dt):
 def bedahari(dt1, dt2):
     return (dt1.year != dt2.year) or (dt1.month != dt2.month) or (dt1.day != dt2.day)
 
-# Function to create messages and save to a new Excel file
-def create_messages_and_save_to_excel(problems, not_found, above_ten_percent, atm_info_path, output_path):
-    # Load the Excel data
-    atm_info = pd.read_excel(atm_info_path, sheet_name='info')
-    atm_info.columns = atm_info.columns.str.strip()  # Remove extra spaces in column names
-    atm_info.columns = atm_info.columns.str.upper()  # Convert columns to uppercase to avoid case issues
+# Outage types a power or network failure at a branch shows up as
+CORRELATED_TYPES = ('Problem Down', 'NPM Problem')
+INCIDENT_PROBLEM_TEXT = "error dengan keterangan : {0} {1} ATM di {2} ({3})"
+
+# Collapse outage bursts into branch incidents. Matched problems of a
+# correlated type are bucketed by branch, PIC, type and start-time window;
+# a bucket with at least `threshold` ATMs becomes one problem for the
+# lowest ATM ID, listing every ATM, and the rest pass through unchanged.
+# Returns the problems and the incidents among them.
+def correlate_branch_incidents(matched_problems, threshold, window_minutes, clock):
+    buckets = defaultdict(list)
+    window_seconds = window_minutes * 60
+    for position, (by_name, id_atm, nama_atm, problem_details, start_time, error_type, match) in enumerate(matched_problems):
+        if by_name or error_type not in CORRELATED_TYPES:
+            continue
+        try:
+            started = datetime.strptime(start_time, '%d/%m/%Y %H:%M:%S')
+        except ValueError:
+            started = clock()
+        window = int(started.timestamp() // window_seconds)
+        buckets[(match["NAMA_CABANG"], match["PIC_NAME"], error_type, window)].append((started, position))
+
+    incidents = {}  # position of an incident's first problem -> the incident
+    correlated = set()
+    for (nama_cabang, pic_name, error_type, window), members in buckets.items():
+        # The same ATM reported twice still counts once
+        atms = {}
+        for started, position in members:
+            atms.setdefault(matched_problems[position][1], (started, position))
+        if len(atms) < threshold:
+            continue
+        ordered = sorted(atms.items(), key=lambda item: int(item[0]))
+        lead_match = matched_problems[ordered[0][1][1]][6]
+        atm_list = ', '.join(f"{matched_problems[position][2]} ID {id_atm}" for id_atm, (_, position) in ordered)
+        problem_details = INCIDENT_PROBLEM_TEXT.format(error_type, len(atms), nama_cabang, atm_list)
+        start_time = min(started for started, _ in members).strftime('%d/%m/%Y %H:%M:%S')
+        incidents[min(position for _, position in members)] = (
+            False, ordered[0][0], f"{len(atms)} ATM di {nama_cabang}", problem_details, start_time, error_type, lead_match
+        )
+        correlated.update(position for _, position in members)
+
+    correlated_problems = []
+    for position, problem in enumerate(matched_problems):
+        if position in incidents:
+            correlated_problems.append(incidents[position])
+        elif position not in correlated:
+            correlated_problems.append(problem)
+    return correlated_problems, list(incidents.values())
+
+# Everything one create_messages_and_save_to_excel call produced, so callers
+# such as the dispatcher can use the messages without re-reading the workbook
+class MessageRun:
+    def __init__(self, messages, not_found, above_ten_percent, report_down_message, history_df, cash_forecast=(), sent_problems=(), now=None):
+        self.messages = messages  # rows of the Found sheet
+        self.not_found = not_found
+        self.above_ten_percent = above_ten_percent
+        self.report_down_message = report_down_message
+        self.history_df = history_df
+        self.cash_forecast = cash_forecast  # rows of the Cash Forecast sheet, soonest empty first
+        self.sent_problems = sent_problems  # (suppression key, FREQUENCY) of every problem in the messages
+        self.now = now  # the run's clock time
+
+# Queue a run's messages, and only then tell the suppression cache they were
+# sent, so a run that fails before its messages are queued keeps nothing quiet
+def queue_messages(message_run, outbox=None, suppression=None):
+    queued = outbox.record(message_run.messages) if outbox is not None else 0
+    if suppression is not None:
+        suppression.record(message_run.sent_problems, message_run.now)
+    return queued
+
+# One new history row for a problem matched to its ATM in the directory
+def new_history_record(now, start_time, id_atm, nama_atm, error_type, problem_details, match):
+    return {
+        "TANGGAL INPUT": now.strftime('%d/%m/%Y %H:%M:%S'),
+        "HARI": days_in_indonesian[now.strftime("%A")],
+        "TANGGAL": start_time.split(' ')[0],
+        "JAM": start_time.split(' ')[1],
+        "FREQUENCY": 1,
+        "ID_ATM": id_atm,
+        "MERK_ATM": match["MERK_ATM"],
+        "NAMA_ATM": nama_atm,
+        "TIPE_PERMASALAHAN": error_type,
+        "PERMASALAHAN": problem_details,
+        "TINDAK LANJUT OFFICER FDS": "",
+        "TINDAK LANJUT PIC": "",
+        "KETERANGAN": "",
+        "PROGRES_PERBAIKAN_ATM": "",
+        "PIC": match["PIC_NAME"],
+        "Unit Kerja": match["NAMA_CABANG"],
+        "Nomor Telepon": match["PHONE"],
+        "UPDATED_AT": now,
+        "STATUS": ""
+    }
 
-    # Print the loaded ATM info data for debugging
-    print("ATM Info Data:")
-    print(atm_info.head())
-    print("-" * 50)
+# The optional stages of a run, all off by default. With a `suppression`
+# cache, PICs are only messaged about problems that are new, escalated or past
+# their TTL. With a report `snapshot`, history is reconciled against the
+# previous report's problems instead of the whole month; which problems are
+# messaged is left to the suppression cache alone. With an
+# `incident_threshold`, outage bursts at a branch within `incident_window`
+# minutes become one branch incident. With a `cash_forecast`, every Saldo di
+# Bawah Pagu row is recorded and ATMs due to run dry within
+# `depletion_horizon` hours are listed. Without a history store, history is
+# read from and written back to the workbook at `history_path`.
+class MessageOptions:
+    def __init__(self, suppression=None, snapshot=None, incident_threshold=None, incident_window=30, cash_forecast=None, depletion_horizon=24, history_path='history.xlsx'):
+        self.suppression = suppression
+        self.snapshot = snapshot
+        self.incident_threshold = incident_threshold
+        self.incident_window = incident_window
+        self.cash_forecast = cash_forecast
+        self.depletion_horizon = depletion_horizon
+        self.history_path = history_path
+
+    # Options as set on the sms.py command line, opening the caches they name
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            suppression=SuppressionCache(args.suppression_db, parse_ttl_overrides(args.suppress_ttl)) if args.suppression_db else None,
+            snapshot=ReportSnapshot(args.snapshot_db) if args.snapshot_db else None,
+            incident_threshold=args.incident_threshold,
+            incident_window=args.incident_window,
+            cash_forecast=CashForecast.load(args.cash_forecast) if args.cash_forecast else None,
+            depletion_horizon=args.depletion_horizon,
+            history_path=args.history_xlsx
+        )
+
+# Function to create messages and save to a new Excel file. Runs as separate
+# directory match, history reconcile, message build, export and history write
+# stages, each timed into `metrics` when one is given. Output rows are written
+# to the workbook at output_path and to `sinks` as soon as each is produced;
+# the caller closes its own sinks. `options` turns on the optional stages.
+def create_messages_and_save_to_excel(problems, not_found, above_ten_percent, atm_directory, output_path, history_df=None, history_store=None, now=None, metrics=None, sinks=None, options=None):
+    # A fixed time replays an archived report as if it ran then; otherwise use the wall clock
+    fixed_now = now
+    clock = (lambda: fixed_now) if fixed_now is not None else datetime.now
+    metrics = metrics if metrics is not None else RunMetrics()
+    options = options if options is not None else MessageOptions()
+    suppression = options.suppression
+    snapshot = options.snapshot
+    cash_forecast = options.cash_forecast
 
     # Dictionaries to store the result data
     messages = defaultdict(list)
     new_history_records = []
     report_down_messages = []
 
-    # Day names in Indonesian
-    days_in_indonesian = {
-        'Monday': 'Senin',
-        'Tuesday': 'Selasa',
-        'Wednesday': 'Rabu',
-        'Thursday': 'Kamis',
-        'Friday': 'Jumat',
-        'Saturday': 'Sabtu',
-        'Sunday': 'Minggu'
-    }
-    
-    months_in_indonesian = {
-        '01': 'Januari',
-        '02': 'Februari',
-        '03': 'Maret',
-        '04': 'April',
-        '05': 'Mei',
-        '06': 'Juni',
-        '07': 'Juli',
-        '08': 'Agustus',
-        '09': 'September',
-        '10': 'Oktober',
-        '11': 'November',
-        '12': 'Desember'
-    }
+    # Messages of this run form one outbox batch, see outbox.idempotency_key
+    batch = clock().strftime('%Y-%m-%d %H:%M:%S')
 
     # Get current hour to determine greeting
-    current_hour = datetime.now().hour
+    current_hour = clock().hour
     if current_hour < 11:
         greeting = "Selamat pagi"
     elif current_hour < 15:
         greeting = "Selamat siang"
     else:
         greeting = "Selamat sore"
-    
-    # Load the history data
-    history_df = pd.read_excel('history.xlsx', sheet_name= f"{months_in_indonesian[datetime.now().strftime('%m')]} 2024")
-    print("here")
-    print(history_df)
-    # Store problematic datetime entries
-    invalid_date_entries = []
-
-    # Parse datetime, mark problematic rows
-    for idx, date_str in history_df["UPDATED_AT"].items():
-        try:
-            parsed_date = pd.to_datetime(date_str, format='%d/%m/%Y %H:%M:%S')
-            history_df.at[idx, "UPDATED_AT"] = parsed_date
-        except ValueError:
-            print(f"Invalid date format at index {idx}: {date_str}")
-            invalid_date_entries.append((idx, date_str))
 
-    # Ensure all ID_ATM values are 8 digits with trailing zeros
-    history_df["ID_ATM"] = history_df["ID_ATM"].apply(lambda x: f"{int(x)}")
-    atm_info["ID_ATM"] = atm_info["ID_ATM"].apply(lambda x: f"{int(x)}")
-
-    # Create a set of existing problems from the report
-    existing_problems_set = set((problem["ID_ATM"], problem["TYPE"], problem["PROBLEM"]) for problem in problems)
-
-    # Iterate through each problem and create the message text
-    for problem in problems:
-        if "ID_ATM" in problem:
-            id_atm = problem["ID_ATM"]
-            nama_atm = problem["NAMA_ATM"]
-            problem_details = problem["PROBLEM"]
-            start_time = problem.get("START_TIME", datetime.now().strftime('%d/%m/%Y %H:%M:%S'))
-            error_type = problem["TYPE"]
-
-            # Find the matching row in the Excel data
-            match = atm_info[atm_info["ID_ATM"] == id_atm]
-
-            if not match.empty:
-                nama_cabang = match.iloc[0]["NAMA_CABANG"]
-                pic_name = match.iloc[0]["PIC_NAME"]
-                phone = match.iloc[0]["PHONE"]
-                merk_atm = match.iloc[0]["MERK_ATM"]
-
-                # Check if the problem already exists in the history with the same ID_ATM, TIPE_PERMASALAHAN, PERMASALAHAN
-                existing_record = history_df[
-                    (history_df["ID_ATM"] == id_atm) &
-                    (history_df["TIPE_PERMASALAHAN"] == error_type) &
-                    (history_df["PERMASALAHAN"] == problem_details)
-                ].sort_values(by="UPDATED_AT", ascending=False)
-
-                now = datetime.now()
-                if not existing_record.empty:
-                    latest_record = existing_record.iloc[0]
-                    updated_at = latest_record["UPDATED_AT"]
-                    if bedahari(now, updated_at):
-                        new_history_records.append({
-                            "TANGGAL INPUT": now.strftime('%d/%m/%Y %H:%M:%S'),
-                            "HARI": days_in_indonesian[now.strftime("%A")],
-                            "TANGGAL": start_time.split(' ')[0],
-                            "JAM": start_time.split(' ')[1],
-                            "FREQUENCY": 1,
-                            "ID_ATM": id_atm,
-                            "MERK_ATM": merk_atm,
-                            "NAMA_ATM": nama_atm,
-                            "TIPE_PERMASALAHAN": error_type,
-                            "PERMASALAHAN": problem_details,
-                            "TINDAK LANJUT OFFICER FDS": "",
-                            "TINDAK LANJUT PIC": "",
-                            "KETERANGAN": "",
-                            "PROGRES_PERBAIKAN_ATM": "",
-                            "PIC": pic_name,
-                            "Unit Kerja": nama_cabang,
-                            "Nomor Telepon": phone,
-                            "UPDATED_AT": now,
-                            "STATUS": ""
-                        })
-                    else:
-                        new_frequency = latest_record["FREQUENCY"] + 1
-                        history_df.loc[latest_record.name, "FREQUENCY"] = new_frequency
-                        history_df.loc[latest_record.name, "UPDATED_AT"] = now
+    # Cash left per ATM in the Saldo di Bawah Pagu section, below and above 10 percent
+    cash_observations = {}
+    cash_names = {}
+    for record in (*problems, *above_ten_percent):
+        if record.template is SALDO_PAGU_TEXT:
+            cash_observations[record.id_atm] = (parse_amount(record.details[0]), parse_percent(record.details[1]))
+            cash_names[record.id_atm] = record.nama_atm
+
+    # Parse records become output rows here; the caller's lists are left as they are
+    not_found = [record.to_row() for record in not_found]
+    above_ten_percent = [record.to_row() for record in above_ten_percent]
+    excel_sink = ExcelSink(output_path) if output_path is not None else None
+    output = SinkGroup(sink for sink in (excel_sink, sinks) if sink is not None)
+    output.write_many(ABOVE_TEN_PERCENT_SHEET, above_ten_percent)
+    output.write_many(NOT_FOUND_SHEET, not_found)
+
+    # Find the ATM of every problem; problems reported by name carry no ID
+    with metrics.stage('directory_match') as stage:
+        matched_problems = []
+        # Create a set of existing problems from the report
+        existing_problems_set = set()
+        not_found_before = len(not_found)
+        for problem in problems:
+            # The PROBLEM text is formatted once here and reused for history and messages
+            problem_details = problem.problem
+            error_type = problem.type
+            nama_atm = problem.nama_atm
+            start_time = problem.start_time if problem.start_time is not None else clock().strftime('%d/%m/%Y %H:%M:%S')
+            existing_problems_set.add((problem.id_atm_str, error_type, problem_details))
+            if problem.id_atm is not None:
+                by_name = False
+                id_atm = problem.id_atm_str
+                match = atm_directory.find_by_id(id_atm)
+            else:
+                by_name = True
+                id_atm = ""  # Assuming no ID available for ATM_NAME section
+                match = atm_directory.find_by_exact_name(nama_atm)
+
+            if match is None:
+                if by_name:
+                    print(f"No match found for ATM_NAME {nama_atm}")
+                    not_found_record = {"ATM_NAME": nama_atm, "Problem Details": problem_details, "TYPE": error_type}
                 else:
-                    # Append a new record if no matching record is found
-                    new_history_records.append({
-                        "TANGGAL INPUT": now.strftime('%d/%m/%Y %H:%M:%S'),
-                        "HARI": days_in_indonesian[now.strftime("%A")],
-                        "TANGGAL": start_time.split(' ')[0],
-                        "JAM": start_time.split(' ')[1],
-                        "FREQUENCY": 1,
-                        "ID_ATM": id_atm,
-                        "MERK_ATM": merk_atm,
-                        "NAMA_ATM": nama_atm,
-                        "TIPE_PERMASALAHAN": error_type,
-                        "PERMASALAHAN": problem_details,
-                        "TINDAK LANJUT OFFICER FDS": "",
-                        "TINDAK LANJUT PIC": "",
-                        "KETERANGAN": "",
-                        "PROGRES_PERBAIKAN_ATM": "",
-                        "PIC": pic_name,
-                        "Unit Kerja": nama_cabang,
-                        "Nomor Telepon": phone,
-                        "UPDATED_AT": now,
-                        "STATUS": ""
-                    })
-
-                # Append details to the message dictionary
-                messages[pic_name].append({
-                    "nama_cabang": nama_cabang,
+                    print(f"No match found for ID_ATM {id_atm}")
+                    not_found_record = {"ID_ATM": id_atm, "NAMA_ATM": nama_atm, "Problem Details": problem_details, "TYPE": error_type}
+                not_found.append(not_found_record)
+                output.write(NOT_FOUND_SHEET, not_found_record)
+                continue
+            matched_problems.append((by_name, id_atm, nama_atm, problem_details, start_time, error_type, match))
+        stage["problems"] = len(problems)
+        stage["matched"] = len(matched_problems)
+        stage["not_found"] = len(not_found) - not_found_before
+
+    if options.incident_threshold:
+        with metrics.stage('branch_correlation') as stage:
+            problem_count = len(matched_problems)
+            matched_problems, incidents = correlate_branch_incidents(
+                matched_problems, options.incident_threshold, options.incident_window, clock
+            )
+            # Incidents are part of the report, so their history rows stay open
+            for by_name, id_atm, nama_atm, problem_details, start_time, error_type, match in incidents:
+                existing_problems_set.add((id_atm, error_type, problem_details))
+            if incidents:
+                print(f"Collapsed {problem_count - len(matched_problems) + len(incidents)} outage problems into {len(incidents)} branch incidents")
+            stage["incidents"] = len(incidents)
+            stage["problems"] = len(matched_problems)
+
+    with metrics.stage('history_reconcile') as stage:
+        # Load the history data unless the caller already holds it in memory
+        history_month = history_sheet_name(clock())
+        if history_df is None:
+            if history_store is not None:
+                history_df = history_store.load_month(history_month)
+            else:
+                history_df = load_history(clock(), options.history_path)
+        # Parse datetimes and IDs in bulk, keeping problematic rows aside
+        invalid_date_entries, invalid_id_entries = normalize_history(history_df)
+        for idx, date_str in invalid_date_entries["UPDATED_AT"].items():
+            print(f"Invalid date format at index {idx}: {date_str}")
+        for idx, id_atm in invalid_id_entries["ID_ATM"].items():
+            print(f"Invalid ID_ATM at index {idx}: {id_atm!r}")
+
+        # Diff the report against the previous one; problems reported by name
+        # aren't tracked in the snapshot, so those reports use all of history
+        report_keys = {key_hash(key) for key in existing_problems_set}
+        delta = None
+        if snapshot is not None and not any(by_name for by_name, *_ in matched_problems):
+            delta = snapshot.delta(history_month, len(history_df), report_keys)
+            if delta is not None and not snapshot_labels_match(history_df, delta.labels):
+                print("History was changed since the last report, reconciling against all of it")
+                delta = None
+
+        # Index the latest history row for each problem key, only of the
+        # report's problems when the snapshot knows where their rows are
+        if delta is None:
+            history_by_id = HistoryIndex(history_df, HISTORY_KEY_COLUMNS)
+            history_by_name = HistoryIndex(history_df, ["NAMA_ATM", "TIPE_PERMASALAHAN", "PERMASALAHAN"])
+        else:
+            history_by_id = HistoryIndex(history_df, HISTORY_KEY_COLUMNS, [
+                label for key in delta.new | delta.persisting for label in delta.labels.get(key, ())
+            ])
+            history_by_name = HistoryIndex(history_df, ["NAMA_ATM", "TIPE_PERMASALAHAN", "PERMASALAHAN"], [])
+
+        # A problem already in history today bumps its frequency; otherwise it gets a new row
+        frequencies = []  # FREQUENCY of each matched problem after this run
+        for by_name, id_atm, nama_atm, problem_details, start_time, error_type, match in matched_problems:
+            history_index = history_by_name if by_name else history_by_id
+            history_key = (nama_atm if by_name else id_atm, error_type, problem_details)
+            latest_record = history_index.find_latest(history_key)
+
+            now = clock()
+            if latest_record is not None and not bedahari(now, latest_record[1]):
+                history_index.bump_frequency(history_key, now)
+                frequencies.append(int(history_df.at[latest_record[0], "FREQUENCY"]))
+            else:
+                new_history_records.append(
+                    new_history_record(now, start_time, id_atm, nama_atm, error_type, problem_details, match)
+                )
+                frequencies.append(1)
+
+        # Set STATUS to DONE for records in history that are not in the current report
+        if delta is None:
+            history_by_id.mark_done_except(existing_problems_set)
+        else:
+            history_by_id.mark_done([label for key in delta.resolved for label in delta.labels.get(key, ())])
+            stage.update((f"report_{kind}", count) for kind, count in delta.counts().items())
+        bumped_labels = history_by_id.bumped_labels | history_by_name.bumped_labels
+        stage["history_rows"] = len(history_df)
+        stage["invalid_dates"] = len(invalid_date_entries)
+        stage["invalid_ids"] = len(invalid_id_entries)
+        stage["new"] = len(new_history_records)
+        stage["bumped"] = len(bumped_labels)
+        stage["done"] = len(history_by_id.done_labels)
+
+    with metrics.stage('message_build') as stage:
+        # Leave out problems the PIC was already told about and that haven't changed since
+        suppression_keys = [
+            (match["PIC_NAME"], nama_atm if by_name else id_atm, error_type, problem_details)
+            for by_name, id_atm, nama_atm, problem_details, start_time, error_type, match in matched_problems
+        ]
+        if suppression is not None:
+            send_keys, suppressed = suppression.filter(zip(suppression_keys, frequencies), clock())
+            print(f"Suppressed {suppressed} repeat problems already sent to their PIC")
+        else:
+            send_keys, suppressed = set(suppression_keys), 0
+
+        sent_problems = []
+        for suppression_key, frequency, (by_name, id_atm, nama_atm, problem_details, start_time, error_type, match) in zip(suppression_keys, frequencies, matched_problems):
+            # Append details to the message dictionary
+            if suppression_key in send_keys:
+                sent_problems.append((suppression_key, frequency))
+                messages[match["PIC_NAME"]].append({
+                    "nama_cabang": match["NAMA_CABANG"],
                     "nama_atm": nama_atm,
                     "id_atm": id_atm,
                     "problem_details": problem_details,
-                    "phone": phone,
+                    "phone": match["PHONE"],
                     "type": error_type
                 })
 
-                # Create report down message if the problem is "Problem Down"
-                if error_type == "Problem Down":
+            # Create report down message if the problem is "Problem Down"
+            if error_type == "Problem Down":
+                if by_name:
+                    report_down_messages.append(f"{nama_atm} dengan {problem_details.split(' : ')[-1]}")
+                else:
                     report_down_messages.append(
                         f"({nama_atm}) dengan {problem_details.split(' : ')[-1]} ( *menunggu konfirmasi pihak pengelola* )"
                     )
-            else:
-                print(f"No match found for ID_ATM {id_atm}")
-                not_found.append({"ID_ATM": id_atm, "NAMA_ATM": nama_atm, "Problem Details": problem_details, "TYPE": error_type})
-        elif "ATM_NAME" in problem:
-            atm_name = problem["ATM_NAME"]
-            problem_details = problem["PROBLEM"]
-            start_time = problem.get("START_TIME", datetime.now().strftime('%d/%m/%Y %H:%M:%S'))
-            error_type = problem["TYPE"]
-
-            # Find the matching row in the Excel data
-            match = atm_info[atm_info["NAMA_ATM"] == atm_name]
-
-            if not match.empty:
-                nama_cabang = match.iloc[0]["NAMA_CABANG"]
-                pic_name = match.iloc[0]["PIC_NAME"]
-                phone = match.iloc[0]["PHONE"]
-                merk_atm = match.iloc[0]["MERK_ATM"]
-
-                # Check if the problem already exists in the history with the same NAMA_ATM, TIPE_PERMASALAHAN, PERMASALAHAN
-                existing_record = history_df[
-                    (history_df["NAMA_ATM"] == atm_name) &
-                    (history_df["TIPE_PERMASALAHAN"] == error_type) &
-                    (history_df["PERMASALAHAN"] == problem_details)
-                ].sort_values(by="UPDATED_AT", ascending=False)
-
-                now = datetime.now()
-                if not existing_record.empty:
-                    latest_record = existing_record.iloc[0]
-                    updated_at = latest_record["UPDATED_AT"]
-                    if bedahari(now, updated_at):
-                        new_history_records.append({
-                            "TANGGAL INPUT": now.strftime('%d/%m/%Y %H:%M:%S'),
-                            "HARI": days_in_indonesian[now.strftime("%A")],
-                            "TANGGAL": start_time.split(' ')[0],
-                            "JAM": start_time.split(' ')[1],
-                            "FREQUENCY": 1,
-                            "ID_ATM": "",  # Assuming no ID available for ATM_NAME section
-                            "MERK_ATM": merk_atm,
-                            "NAMA_ATM": atm_name,
-                            "TIPE_PERMASALAHAN": error_type,
-                            "PERMASALAHAN": problem_details,
-                            "TINDAK LANJUT OFFICER FDS": "",
-                            "TINDAK LANJUT PIC": "",
-                            "KETERANGAN": "",
-                            "PROGRES_PERBAIKAN_ATM": "",
-                            "PIC": pic_name,
-                            "Unit Kerja": nama_cabang,
-                            "Nomor Telepon": phone,
-                            "UPDATED_AT": now,
-                            "STATUS": ""
-                        })
-                    else:
-                        new_frequency = latest_record["FREQUENCY"] + 1
-                        history_df.loc[latest_record.name, "FREQUENCY"] = new_frequency
-                        history_df.loc[latest_record.name, "UPDATED_AT"] = now
-                else:
-                    # Append a new record if no matching record is found
-                    new_history_records.append({
-                        "TANGGAL INPUT": now.strftime('%d/%m/%Y %H:%M:%S'),
-                        "HARI": days_in_indonesian[now.strftime("%A")],
-                        "TANGGAL": start_time.split(' ')[0],
-                        "JAM": start_time.split(' ')[1],
-                        "FREQUENCY": 1,
-                        "ID_ATM": "",  # Assuming no ID available for ATM_NAME section
-                        "MERK_ATM": merk_atm,
-                        "NAMA_ATM": atm_name,
-                        "TIPE_PERMASALAHAN": error_type,
-                        "PERMASALAHAN": problem_details,
-                        "TINDAK LANJUT OFFICER FDS": "",
-                        "TINDAK LANJUT PIC": "",
-                        "KETERANGAN": "",
-                        "PROGRES_PERBAIKAN_ATM": "",
-                        "PIC": pic_name,
-                        "Unit Kerja": nama_cabang,
-                        "Nomor Telepon": phone,
-                        "UPDATED_AT": now,
-                        "STATUS": ""
-                    })
-
-                # Append details to the message dictionary
-                messages[pic_name].append({
-                    "nama_cabang": nama_cabang,
-                    "nama_atm": atm_name,
-                    "id_atm": "",  # Assuming no ID available for ATM_NAME section
-                    "problem_details": problem_details,
-                    "phone": phone,
-                    "type": error_type
-                })
 
-                # Create report down message if the problem is "Problem Down"
-                if error_type == "Problem Down":
-                    report_down_messages.append(
-                        f"{atm_name} dengan {problem_details.split(' : ')[-1]}"
-                    )
-            else:
-                print(f"No match found for ATM_NAME {atm_name}")
-                not_found.append({"ATM_NAME": atm_name, "Problem Details": problem_details, "TYPE": error_type})
-    
-    # Set STATUS to DONE for records in history that are not in the current report
-    for index, row in history_df.iterrows():
-        if (row["ID_ATM"], row["TIPE_PERMASALAHAN"], row["PERMASALAHAN"]) not in existing_problems_set:
-            history_df.at[index, "PROGRES_PERBAIKAN_ATM"] = "DONE"
-
-    # Combine messages by pic_name
-    combined_messages = []
-    for pic_name, details in messages.items():
-        unqueDetails = removeDuplicate(details)
-        sortedDetails = sortedByAtmId(details)
-        phone = details[0]['phone']
-        atm_details = ', '.join([f"{d['nama_atm']} ID {d['id_atm']}" for d in unqueDetails])
-        problem_details_combined = '\n\n'.join([d['problem_details'] for d in sortedDetails])
-        nama_cabang_list = list(set([d['nama_cabang'] for d in details]))  # Get unique branch names
-        nama_cabang_str = ', '.join(nama_cabang_list)
-
-        # Create the combined message text
-        message = (
-            f"{greeting},\n\n"
-            f"Bapak/Ibu {pic_name},\n\n"
-            f"Perkenalkan, saya {os.getenv('PIC_FDS', 'Made Bramasta Vikana Putra')}, dari DJA Kantor Pusat. Disampaikan bahwa ATM dengan details *{atm_details}* yang masih dalam kelolaan *{nama_cabang_str}* mendapatkan peringatan dengan rincian sebagai berikut:\n\n"
-            f"{problem_details_combined}\n\n"
-            "Terima kasih atas perhatian dan kerjasamanya."
+        # Combine messages by pic_name
+        combined_messages = []
+        pic_fds = os.getenv('PIC_FDS', 'Made Bramasta Vikana Putra')
+        for pic_name, details in messages.items():
+            phone = details[0]['phone']
+            atm_details, problem_details_combined, nama_cabang_str = assemble_pic_details(details)
+
+            # Create the combined message text
+            message = (
+                f"{greeting},\n\n"
+                f"Bapak/Ibu {pic_name},\n\n"
+                f"Perkenalkan, saya {pic_fds}, dari DJA Kantor Pusat. Disampaikan bahwa ATM dengan details *{atm_details}* yang masih dalam kelolaan *{nama_cabang_str}* mendapatkan peringatan dengan rincian sebagai berikut:\n\n"
+                f"{problem_details_combined}\n\n"
+                "Terima kasih atas perhatian dan kerjasamanya."
+            )
+
+            # URL encode the message
+            encoded_message = urllib.parse.quote(message)
+
+            # Create WhatsApp URL with the phone as 62... digits, whichever way info.xlsx wrote it
+            whatsapp_url = f"https://web.whatsapp.com/send?phone={whatsapp_phone(phone)}&text={encoded_message}"
+
+            # Append the combined message to the list
+            combined_message = {
+                "PIC_NAME": pic_name,
+                "Message": message,
+                "PHONE": phone,
+                "WhatsApp_URL": whatsapp_url,
+                # Dispatched as the most urgent of the PIC's problems
+                "TYPE": min((detail['type'] for detail in details), key=dispatch_priority),
+                "BATCH": batch
+            }
+            combined_messages.append(combined_message)
+            output.write(FOUND_SHEET, combined_message)
+
+        # Create the report down message text
+        report_down_message_text = (
+            f"{greeting}, izin untuk report ATM Down pada {days_in_indonesian[clock().strftime('%A')]}, {clock().strftime('%d')} {months_in_indonesian[clock().strftime('%m')]} {clock().strftime('%Y')} periode {bulatkanwaktu(clock() - timedelta(hours=1))} - {bulatkanwaktu(clock())}. Berikut rinciannya:\n\n"
+            + "\n".join([f"{i+1}. {msg}" for i, msg in enumerate(report_down_messages)])
         )
-
-        # URL encode the message
-        encoded_message = urllib.parse.quote(message)
-
-        # Create WhatsApp URL
-        whatsapp_url = f"https://web.whatsapp.com/send?phone={phone}&text={encoded_message}"
-
-        # Append the combined message to the list
-        combined_messages.append({
-            "PIC_NAME": pic_name,
-            "Message": message,
-            "PHONE": phone,
-            "WhatsApp_URL": whatsapp_url,
-            "TYPE": details[0]['type']
-        })
-
-    # Convert the results to a DataFrame
-    results_df = pd.DataFrame(combined_messages)
-    not_found_df = pd.DataFrame(not_found)
-    above_ten_percent_df = pd.DataFrame(above_ten_percent)
-
-    # Create the report down message text
-    print(datetime.now())
-    report_down_message_text = (
-        f"{greeting}, izin untuk report ATM Down pada {days_in_indonesian[datetime.now().strftime('%A')]}, {datetime.now().strftime('%d')} {months_in_indonesian[datetime.now().strftime('%m')]} {datetime.now().strftime('%Y')} periode {bulatkanwaktu(datetime.now() - timedelta(hours=1))} - {bulatkanwaktu(datetime.now())}. Berikut rinciannya:\n\n"
-        + "\n".join([f"{i+1}. {msg}" for i, msg in enumerate(report_down_messages)])
+        output.write(REPORT_DOWN_SHEET, {"Report Down": report_down_message_text})
+        stage["messages"] = len(combined_messages)
+        stage["suppressed"] = suppressed
+        stage["report_down"] = len(report_down_messages)
+
+    forecast_rows = []
+    if cash_forecast is not None:
+        with metrics.stage('cash_forecast') as stage:
+            cash_forecast.observe(cash_observations, clock())
+            forecast_rows = cash_forecast.forecast(list(cash_observations), clock(), options.depletion_horizon, cash_names)
+            cash_forecast.save()
+            output.write_many(CASH_FORECAST_SHEET, forecast_rows)
+            if forecast_rows:
+                print(f"{len(forecast_rows)} ATMs will run out of cash within {options.depletion_horizon:g} hours")
+            stage["observed"] = len(cash_observations)
+            stage["tracked"] = len(cash_forecast.ids)
+            stage["due"] = len(forecast_rows)
+
+    # Finish the Excel file, unless the caller only wants history
+    if excel_sink is not None:
+        with metrics.stage('excel_export') as stage:
+            excel_sink.close()
+            stage["rows"] = len(combined_messages) + len(not_found) + len(above_ten_percent) + len(forecast_rows) + 1
+
+    with metrics.stage('history_write') as stage:
+        # Append new history records
+        new_history_df = pd.DataFrame(new_history_records)
+        if history_store is not None:
+            # Only the changed and new rows are written; new rows keep their store ids as labels
+            frequency_updates = [
+                (label, history_df.at[label, "FREQUENCY"], history_df.at[label, "UPDATED_AT"]) for label in bumped_labels
+            ]
+            new_history_df.index = history_store.apply_changes(
+                history_month, new_history_records, frequency_updates, history_by_id.done_labels
+            )
+            updated_history_df = append_history(history_df, new_history_df)
+        else:
+            updated_history_df = append_history(history_df, new_history_df, ignore_index=True)
+
+        # Restore invalid datetime entries
+        if not invalid_date_entries.empty:
+            updated_history_df.loc[invalid_date_entries.index, "UPDATED_AT"] = invalid_date_entries["UPDATED_AT"]
+
+        if history_store is None:
+            write_history_sheet(options.history_path, history_month, updated_history_df)
+
+        # Remember this report's problems and where their history rows are
+        if snapshot is not None:
+            if delta is not None:
+                added_labels = defaultdict(list)
+                for label, record in zip(updated_history_df.index[len(history_df):], new_history_records):
+                    added_labels[key_hash(tuple(record[column] for column in HISTORY_KEY_COLUMNS))].append(int(label))
+                snapshot.commit(history_month, len(updated_history_df), report_keys, added_labels)
+            else:
+                snapshot.reset(history_month, len(updated_history_df), report_keys, history_key_labels(updated_history_df))
+        stage["rows"] = len(updated_history_df)
+    print("History updated successfully.")
+    return MessageRun(
+        combined_messages, not_found, above_ten_percent, report_down_message_text, updated_history_df, forecast_rows,
+        sent_problems, clock()
     )
 
-    # Save the results to a new Excel file with multiple sheets
-    with pd.ExcelWriter(output_path) as writer:
-        results_df.to_excel(writer, sheet_name='Found', index=False)
-        not_found_df.to_excel(writer, sheet_name='Not Found', index=False)
-        above_ten_percent_df.to_excel(writer, sheet_name='Above 10 Percent', index=False)
+# Save the results to a new Excel file with multiple sheets
+def save_messages_workbook(output_path, messages, not_found, above_ten_percent, report_down_message):
+    with ExcelSink(output_path) as sink:
+        sink.write_many(FOUND_SHEET, messages)
+        sink.write_many(NOT_FOUND_SHEET, not_found)
+        sink.write_many(ABOVE_TEN_PERCENT_SHEET, above_ten_percent)
         # Save the report down message to a new sheet
-        pd.DataFrame([{"Report Down": report_down_message_text}]).to_excel(writer, sheet_name='report_down', index=False)
-
-    print(f"Messages saved to {output_path}")
-
-    # Append new history records to history.xlsx
-    new_history_df = pd.DataFrame(new_history_records)
-    updated_history_df = pd.concat([history_df, new_history_df], ignore_index=True)
-
-    # Restore invalid datetime entries
-    for idx, date_str in invalid_date_entries:
-        updated_history_df.at[idx, "UPDATED_AT"] = date_str
-
-    updated_history_df.to_excel('history.xlsx', sheet_name= f"{months_in_indonesian[datetime.now().strftime('%m')]} 2024", index=False)
-    print("History updated successfully.")
+        sink.write(REPORT_DOWN_SHEET, {"Report Down": report_down_message})
+
+# One pass over a PIC's details: the first detail of each ATM in report order
+# for the header, every problem grouped by ATM and ordered by numeric ID for
+# the body, and the set of branches involved
+def assemble_pic_details(details):
+    details_by_atm = defaultdict(list)
+    nama_cabang_set = set()
+    for d in details:
+        details_by_atm[d['id_atm']].append(d)
+        nama_cabang_set.add(d['nama_cabang'])
+
+    atm_details = ', '.join(f"{group[0]['nama_atm']} ID {id_atm}" for id_atm, group in details_by_atm.items())
+    problem_details_combined = '\n\n'.join(
+        d['problem_details'] for id_atm in sorted(details_by_atm, key=int) for d in details_by_atm[id_atm]
+    )
+    nama_cabang_str = ', '.join(nama_cabang_set)  # Get unique branch names
+    return atm_details, problem_details_combined, nama_cabang_str
+
+# Byte offset into report.txt of the first dump not yet processed, saved after
+# every processed dump so a restarted follower resumes where it stopped
+class FollowCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.inode = None
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = cls(path)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                data = json.load(file)
+            checkpoint.offset = data['offset']
+            checkpoint.inode = data['inode']
+        return checkpoint
+
+    def save(self):
+        data = {'offset': self.offset, 'inode': self.inode}
+        with atomic_write(self.path) as file:
+            json.dump(data, file)
+
+    def reset(self, inode, offset=0):
+        self.offset = offset
+        self.inode = inode
+
+# Yield (line, size in bytes) for the complete lines after offset. A trailing
+# line without a newline is still being written and is left for the next poll.
+def read_appended_lines(text_file_path, offset):
+    encoding = locale.getpreferredencoding(False)
+    with open(text_file_path, 'rb') as file:
+        file.seek(offset)
+        for raw_line in file:
+            if not raw_line.endswith(b'\n'):
+                break
+            yield raw_line.decode(encoding).replace('\r\n', '\n'), len(raw_line)
+
+# Byte offset of the last dump in the report
+def last_block_offset(text_file_path):
+    blocks = ReportBlocks()
+    offset = 0
+    for line, size in read_appended_lines(text_file_path, 0):
+        blocks.feed(line, offset)
+        offset += size
+    return blocks.starts[-1] if blocks.starts else 0
+
+# Hands each dump appended to report.txt to handle_block as a list of lines.
+# A dump is complete once the next one starts; the last dump in the file is
+# taken when it has reached its last section and the size held for a poll,
+# or when the size has held for settle seconds.
+class ReportFollower:
+    def __init__(self, text_file_path, checkpoint, handle_block, settle=60.0):
+        self.text_file_path = text_file_path
+        self.checkpoint = checkpoint
+        self.handle_block = handle_block
+        self.settle = settle
+        self.last_size = None
+        self.changed_at = None
+
+    # Handle every complete dump after the checkpoint and return how many there were
+    def poll(self, now=None):
+        now = time.monotonic() if now is None else now
+        try:
+            file_stat = os.stat(self.text_file_path)
+        except FileNotFoundError:
+            # The report is being rotated; wait for the new file
+            self.last_size = None
+            return 0
+
+        if self.checkpoint.inode is None:
+            # Without a checkpoint only the newest dump is still current
+            offset = last_block_offset(self.text_file_path)
+            print(f"No checkpoint, following {self.text_file_path} from its last report block at byte {offset}")
+            self.checkpoint.reset(file_stat.st_ino, offset)
+            self.checkpoint.save()
+        elif self.checkpoint.inode != file_stat.st_ino or file_stat.st_size < self.checkpoint.offset:
+            # A new inode means the file was rotated, a smaller size means it was truncated
+            print(f"{self.text_file_path} was rotated or truncated, reading from the start")
+            self.checkpoint.reset(file_stat.st_ino)
+            self.checkpoint.save()
+
+        quiet = file_stat.st_size == self.last_size
+        if not quiet:
+            self.last_size = file_stat.st_size
+            self.changed_at = now
+        settled = now - self.changed_at >= self.settle
+        if file_stat.st_size <= self.checkpoint.offset:
+            return 0
+
+        lines = list(read_appended_lines(self.text_file_path, self.checkpoint.offset))
+        blocks = ReportBlocks()
+        for number, (line, _) in enumerate(lines):
+            blocks.feed(line, number)
+        bounds = [0] + blocks.starts + [len(lines)]
+        handled = 0
+        for start, end in zip(bounds, bounds[1:]):
+            if end == len(lines) and not (quiet and blocks.complete or settled):
+                break
+            block = lines[start:end]
+            if any(line.strip() for line, _ in block):
+                self.handle_block([line for line, _ in block])
+                handled += 1
+            self.checkpoint.offset += sum(size for _, size in block)
+            self.checkpoint.save()
+        return handled
+
+# Tail report.txt and run the pipeline on each dump appended to it, keeping
+# the ATM directory and history in memory between dumps
+def follow_report(text_file_path, atm_directory, output_path, checkpoint_path, interval=5.0, settle=60.0, history_store=None, outbox=None, metrics_log=None, prometheus_path=None, sink_specs=(), options=None):
+    options = options if options is not None else MessageOptions()
+    history_df = None
+    history_sheet = None
+
+    def handle_block(lines):
+        nonlocal history_df, history_sheet
+        metrics = RunMetrics()
+        parse_stats = ParseStats()
+        with metrics.stage('parse') as stage:
+            problems, not_found, above_ten_percent = process_text_file(lines, atm_directory, parse_stats)
+            stage.update(parse_stats.counts())
+        print(f"Parsed {parse_stats.lines} new lines in {parse_stats.elapsed:.3f}s ({parse_stats.lines_per_second:.0f} lines/s)")
+
+        # Reload history only when the month sheet changes
+        now = datetime.now()
+        if history_sheet != history_sheet_name(now):
+            history_df = None
+        with SinkGroup(open_sink(spec) for spec in sink_specs) as sinks:
+            message_run = create_messages_and_save_to_excel(
+                problems, not_found, above_ten_percent, atm_directory, output_path, history_df, history_store,
+                metrics=metrics, sinks=sinks, options=options
+            )
+        history_df = message_run.history_df
+        queue_messages(message_run, outbox, options.suppression)
+        history_sheet = history_sheet_name(now)
+        publish_metrics(metrics, metrics_log, prometheus_path)
+
+    follower = ReportFollower(text_file_path, FollowCheckpoint.load(checkpoint_path), handle_block, settle)
+    while True:
+        follower.poll()
+        time.sleep(interval)
+
+# Archived reports carry their capture time in the file name, e.g.
+# report_20241015_0905.txt or report-2024-10-15T09-05-00.txt
+REPORT_TIMESTAMP_PATTERN = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})[T_ -]?(\d{2})[:.-]?(\d{2})(?:[:.-]?(\d{2}))?')
+
+def report_timestamp(path):
+    match = REPORT_TIMESTAMP_PATTERN.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime(*(int(group) if group else 0 for group in match.groups()))
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+# Each replay worker process receives the ATM directory once, not per report
+_replay_directory = None
+
+def _init_replay_worker(atm_directory):
+    global _replay_directory
+    _replay_directory = atm_directory
+
+def _parse_replay_report(text_file_path):
+    return process_text_file(text_file_path, _replay_directory)
+
+# Rebuild history from a directory of archived reports. Reports are parsed in
+# a process pool, then applied to history strictly in timestamp order, each
+# with the clock set to its own capture time.
+def replay_reports(report_dir, atm_directory, history_store=None, workers=None):
+    timed_paths = sorted(
+        (report_timestamp(os.path.join(report_dir, name)), os.path.join(report_dir, name))
+        for name in os.listdir(report_dir) if name.endswith('.txt')
+    )
+    print(f"Replaying {len(timed_paths)} reports from {report_dir}")
+
+    history_df = None
+    history_sheet = None
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_replay_worker, initargs=(atm_directory,)) as executor:
+        # map() yields results in submission order while later reports are still being parsed
+        parsed_reports = executor.map(_parse_replay_report, [path for _, path in timed_paths], chunksize=4)
+        for (report_time, text_file_path), (problems, not_found, above_ten_percent) in zip(timed_paths, parsed_reports):
+            if history_sheet != history_sheet_name(report_time):
+                history_df = None
+            history_df = create_messages_and_save_to_excel(
+                problems, not_found, above_ten_percent, atm_directory, None, history_df, history_store, report_time
+            ).history_df
+            history_sheet = history_sheet_name(report_time)
+            print(f"Replayed {text_file_path} as {report_time:%d/%m/%Y %H:%M:%S}")
+
+    print(f"Replayed {len(timed_paths)} reports in {time.perf_counter() - started:.1f}s")
+
+# Append the run to the JSON log and refresh the Prometheus textfile; either path may be None
+def publish_metrics(metrics, metrics_log=None, prometheus_path=None):
+    metrics.capture_tracemalloc_top()
+    if metrics_log:
+        metrics.append_json_log(metrics_log)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
+    print("Stages: " + ", ".join(f"{stage['stage']} {stage['seconds']:.3f}s" for stage in metrics.stages))
+
+# The workbook path among --sink specs, which create_messages_and_save_to_excel
+# writes and times itself, and the remaining specs
+def split_sink_specs(sink_specs, default_output_path):
+    output_path = None
+    other_specs = []
+    for spec in sink_specs:
+        kind, _, path = spec.partition(':')
+        if kind == 'xlsx' and output_path is None:
+            output_path = path or default_output_path
+        else:
+            other_specs.append(spec)
+    return output_path, other_specs
+
+# Command line switches of the MessageOptions stages, shared with service.py
+def add_message_options(parser):
+    parser.add_argument('--suppression-db', default='suppression.db',
+                        help="cache of problems already sent to each PIC, empty to message every problem every run")
+    parser.add_argument('--suppress-ttl', action='append', metavar='TYPE=MINUTES',
+                        help="minutes a sent problem of TYPE stays quiet, e.g. 'Problem Down=30'; repeatable")
+    parser.add_argument('--snapshot-db', default='snapshot.db',
+                        help="problems of the previous report, to reconcile history by delta; empty to always use all of history")
+    parser.add_argument('--incident-threshold', type=int, default=5,
+                        help="ATMs of one branch down in the same window that become one branch incident, 0 to disable")
+    parser.add_argument('--incident-window', type=float, default=30, help="minutes of start time grouped into one branch incident")
+    parser.add_argument('--cash-forecast', default='cash_forecast.npz',
+                        help="recent Saldo di Bawah Pagu observations per ATM, empty to skip the cash forecast")
+    parser.add_argument('--depletion-horizon', type=float, default=24, help="hours ahead the Cash Forecast sheet looks")
 
-def removeDuplicate(details):
-    temp = []
-    datatemp = []
-    for b in range(len(details)):
-        if details[b]['id_atm'] not in temp:
-            datatemp.append(details[b])
-        temp.append(details[b]['id_atm'])
-    return datatemp
-        
-def sortedByAtmId(details):
-    temp = []
-    datatemp = []
-    sortedTemp = []
-    for b in range(len(details)):
-        if details[b]['id_atm'] not in temp:
-            datatemp.append(int(details[b]['id_atm']))
-        temp.append(details[b]['id_atm'])
-
-    datatemp.sort()
-
-    for b in range(len(datatemp)):
-        for c in range(len(details)):
-            if str(datatemp[b]) == details[c]['id_atm']:
-                sortedTemp.append(details[c]) 
-                                    
-    return sortedTemp
-
-        
-    
 # Main function to run the script
-def main():
-    text_file_path = 'report.txt'  # Path to the text file
-    atm_info_path = 'info.xlsx'  # Path to the Excel file
-    output_path = 'atm_problem_messages.xlsx'  # Path to the output Excel file
-
-    # Load the Excel data
-    atm_info = pd.read_excel(atm_info_path, sheet_name='info')
-    exceptions = pd.read_excel(atm_info_path, sheet_name='exception')['ID_ATM'].tolist()
-    
-    atm_info.columns = atm_info.columns.str.strip()  # Remove extra spaces in column names
-    atm_info.columns = atm_info.columns.str.upper()  # Convert columns to uppercase to avoid case issues
-    
-    problems, not_found, above_ten_percent = process_text_file(text_file_path, atm_info, exceptions)
-    print(f"Parsed problems: {problems}")
-    print(f"Not found: {not_found}")
-    create_messages_and_save_to_excel(problems, not_found, above_ten_percent, atm_info_path, output_path)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build WhatsApp messages for ATM problems in report.txt")
+    parser.add_argument('--report', default='report.txt', help="report text file")
+    parser.add_argument('--info', default='info.xlsx', help="ATM info workbook with info and exception sheets")
+    parser.add_argument('--history-xlsx', default='history.xlsx',
+                        help="workbook imported once into an empty history store, and history itself when there is no store")
+    parser.add_argument('--history-db', default='history.db', help="history store, empty to keep history in --history-xlsx alone")
+    parser.add_argument('--outbox', default='outbox.db', help="messages waiting for dispatcher.py")
+    parser.add_argument('--follow', action='store_true', help="keep running and process blocks appended to report.txt")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between polls in follow mode")
+    parser.add_argument('--settle', type=float, default=60.0,
+                        help="seconds the report must hold its size before a dump that looks unfinished is processed in follow mode")
+    parser.add_argument('--export-history', metavar='XLSX', help="write every history month to a workbook and exit")
+    parser.add_argument('--import-manual', metavar='XLSX',
+                        help="take the officer columns (KETERANGAN, TINDAK LANJUT, PROGRES) of an --export-history workbook and exit")
+    parser.add_argument('--replay', metavar='DIR', help="rebuild history from the timestamped reports in DIR and exit")
+    parser.add_argument('--workers', type=int, default=None, help="parser processes for --replay")
+    parser.add_argument('--metrics-log', default='sms_runs.jsonl', help="JSON lines file that gets one entry per run, empty to disable")
+    parser.add_argument('--prometheus', default='sms_metrics.prom', help="Prometheus textfile rewritten after every run, empty to disable")
+    parser.add_argument('--profile', metavar='PSTATS', help="run under cProfile and dump the stats to PSTATS")
+    parser.add_argument('--trace-memory', action='store_true', help="track Python heap peaks per stage with tracemalloc")
+    parser.add_argument('--sink', action='append', metavar='KIND[:PATH]',
+                        help="where to write the output rows: xlsx, csv, jsonl, parquet or stdout; repeatable (default xlsx)")
+    add_message_options(parser)
+    args = parser.parse_args(argv)
+    args.sink = args.sink or ['xlsx']
+    if not args.history_db and (args.export_history or args.import_manual or args.replay):
+        parser.error("--export-history, --import-manual and --replay need a --history-db")
+
+    # Keep stdout clean for the JSON lines when they are piped on
+    if any(spec.partition(':')[0] == 'stdout' for spec in args.sink):
+        with contextlib.redirect_stdout(sys.stderr):
+            profile_run(args)
+    else:
+        profile_run(args)
+
+# Run under tracemalloc and cProfile when asked
+def profile_run(args):
+    if args.trace_memory:
+        tracemalloc.start()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            run(args)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"Profile written to {args.profile}")
+    else:
+        run(args)
+
+# One sms.py invocation with parsed arguments
+def run(args):
+    text_file_path = args.report
+    atm_info_path = args.info
+    output_path, sink_specs = split_sink_specs(args.sink, 'atm_problem_messages.xlsx')  # Excel file and other outputs
+    checkpoint_path = f"{text_file_path}.offset"  # Follow mode position in the text file
+    history_excel_path = args.history_xlsx
+    history_db_path = args.history_db
+    outbox_path = args.outbox
+
+    history_store = HistoryStore(history_db_path) if history_db_path else None
+    if history_store is not None and history_store.is_empty() and os.path.exists(history_excel_path):
+        imported = history_store.import_excel(history_excel_path)
+        print(f"Imported {imported} history rows from {history_excel_path} into {history_db_path}")
+
+    if args.export_history:
+        history_store.export_excel(args.export_history)
+        print(f"History exported to {args.export_history}")
+        return
+
+    if args.import_manual:
+        changed = history_store.import_manual_columns(args.import_manual)
+        print(f"Imported {changed} officer edits from {args.import_manual} into {history_db_path}")
+        return
+
+    outbox = Outbox(outbox_path)
+    options = MessageOptions.from_args(args)
+
+    # Load the reference data once and index it for both stages
+    metrics = RunMetrics()
+    with metrics.stage('reference_load') as stage:
+        atm_directory, history_df = load_reference_data(atm_info_path, history_store, history_path=history_excel_path)
+        stage["atms"] = len(atm_directory.records)
+        stage["history_rows"] = len(history_df)
+
+    if args.replay:
+        replay_reports(args.replay, atm_directory, history_store, args.workers)
+        return
+
+    if args.follow:
+        follow_report(
+            text_file_path, atm_directory, output_path, checkpoint_path, interval=args.interval, settle=args.settle,
+            history_store=history_store, outbox=outbox, metrics_log=args.metrics_log,
+            prometheus_path=args.prometheus, sink_specs=sink_specs, options=options
+        )
+        return
+
+    parse_stats = ParseStats()
+    with metrics.stage('parse') as stage:
+        problems, not_found, above_ten_percent = process_text_file(text_file_path, atm_directory, parse_stats)
+        stage.update(parse_stats.counts())
+        stage["problems"] = len(problems)
+        stage["not_found"] = len(not_found)
+        stage["above_ten_percent"] = len(above_ten_percent)
+    print(f"Parsed {parse_stats.lines} lines in {parse_stats.elapsed:.3f}s ({parse_stats.lines_per_second:.0f} lines/s)")
+    print(f"Parsed problems: {len(problems)}, not found: {len(not_found)}, above 10 percent: {len(above_ten_percent)}")
+    with SinkGroup(open_sink(spec) for spec in sink_specs) as sinks:
+        message_run = create_messages_and_save_to_excel(
+            problems, not_found, above_ten_percent, atm_directory, output_path, history_df, history_store,
+            metrics=metrics, sinks=sinks, options=options
+        )
+
+    # Queue the messages for dispatcher.py; already-recorded ones are ignored
+    queued = queue_messages(message_run, outbox, options.suppression)
+    print(f"Queued {queued} new messages in {outbox_path}")
+    publish_metrics(metrics, args.metrics_log, args.prometheus)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import sqlite3
+
+# Problem keys are (ID_ATM, TIPE_PERMASALAHAN, PERMASALAHAN), kept as 64-bit hashes
+def key_hash(key):
+    return hashlib.blake2b('\x1f'.join(str(part) for part in key).encode('utf-8'), digest_size=8).hexdigest()
+
+# How the problems of one report differ from the previous report's, plus the
+# history rows of every key involved
+class SnapshotDelta:
+    def __init__(self, new, persisting, resolved, labels):
+        self.new = new  # key hashes not in the previous report
+        self.persisting = persisting  # key hashes in both reports
+        self.resolved = resolved  # key hashes only in the previous report
+        self.labels = labels  # key hash -> history row labels of that key this month
+
+    def counts(self):
+        return {"new": len(self.new), "persisting": len(self.persisting), "resolved": len(self.resolved)}
+
+# The problem keys of the last processed report, per history month, with the
+# history rows each key has this month. Keys from earlier reports stay on as
+# inactive so a problem that comes back finds its rows without a history scan.
+# The month is read from SQLite once and then kept in memory; each run only
+# writes the keys that changed.
+class ReportSnapshot:
+    def __init__(self, path='snapshot.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot_month (month TEXT PRIMARY KEY, history_rows INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot_key ("
+                "month TEXT NOT NULL, key TEXT NOT NULL, active INTEGER NOT NULL, labels TEXT NOT NULL, "
+                "PRIMARY KEY (month, key))"
+            )
+        self.month = None
+        self.history_rows = None
+        self.active = set()
+        self.labels = {}
+
+    def close(self):
+        self.connection.close()
+
+    def _load(self, month):
+        if self.month == month:
+            return
+        self.month = month
+        row = self.connection.execute(
+            "SELECT history_rows FROM snapshot_month WHERE month = ?", (month,)
+        ).fetchone()
+        self.history_rows = row[0] if row is not None else None
+        self.active = set()
+        self.labels = {}
+        for key, active, labels in self.connection.execute(
+            "SELECT key, active, labels FROM snapshot_key WHERE month = ?", (month,)
+        ):
+            self.labels[key] = json.loads(labels)
+            if active:
+                self.active.add(key)
+
+    # The delta of report_keys against the last report, or None when there is
+    # no snapshot for the month or history has a row count the snapshot didn't leave
+    def delta(self, month, history_rows, report_keys):
+        self._load(month)
+        if self.history_rows is None or self.history_rows != history_rows:
+            return None
+        new = report_keys - self.active
+        persisting = report_keys & self.active
+        resolved = self.active - report_keys
+        labels = {key: self.labels[key] for key in new | persisting | resolved if key in self.labels}
+        return SnapshotDelta(new, persisting, resolved, labels)
+
+    # Record report_keys as the active set after a delta run; added_labels are
+    # the history rows this run appended, by key hash
+    def commit(self, month, history_rows, report_keys, added_labels):
+        self._load(month)
+        changed = (report_keys ^ self.active) | set(added_labels)
+        for key, labels in added_labels.items():
+            self.labels[key] = self.labels.get(key, []) + labels
+        self.active = set(report_keys)
+        self.history_rows = history_rows
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO snapshot_month (month, history_rows) VALUES (?, ?)", (month, history_rows)
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO snapshot_key (month, key, active, labels) VALUES (?, ?, ?, ?)",
+                [(month, key, key in self.active, json.dumps(self.labels.get(key, []))) for key in changed]
+            )
+
+    # Replace the month's snapshot after a run that reconciled against all of
+    # history; labels holds the rows of every key in the month's history
+    def reset(self, month, history_rows, report_keys, labels):
+        self.month = month
+        self.history_rows = history_rows
+        self.active = set(report_keys)
+        self.labels = dict(labels)
+        with self.connection:
+            # Only the current month is ever diffed against, so older months go too
+            self.connection.execute("DELETE FROM snapshot_key")
+            self.connection.execute("DELETE FROM snapshot_month")
+            self.connection.execute(
+                "INSERT INTO snapshot_month (month, history_rows) VALUES (?, ?)", (month, history_rows)
+            )
+            self.connection.executemany(
+                "INSERT INTO snapshot_key (month, key, active, labels) VALUES (?, ?, ?, ?)",
+                [(month, key, key in self.active, json.dumps(labels.get(key, []))) for key in self.active | set(labels)]
+            )
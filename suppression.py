@@ -0,0 +1,103 @@
+import sqlite3
+from bisect import bisect_right
+
+# How long a problem stays quiet after its PIC was messaged about it, per
+# TIPE_PERMASALAHAN, in minutes. Types not listed use DEFAULT_TTL_MINUTES.
+DEFAULT_TTL_MINUTES = 240
+TTL_MINUTES = {
+    'Problem Down': 60,
+    'NPM Problem': 60,
+    'Problem Supply Out': 120,
+    'Saldo di Bawah Pagu': 120,
+    'Problem Hardware': 240,
+    'ATM Warning': 480
+}
+
+# FREQUENCY levels at which a still-suppressed problem is sent again anyway,
+# e.g. the fifth report of the same fault today
+ESCALATION_FREQUENCIES = (5, 10, 20, 50)
+
+# Parse --suppress-ttl values of the form "TYPE=MINUTES" into a TTL_MINUTES override
+def parse_ttl_overrides(specs):
+    ttls = {}
+    for spec in specs or ():
+        error_type, separator, minutes = spec.rpartition('=')
+        if not separator or not error_type:
+            raise ValueError(f"Expected TYPE=MINUTES, got {spec!r}")
+        ttls[error_type] = float(minutes)
+    return ttls
+
+# Problems each PIC was last messaged about, in SQLite, so a problem that is
+# still in the report keeps quiet until its TTL runs out. A problem is sent
+# again sooner only when it escalates: its FREQUENCY in history has crossed
+# one of the escalation levels since the last send.
+class SuppressionCache:
+    def __init__(self, path='suppression.db', ttl_minutes=None, escalation_frequencies=ESCALATION_FREQUENCIES):
+        self.path = path
+        self.ttl_minutes = dict(TTL_MINUTES)
+        self.ttl_minutes.update(ttl_minutes or {})
+        self.escalation_frequencies = sorted(escalation_frequencies)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS suppression ("
+                "pic_name TEXT NOT NULL, id_atm TEXT NOT NULL, type TEXT NOT NULL, problem TEXT NOT NULL, "
+                "frequency INTEGER NOT NULL, sent_at REAL NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (pic_name, id_atm, type, problem))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS suppression_expiry ON suppression (expires_at)")
+
+    def close(self):
+        self.connection.close()
+
+    def ttl_seconds(self, error_type):
+        return self.ttl_minutes.get(error_type, DEFAULT_TTL_MINUTES) * 60
+
+    def escalated(self, sent_frequency, frequency):
+        levels = self.escalation_frequencies
+        return bisect_right(levels, frequency) > bisect_right(levels, sent_frequency)
+
+    # Drop entries whose TTL ran out; returns how many went
+    def evict_expired(self, now):
+        with self.connection:
+            return self.connection.execute(
+                "DELETE FROM suppression WHERE expires_at <= ?", (now.timestamp(),)
+            ).rowcount
+
+    # Split (key, frequency) pairs into the keys to send and the number
+    # suppressed. Nothing is remembered until record() is called with what was
+    # actually queued. A key is (PIC, ID_ATM, TIPE_PERMASALAHAN, PERMASALAHAN);
+    # ID_ATM is the ATM name for problems reported by name.
+    def filter(self, keyed_frequencies, now):
+        self.evict_expired(now)
+        send = set()
+        suppressed = 0
+        for key, frequency in keyed_frequencies:
+            stored_key = tuple(str(part) for part in key)
+            row = self.connection.execute(
+                "SELECT frequency FROM suppression "
+                "WHERE pic_name = ? AND id_atm = ? AND type = ? AND problem = ?",
+                stored_key
+            ).fetchone()
+            if row is not None and not self.escalated(row[0], frequency):
+                suppressed += 1
+                continue
+            send.add(key)
+        return send, suppressed
+
+    # Remember (key, frequency) pairs as sent at `now`, starting their TTL
+    def record(self, keyed_frequencies, now):
+        sent_at = now.timestamp()
+        rows = [
+            (*(str(part) for part in key), frequency, sent_at, sent_at + self.ttl_seconds(key[2]))
+            for key, frequency in keyed_frequencies
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO suppression "
+                "(pic_name, id_atm, type, problem, frequency, sent_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM suppression").fetchone()[0]
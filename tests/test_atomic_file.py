@@ -0,0 +1,26 @@
+import pytest
+
+from atomic_file import atomic_write
+
+def test_the_file_is_replaced_once_the_block_finishes(tmp_path):
+    path = tmp_path / 'metrics.prom'
+    path.write_text("old\n")
+
+    with atomic_write(path) as file:
+        file.write("new\n")
+        assert path.read_text() == "old\n"
+
+    assert path.read_text() == "new\n"
+    assert list(tmp_path.iterdir()) == [path]
+
+def test_a_failed_write_keeps_the_old_file(tmp_path):
+    path = tmp_path / 'forecast.npz'
+    path.write_bytes(b"old")
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, 'wb') as file:
+            file.write(b"half")
+            raise RuntimeError("disk full")
+
+    assert path.read_bytes() == b"old"
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,82 @@
+import math
+from datetime import datetime, timedelta
+
+from cash_forecast import CashForecast, parse_amount, parse_percent
+
+START = datetime(2024, 10, 15, 6, 0)
+
+# Observe {ID_ATM: [amount per hour]} one hour apart from START; returns the time of the last one
+def observe_hourly(forecast, amounts_by_atm):
+    hours = max(len(amounts) for amounts in amounts_by_atm.values())
+    for hour in range(hours):
+        observations = {
+            id_atm: (amounts[hour], amounts[hour] / 1e6)
+            for id_atm, amounts in amounts_by_atm.items() if hour < len(amounts)
+        }
+        forecast.observe(observations, START + timedelta(hours=hour))
+    return START + timedelta(hours=hours - 1)
+
+def test_amounts_and_percents_parse_as_the_report_writes_them():
+    assert parse_amount("5.000.000") == parse_amount("5000000") == 5e6
+    assert math.isnan(parse_amount("-"))
+    assert parse_percent(" 8.56% ") == 8.56
+    assert math.isnan(parse_percent("n/a"))
+
+def test_draining_atms_are_ranked_by_hours_to_empty(tmp_path):
+    forecast = CashForecast(str(tmp_path / 'forecast.npz'))
+    now = observe_hourly(forecast, {
+        10000007: [10e6, 9e6, 8e6],  # 1M an hour, empty in 8 hours
+        10000003: [10e6, 8e6, 6e6],  # 2M an hour, empty in 3 hours
+        10000005: [5e6, 5e6, 5e6]  # not draining
+    })
+
+    rows = forecast.forecast([10000007, 10000003, 10000005], now, 24, names={10000003: "ATM Cabang 3"})
+
+    assert [(row["RANK"], row["ID_ATM"], row["HOURS_TO_EMPTY"]) for row in rows] == [(1, "10000003", 3.0), (2, "10000007", 8.0)]
+    assert rows[0] == {
+        "RANK": 1, "ID_ATM": "10000003", "NAMA_ATM": "ATM Cabang 3", "JML_UANG": 6000000, "PERCENT": 6.0,
+        "RATE_PER_HOUR": 2000000, "HOURS_TO_EMPTY": 3.0, "OBSERVATIONS": 3
+    }
+    assert [row["ID_ATM"] for row in forecast.forecast([10000007, 10000003], now, 5)] == ["10000003"]
+
+def test_time_since_the_last_observation_counts_against_the_forecast(tmp_path):
+    forecast = CashForecast(str(tmp_path / 'forecast.npz'))
+    last = observe_hourly(forecast, {10000003: [10e6, 8e6, 6e6]})
+
+    (row,) = forecast.forecast([10000003], last + timedelta(hours=2), 24)
+    assert row["HOURS_TO_EMPTY"] == 1.0
+
+def test_a_single_observation_or_an_unknown_atm_has_no_forecast(tmp_path):
+    forecast = CashForecast(str(tmp_path / 'forecast.npz'))
+    now = observe_hourly(forecast, {10000003: [1e6]})
+
+    assert forecast.forecast([10000003, 10000099], now, 24) == []
+
+def test_a_refill_drops_the_earlier_drain(tmp_path):
+    forecast = CashForecast(str(tmp_path / 'forecast.npz'))
+    now = observe_hourly(forecast, {10000003: [10e6, 4e6, 20e6, 19e6]})
+
+    (row,) = forecast.forecast([10000003], now, 24)
+    assert (row["OBSERVATIONS"], row["RATE_PER_HOUR"], row["HOURS_TO_EMPTY"]) == (2, 1000000, 19.0)
+
+def test_only_the_last_capacity_observations_are_kept(tmp_path):
+    forecast = CashForecast(str(tmp_path / 'forecast.npz'), capacity=3)
+    # A slow drain, then three hours draining 3M an hour
+    now = observe_hourly(forecast, {10000003: [30e6, 29.9e6, 29.8e6, 27e6, 24e6, 21e6]})
+
+    (row,) = forecast.forecast([10000003], now, 24)
+    assert (row["OBSERVATIONS"], row["RATE_PER_HOUR"], row["HOURS_TO_EMPTY"]) == (3, 3000000, 7.0)
+
+def test_observations_survive_save_and_load(tmp_path):
+    path = str(tmp_path / 'forecast.npz')
+    forecast = CashForecast(path)
+    now = observe_hourly(forecast, {10000003: [10e6, 8e6], 10000007: [10e6, 9e6]})
+    forecast.save()
+
+    loaded = CashForecast.load(path)
+    assert loaded.forecast([10000003, 10000007], now, 24) == forecast.forecast([10000003, 10000007], now, 24)
+    loaded.observe({10000003: (6e6, 6.0)}, now + timedelta(hours=1))
+    assert loaded.forecast([10000003], now + timedelta(hours=1), 24)[0]["OBSERVATIONS"] == 3
+
+    # Saved with another capacity, the buffers start over
+    assert CashForecast.load(path, capacity=6).rows == {}
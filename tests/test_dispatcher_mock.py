@@ -0,0 +1,90 @@
+import json
+import os
+import pathlib
+
+import pytest
+
+pytest.importorskip('selenium')
+from selenium.common.exceptions import WebDriverException # type: ignore
+
+from dispatcher import IN_PAGE, NAVIGATE, BrowserSession
+
+MOCK_PAGE = pathlib.Path(__file__).resolve().parent.parent / 'mock_whatsapp.html'
+
+# Keeps the mock's own click handler from seeing chat links, like an app
+# that doesn't handle them: the link is then loaded as a new page
+IGNORE_CHAT_LINKS_SCRIPT = (
+    "document.addEventListener('click', function (event) { event.stopImmediatePropagation(); }, true);"
+)
+
+# Like a chat switch that still shows the previous chat's draft, with a
+# usable send button, until the new chat has loaded
+LEAVE_DRAFT_SCRIPT = (
+    "var openOriginal = openChat;"
+    "openChat = function (phone, text) {"
+    "  openOriginal(phone, text);"
+    "  var compose = document.getElementById('compose');"
+    "  compose.textContent = 'Draft lama';"
+    "  var button = document.createElement('button');"
+    "  button.setAttribute('data-icon', 'send');"
+    "  button.onclick = function () {"
+    "    sent.push({phone: phone, text: compose.textContent, load: load});"
+    "    localStorage.setItem('sent', JSON.stringify(sent));"
+    "  };"
+    "  compose.parentNode.appendChild(button);"
+    "};"
+)
+
+@pytest.fixture
+def session(tmp_path):
+    send_url = f"{MOCK_PAGE.as_uri()}?phone={{phone}}&text={{text}}"
+    try:
+        session = BrowserSession.open_chrome(
+            'test', os.fspath(tmp_path / 'profile'), headless=True, send_url_template=send_url, timeout=15, switch_timeout=3
+        )
+    except WebDriverException as e:
+        pytest.skip(f"Chrome is not available: {e.__class__.__name__}")
+    try:
+        session.start()
+        yield session
+    finally:
+        session.close()
+
+def page_loads(session):
+    return int(session.driver.execute_script("return localStorage.getItem('loads');"))
+
+def sent_messages(session):
+    return json.loads(session.driver.execute_script("return localStorage.getItem('sent') || '[]';"))
+
+def test_switches_chats_inside_the_loaded_page(session):
+    assert session.send('081234567890', 'Pesan pertama') == IN_PAGE
+    assert session.send('+6281234567891', 'Pesan kedua') == IN_PAGE
+
+    assert page_loads(session) == 1
+    sent = sent_messages(session)
+    assert [(entry['phone'], entry['text'], entry['load']) for entry in sent] == [
+        ('6281234567890', 'Pesan pertama', 1),
+        ('6281234567891', 'Pesan kedua', 1)
+    ]
+
+def test_waits_on_the_page_a_chat_link_navigated_to(session):
+    session.driver.execute_script(IGNORE_CHAT_LINKS_SCRIPT)
+
+    assert session.send('081234567890', 'Pesan pertama') == NAVIGATE
+
+    # The link's own load and nothing more: the send URL was not loaded again
+    assert page_loads(session) == 2
+    sent = sent_messages(session)
+    assert [(entry['phone'], entry['load']) for entry in sent] == [('6281234567890', 2)]
+
+    # The new page is marked, so the next chat switches inside it
+    assert session.send('081234567891', 'Pesan kedua') == IN_PAGE
+    assert page_loads(session) == 2
+
+def test_waits_for_the_message_instead_of_sending_a_left_draft(session):
+    session.driver.execute_script(LEAVE_DRAFT_SCRIPT)
+
+    assert session.send('081234567890', 'Pesan pertama\n\nBaris kedua') == IN_PAGE
+
+    sent = sent_messages(session)
+    assert [(entry['phone'], entry['text']) for entry in sent] == [('6281234567890', 'Pesan pertama\n\nBaris kedua')]
@@ -0,0 +1,144 @@
+import os
+
+import pytest
+
+from benchmark import generate_fixtures
+from report_parser import ReportBlocks
+from sms import FollowCheckpoint, ReportFollower
+
+@pytest.fixture(scope='module')
+def dumps(tmp_path_factory):
+    dumps = []
+    for seed in (3, 4):
+        fixture_dir = tmp_path_factory.mktemp('fixture')
+        generate_fixtures(os.fspath(fixture_dir), atm_count=120, history_rows=10, problem_count=60, seed=seed)
+        dumps.append((fixture_dir / 'report.txt').read_text())
+    return dumps
+
+def block_starts(text):
+    blocks = ReportBlocks()
+    for number, line in enumerate(text.splitlines(keepends=True)):
+        blocks.feed(line, number)
+    return blocks.starts
+
+# A follower over report.txt in tmp_path whose handled dumps land in a list
+def start_follower(tmp_path, settle=60.0):
+    handled = []
+    checkpoint = FollowCheckpoint.load(os.fspath(tmp_path / 'report.checkpoint'))
+    follower = ReportFollower(os.fspath(tmp_path / 'report.txt'), checkpoint, lambda lines: handled.append(''.join(lines)), settle)
+    return follower, handled
+
+def append(path, text):
+    with open(path, 'a') as file:
+        file.write(text)
+
+def test_one_dump_is_one_block(dumps):
+    # Problem Hardware and Problem Down also head the atm_problem subsections
+    assert 'Report Problem ATM BPD Bali\n*Problem Hardware*\n' in dumps[0]
+    assert block_starts(dumps[0]) == []
+
+def test_consecutive_dumps_split_at_their_first_line(dumps):
+    text = dumps[0] + dumps[1] + dumps[0]
+    first, second = len(dumps[0].splitlines()), len(dumps[1].splitlines())
+    assert block_starts(text) == [first, first + second]
+
+def test_a_dump_opening_on_an_atm_problem_subheader_starts_a_block(dumps):
+    # The second dump opens with Problem Hardware right after the first dump's atm_problem rows
+    text = dumps[0] + "*Problem Hardware*\n 1. 10000007 | ATM Cabang 1 | error dengan keterangan : ID ATM 10000007 Card Reader Fault\n"
+    assert block_starts(text) == [len(dumps[0].splitlines())]
+
+def test_first_start_without_checkpoint_takes_only_the_last_dump(tmp_path, dumps):
+    (tmp_path / 'report.txt').write_text(dumps[0] + dumps[1])
+    follower, handled = start_follower(tmp_path)
+
+    assert follower.poll(now=0) == 0
+    assert follower.poll(now=5) == 1
+    assert handled == [dumps[1]]
+
+def test_a_dump_flushed_in_two_parts_is_handled_once(tmp_path, dumps):
+    report_path = tmp_path / 'report.txt'
+    report_path.write_text(dumps[0])
+    follower, handled = start_follower(tmp_path)
+    follower.poll(now=0)
+    follower.poll(now=5)
+
+    # The first half holds still for a poll but hasn't reached atm_problem yet
+    middle = dumps[1].index('Report Persentase')
+    append(report_path, dumps[1][:middle])
+    follower.poll(now=10)
+    assert follower.poll(now=15) == 0
+    append(report_path, dumps[1][middle:])
+    follower.poll(now=20)
+    assert follower.poll(now=25) == 1
+    assert handled == [dumps[0], dumps[1]]
+
+def test_dumps_appended_between_polls_are_handled_apart(tmp_path, dumps):
+    report_path = tmp_path / 'report.txt'
+    report_path.write_text(dumps[0])
+    follower, handled = start_follower(tmp_path)
+    follower.poll(now=0)
+    follower.poll(now=5)
+
+    append(report_path, dumps[1] + dumps[0])
+    # The dump followed by another is complete at once; the last waits for the size to hold
+    assert follower.poll(now=10) == 1
+    assert follower.poll(now=15) == 1
+    assert handled == [dumps[0], dumps[1], dumps[0]]
+
+def test_an_unfinished_dump_is_taken_once_the_size_settles(tmp_path, dumps):
+    report_path = tmp_path / 'report.txt'
+    report_path.write_text(dumps[0])
+    follower, handled = start_follower(tmp_path, settle=30)
+    follower.poll(now=0)
+    follower.poll(now=5)
+
+    partial = dumps[1][:dumps[1].index('monitoring_npm:')]
+    append(report_path, partial)
+    follower.poll(now=10)
+    assert follower.poll(now=35) == 0
+    assert follower.poll(now=40) == 1
+    assert handled[-1] == partial
+
+def test_restart_resumes_from_the_checkpoint(tmp_path, dumps):
+    report_path = tmp_path / 'report.txt'
+    report_path.write_text(dumps[0])
+    follower, handled = start_follower(tmp_path)
+    follower.poll(now=0)
+    follower.poll(now=5)
+
+    append(report_path, dumps[1])
+    follower, handled = start_follower(tmp_path)
+    follower.poll(now=0)
+    follower.poll(now=5)
+    assert handled == [dumps[1]]
+
+def test_truncated_report_is_read_from_the_start(tmp_path, dumps):
+    report_path = tmp_path / 'report.txt'
+    report_path.write_text(dumps[0] + dumps[1])
+    follower, handled = start_follower(tmp_path)
+    follower.poll(now=0)
+    follower.poll(now=5)
+
+    with open(report_path, 'w') as file:
+        file.write(dumps[0][:100])
+    follower.poll(now=10)
+    assert follower.checkpoint.offset == 0
+    append(report_path, dumps[0][100:])
+    follower.poll(now=15)
+    follower.poll(now=20)
+    assert handled == [dumps[1], dumps[0]]
+
+def test_rotated_report_is_read_from_the_start(tmp_path, dumps):
+    report_path = tmp_path / 'report.txt'
+    report_path.write_text(dumps[0])
+    follower, handled = start_follower(tmp_path)
+    follower.poll(now=0)
+    follower.poll(now=5)
+
+    # The new file is larger than the checkpoint offset, so only the inode gives the rotation away
+    os.rename(report_path, tmp_path / 'report.txt.1')
+    follower.poll(now=10)
+    report_path.write_text(dumps[1] + dumps[0])
+    follower.poll(now=15)
+    follower.poll(now=20)
+    assert handled == [dumps[0], dumps[1], dumps[0]]
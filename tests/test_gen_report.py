@@ -0,0 +1,65 @@
+import os
+
+import pandas as pd
+import pytest
+
+import genReport
+from benchmark import BENCH_CLOCK, generate_fixtures
+from history_store import ROW_ID_COLUMN, HistoryStore
+
+def write_report(tmp_path, *args):
+    output = tmp_path / 'ATM_Report.txt'
+    genReport.main([
+        '--date', f"{BENCH_CLOCK:%Y-%m-%d}", '--output', os.fspath(output),
+        '--index', os.fspath(tmp_path / 'report_index.pkl'), *args
+    ])
+    return output.read_text()
+
+@pytest.fixture
+def fixture_dir(tmp_path):
+    generate_fixtures(os.fspath(tmp_path), atm_count=60, history_rows=400, problem_count=30, seed=11)
+    return tmp_path
+
+def test_workbook_and_store_give_the_same_report(fixture_dir, tmp_path_factory):
+    from_workbook = write_report(
+        fixture_dir, '--history-db', '', '--history-xlsx', os.fspath(fixture_dir / 'history.xlsx')
+    )
+    history_store = HistoryStore(os.fspath(fixture_dir / 'history.db'))
+    history_store.import_excel(os.fspath(fixture_dir / 'history.xlsx'))
+    history_store.close()
+    store_dir = tmp_path_factory.mktemp('store_report')
+    from_store = write_report(store_dir, '--history-db', os.fspath(fixture_dir / 'history.db'))
+
+    assert from_workbook == from_store
+    assert from_workbook.count("Tidak ada data.") < len(genReport.SECTION_TITLES)
+
+def test_officer_edits_reach_the_report(fixture_dir):
+    history_db = os.fspath(fixture_dir / 'history.db')
+    history_store = HistoryStore(history_db)
+    history_store.import_excel(os.fspath(fixture_dir / 'history.xlsx'))
+    history_store.export_excel(os.fspath(fixture_dir / 'export.xlsx'))
+    before = write_report(fixture_dir, '--history-db', history_db)
+
+    # An officer notes the last row of today as being worked on
+    sheets = pd.read_excel(fixture_dir / 'export.xlsx', sheet_name=None)
+    month_df = next(iter(sheets.values()))
+    today = month_df["TANGGAL INPUT"].str.startswith(f"{BENCH_CLOCK:%d/%m/%Y}")
+    row_id = month_df.loc[today & month_df["KETERANGAN"].isna(), ROW_ID_COLUMN].iloc[-1]
+    month_df["KETERANGAN"] = month_df["KETERANGAN"].astype(object)
+    month_df.loc[month_df[ROW_ID_COLUMN] == row_id, "KETERANGAN"] = "in progress"
+    with pd.ExcelWriter(fixture_dir / 'export.xlsx') as writer:
+        for month, sheet_df in sheets.items():
+            sheet_df.to_excel(writer, sheet_name=month, index=False)
+    assert history_store.import_manual_columns(os.fspath(fixture_dir / 'export.xlsx')) == 1
+    history_store.close()
+
+    after = write_report(fixture_dir, '--history-db', history_db)
+    in_progress = after.split(genReport.SECTION_TITLES[2])[1].split(genReport.SECTION_TITLES[3])[0]
+    line = month_df.loc[month_df[ROW_ID_COLUMN] == row_id, ["NAMA_ATM", "PERMASALAHAN"]].iloc[0]
+    assert f"{line['NAMA_ATM']} {line['PERMASALAHAN']}" in in_progress
+    assert after != before
+
+def test_no_history_is_a_clear_error(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        write_report(tmp_path, '--history-db', os.fspath(tmp_path / 'missing.db'), '--history-xlsx', os.fspath(tmp_path / 'missing.xlsx'))
+    assert "no history found" in capsys.readouterr().err
@@ -0,0 +1,74 @@
+import pandas as pd
+
+from history_store import HISTORY_COLUMNS, ROW_ID_COLUMN, HistoryStore
+
+def history_record(id_atm, problem, updated_at="15/10/2024 09:00:00"):
+    record = {column: None for column in HISTORY_COLUMNS}
+    record.update({
+        "TANGGAL INPUT": updated_at, "FREQUENCY": 1, "ID_ATM": str(id_atm), "NAMA_ATM": f"ATM {id_atm}",
+        "TIPE_PERMASALAHAN": "Problem Down", "PERMASALAHAN": problem, "UPDATED_AT": pd.Timestamp(2024, 10, 15, 9)
+    })
+    return record
+
+def open_store(tmp_path):
+    history_store = HistoryStore(str(tmp_path / 'history.db'))
+    history_store.apply_changes("Oktober 2024", [history_record(10000007, "Down Node"), history_record(10000014, "Comm Down")], [], [])
+    history_store.apply_changes("September 2024", [history_record(10000021, "Card Reader Fault")], [], [])
+    return history_store
+
+def test_apply_changes_bumps_marks_done_and_inserts(tmp_path):
+    history_store = open_store(tmp_path)
+    first, second = history_store.load_month("Oktober 2024").index
+
+    (new_id,) = history_store.apply_changes(
+        "Oktober 2024", [history_record(10000028, "Down Node")], [(first, 3, pd.Timestamp(2024, 10, 15, 10))], [second]
+    )
+
+    history_df = history_store.load_month("Oktober 2024")
+    assert history_df.index.tolist() == [first, second, new_id]
+    assert history_df.at[first, "FREQUENCY"] == 3
+    assert history_df.at[first, "UPDATED_AT"] == pd.Timestamp(2024, 10, 15, 10)
+    assert history_df.at[second, "PROGRES_PERBAIKAN_ATM"] == "DONE"
+
+def test_export_keeps_every_month_with_its_row_ids(tmp_path):
+    history_store = open_store(tmp_path)
+    history_store.export_excel(str(tmp_path / 'export.xlsx'))
+
+    sheets = pd.read_excel(tmp_path / 'export.xlsx', sheet_name=None)
+    assert list(sheets) == ["Oktober 2024", "September 2024"]
+    assert sheets["Oktober 2024"][ROW_ID_COLUMN].tolist() == history_store.load_month("Oktober 2024").index.tolist()
+
+    # An exported workbook also imports into an empty store, ids aside
+    fresh_store = HistoryStore(str(tmp_path / 'fresh.db'))
+    assert fresh_store.import_excel(str(tmp_path / 'export.xlsx')) == 3
+    assert fresh_store.months() == ["Oktober 2024", "September 2024"]
+
+def test_officer_edits_go_back_by_row_id(tmp_path):
+    history_store = open_store(tmp_path)
+    history_store.export_excel(str(tmp_path / 'export.xlsx'))
+    first, second = history_store.load_month("Oktober 2024").index
+    # A run after the export marks the second row DONE
+    history_store.apply_changes("Oktober 2024", [], [], [second])
+
+    sheets = pd.read_excel(tmp_path / 'export.xlsx', sheet_name=None)
+    october = sheets["Oktober 2024"]
+    october["KETERANGAN"] = october["KETERANGAN"].astype(object)
+    october["TINDAK LANJUT PIC"] = october["TINDAK LANJUT PIC"].astype(object)
+    october.loc[october[ROW_ID_COLUMN] == first, "KETERANGAN"] = "in progress"
+    october.loc[october[ROW_ID_COLUMN] == second, "TINDAK LANJUT PIC"] = "teknisi dijadwalkan"
+    # Columns sms.py owns are never taken from the workbook
+    october.loc[october[ROW_ID_COLUMN] == first, "FREQUENCY"] = 99
+    with pd.ExcelWriter(tmp_path / 'export.xlsx') as writer:
+        for month, sheet_df in sheets.items():
+            sheet_df.to_excel(writer, sheet_name=month, index=False)
+
+    assert history_store.import_manual_columns(str(tmp_path / 'export.xlsx')) == 2
+    history_df = history_store.load_month("Oktober 2024")
+    assert history_df.at[first, "KETERANGAN"] == "in progress"
+    assert history_df.at[first, "FREQUENCY"] == 1
+    assert history_df.at[second, "TINDAK LANJUT PIC"] == "teknisi dijadwalkan"
+    # The blank PROGRES cell of the older export left DONE in place
+    assert history_df.at[second, "PROGRES_PERBAIKAN_ATM"] == "DONE"
+
+    # Importing the same edits again changes nothing
+    assert history_store.import_manual_columns(str(tmp_path / 'export.xlsx')) == 0
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from sms import correlate_branch_incidents
+
+NOW = datetime(2024, 10, 15, 9, 0)
+DENPASAR = {"NAMA_CABANG": "Cabang Denpasar", "PIC_NAME": "PIC 1"}
+KUTA = {"NAMA_CABANG": "Capem Kuta", "PIC_NAME": "PIC 2"}
+
+# A matched problem as create_messages_and_save_to_excel builds them
+def down(id_atm, start_time, match=DENPASAR, error_type='Problem Down', by_name=False):
+    return (by_name, str(id_atm), f"ATM {id_atm}", f"ID ATM {id_atm} Down Node", start_time, error_type, match)
+
+def correlate(problems, threshold=3, window_minutes=30):
+    return correlate_branch_incidents(problems, threshold, window_minutes, lambda: NOW)
+
+def test_a_burst_at_one_branch_becomes_one_incident():
+    problems = [down(10000012, '15/10/2024 08:05:00'), down(10000003, '15/10/2024 08:01:00'), down(10000007, '15/10/2024 08:10:00')]
+
+    correlated, incidents = correlate(problems)
+
+    assert correlated == incidents
+    (incident,) = incidents
+    # Led by the lowest ID, starting at the earliest start, in the place of the first problem
+    assert incident == (
+        False, '10000003', "3 ATM di Cabang Denpasar",
+        "error dengan keterangan : Problem Down 3 ATM di Cabang Denpasar "
+        "(ATM 10000003 ID 10000003, ATM 10000007 ID 10000007, ATM 10000012 ID 10000012)",
+        '15/10/2024 08:01:00', 'Problem Down', DENPASAR
+    )
+
+def test_problems_below_the_threshold_pass_through():
+    problems = [down(10000003, '15/10/2024 08:01:00'), down(10000007, '15/10/2024 08:02:00')]
+    assert correlate(problems) == (problems, [])
+
+def test_an_atm_reported_twice_counts_once():
+    problems = [down(10000003, '15/10/2024 08:01:00'), down(10000003, '15/10/2024 08:02:00'), down(10000007, '15/10/2024 08:03:00')]
+    assert correlate(problems) == (problems, [])
+
+def test_buckets_split_by_branch_window_and_type():
+    problems = [
+        down(10000001, '15/10/2024 08:01:00'),
+        down(10000002, '15/10/2024 08:02:00', match=KUTA),
+        down(10000003, '15/10/2024 08:40:00'),
+        down(10000004, '15/10/2024 08:03:00', error_type='NPM Problem'),
+        down(10000005, '15/10/2024 08:04:00', error_type='Problem Hardware')
+    ]
+    assert correlate(problems, threshold=2) == (problems, [])
+
+def test_other_problems_keep_their_place_around_an_incident():
+    hardware = down(10000009, '15/10/2024 08:00:00', error_type='Problem Hardware')
+    by_name = down(10000010, '15/10/2024 08:00:00', by_name=True)
+    problems = [hardware, down(10000001, '15/10/2024 08:01:00'), by_name, down(10000002, '15/10/2024 08:02:00')]
+
+    correlated, incidents = correlate(problems, threshold=2)
+
+    assert correlated == [hardware, incidents[0], by_name]
+
+def test_a_start_time_that_does_not_parse_falls_in_the_current_window():
+    problems = [down(10000001, 'sejak tadi'), down(10000002, '15/10/2024 09:05:00')]
+
+    (incident,) = correlate(problems, threshold=2)[1]
+
+    assert incident[4] == '15/10/2024 09:00:00'
@@ -0,0 +1,44 @@
+from name_index import TrigramIndex, bounded_levenshtein, normalize_name, numbers
+
+def build_index(*names):
+    return TrigramIndex([{"NAMA_ATM": name, "ID_ATM": 10000000 + n} for n, name in enumerate(names)])
+
+def test_normalize_name_folds_case_and_punctuation():
+    assert normalize_name("ATM  Cabang-Denpasar (Utara)") == "atm cabang denpasar utara"
+    assert numbers(normalize_name("ATM Cabang 22 Unit 7")) == ['22', '7']
+
+def test_bounded_levenshtein_gives_up_past_the_bound():
+    assert bounded_levenshtein("kitten", "sitting", 3) == 3
+    assert bounded_levenshtein("kitten", "sitting", 2) is None
+    assert bounded_levenshtein("abc", "abcdef", 2) is None
+
+def test_feed_name_with_a_suffix_matches_on_its_leading_words():
+    index = build_index("ATM Cabang Denpasar Utara", "ATM Renon Timur")
+
+    match = index.lookup("ATM Cabang Denpasar Utara (node down)")
+
+    assert match.record["NAMA_ATM"] == "ATM Cabang Denpasar Utara"
+    assert match.candidates[0] == ("ATM Cabang Denpasar Utara", 1.0)
+
+def test_a_number_the_directory_lacks_is_never_matched():
+    index = build_index("ATM Cabang 22", "ATM Pasar Badung", "ATM Renon Timur")
+
+    for feed_name in ["ATM Cabang 222", "ATM Cabang 222 (node down)", "ATM Pasar Badung 2", "ATM Renon Timur 3"]:
+        match = index.lookup(feed_name)
+        assert match.record is None, feed_name
+        assert match.candidates == [], feed_name
+
+def test_numbers_that_agree_still_match():
+    index = build_index("ATM Cabang 22", "ATM Pasar Badung 2")
+
+    assert index.lookup("ATM Cabang 22 (node down)").record["NAMA_ATM"] == "ATM Cabang 22"
+    assert index.lookup("ATM Pasar  Badung-2").record["NAMA_ATM"] == "ATM Pasar Badung 2"
+
+def test_close_runner_up_leaves_the_name_unresolved():
+    index = build_index("ATM Cabang Denpasar Utara", "ATM Cabang Denpasar Utama")
+
+    match = index.lookup("ATM Cabang Denpasar Utarx")
+
+    assert match.record is None
+    assert match.ambiguous
+    assert [name for name, _ in match.candidates] == ["ATM Cabang Denpasar Utara", "ATM Cabang Denpasar Utama"]
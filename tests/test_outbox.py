@@ -0,0 +1,78 @@
+import time
+
+from outbox import DEAD, FAILED, PENDING, SENDING, SENT, Outbox, idempotency_key
+
+def found_row(phone=628120000010, message="Selamat pagi", batch="2024-10-15 10:05:00"):
+    return {"PIC_NAME": "PIC 1", "PHONE": phone, "TYPE": "Problem Down", "Message": message, "BATCH": batch}
+
+def open_outbox(tmp_path, **kwargs):
+    return Outbox(str(tmp_path / 'outbox.db'), **kwargs)
+
+def test_key_ignores_how_excel_typed_the_phone():
+    keys = {idempotency_key("PIC 1", phone, "Selamat pagi", "b") for phone in [628120000010.0, 628120000010, "+628120000010", "08120000010"]}
+    assert len(keys) == 1
+
+def test_recording_a_batch_twice_queues_it_once(tmp_path):
+    outbox = open_outbox(tmp_path)
+
+    assert outbox.record([found_row(phone=628120000010.0)]) == 1
+    # The dispatcher reads the same row back from the Found sheet as an int
+    assert outbox.record([found_row(phone=628120000010)]) == 0
+    assert outbox.counts() == {PENDING: 1}
+
+def test_the_same_text_in_a_later_batch_is_queued_again(tmp_path):
+    outbox = open_outbox(tmp_path)
+
+    outbox.record([found_row(batch="2024-10-15 10:05:00")])
+    assert outbox.record([found_row(batch="2024-10-15 11:05:00")]) == 1
+
+def test_interrupted_sends_are_requeued_only_when_asked(tmp_path):
+    outbox = open_outbox(tmp_path)
+    outbox.record([found_row()])
+    (message,) = outbox.due()
+    outbox.mark_sending(message["KEY"])
+    outbox.close()
+
+    # Opening the outbox beside a running dispatcher leaves its sends alone
+    outbox = open_outbox(tmp_path)
+    assert outbox.counts() == {SENDING: 1}
+    assert outbox.due() == []
+
+    assert outbox.requeue_interrupted() == 1
+    assert [row["KEY"] for row in outbox.due()] == [message["KEY"]]
+
+def test_failures_back_off_then_give_up(tmp_path):
+    outbox = open_outbox(tmp_path, max_attempts=3, retry_base=30.0, retry_cap=45.0)
+    outbox.record([found_row()])
+    (message,) = outbox.due()
+    key = message["KEY"]
+
+    started = time.time()
+    outbox.mark_sending(key)
+    outbox.mark_failed(key, "timeout")
+    assert outbox.counts() == {FAILED: 1}
+    assert outbox.due(now=started) == []
+    assert started + 30 <= outbox.next_retry_at() <= time.time() + 30
+
+    # The second backoff doubles to 60s, capped at 45s
+    outbox.mark_sending(key)
+    outbox.mark_failed(key, "timeout")
+    assert outbox.next_retry_at() <= time.time() + 45
+    assert [row["KEY"] for row in outbox.due(now=time.time() + 46)] == [key]
+
+    outbox.mark_sending(key)
+    outbox.mark_failed(key, "timeout")
+    assert outbox.counts() == {DEAD: 1}
+    assert outbox.due(now=time.time() + 3600) == []
+
+def test_sent_messages_are_not_due_again(tmp_path):
+    outbox = open_outbox(tmp_path)
+    outbox.record([found_row()])
+    (message,) = outbox.due()
+
+    outbox.mark_sending(message["KEY"])
+    outbox.mark_sent(message["KEY"])
+
+    assert outbox.counts() == {SENT: 1}
+    assert outbox.record([found_row()]) == 0
+    assert outbox.due() == []
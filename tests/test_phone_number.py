@@ -0,0 +1,43 @@
+import math
+
+import pandas as pd
+import pytest
+
+from move_phone import resolve_branch_pics
+from phone_number import normalize_phone, normalize_phones, whatsapp_phone
+
+@pytest.mark.parametrize('value', [
+    81234567890, 81234567890.0, '81234567890', '081234567890', '6281234567890', '+6281234567890',
+    6281234567890.0, '0812-3456-7890', '+62 812 3456 7890', '(0812) 3456 7890', ' 081234567890 ', '81234567890.0'
+])
+def test_every_way_a_phone_is_written_normalizes_the_same(value):
+    assert normalize_phone(value) == '+6281234567890'
+
+@pytest.mark.parametrize('value', [None, math.nan, '', 'not found', '0812abc', '+1 555 0100'])
+def test_values_without_a_number_normalize_to_none(value):
+    assert normalize_phone(value) is None
+
+def test_whatsapp_phone_is_digits_and_keeps_what_it_cannot_read():
+    assert whatsapp_phone(81234567890.0) == '6281234567890'
+    assert whatsapp_phone('not found') == 'not found'
+
+def test_normalize_phones_keeps_missing_values_missing():
+    phones = normalize_phones(pd.Series(['0812-3456', 8123456.0, None, '0812-3456']))
+    assert phones.iloc[[0, 1, 3]].tolist() == ['+628123456'] * 3
+    assert pd.isna(phones.iloc[2])
+
+def test_branch_pics_come_from_the_capem_or_cabang_columns():
+    master = pd.DataFrame({'NAMA_CABANG': ['Cabang Denpasar / KC', ' CAPEM Kuta', 'Cabang Tabanan', 'Cabang Gianyar', None]})
+    heads = pd.DataFrame({
+        'cabang': ['cabang denpasar ', 'Capem Kuta', 'Cabang Gianyar', 'cabang denpasar'],
+        'PIC_NAME_CABANG': ['Made', 'Kadek', 'Komang', 'Ketut'],
+        'PHONE_CABANG': [81111111.0, 82222222.0, None, 84444444.0],
+        'PIC_NAME_CAPEM': ['Putu', 'Wayan', 'Nyoman', 'Gede'],
+        'PHONE_CAPEM': ['0815-5555', '0816-6666', '0817-7777', '0818-8888']
+    })
+
+    resolve_branch_pics(master, heads)
+
+    # A branch listed twice in the heads list takes its first row
+    assert master['PIC_NAME'].tolist() == ['Made', 'Wayan', 'not found', 'Komang', 'not found']
+    assert master['PHONE'].tolist() == ['+6281111111', '+628166666', 'not found', 'not found', 'not found']
@@ -0,0 +1,64 @@
+import json
+import os
+import pathlib
+
+import pandas as pd
+import pytest
+
+from benchmark import BENCH_CLOCK, generate_fixtures
+from history_store import history_sheet_name
+from report_parser import AtmDirectory, process_text_file
+from sms import MessageOptions, create_messages_and_save_to_excel
+
+FIXTURES = pathlib.Path(__file__).resolve().parent / 'fixtures'
+
+# The expected files hold what the original sms.py made of this fixture,
+# before its parser and message assembly were rewritten: the records of
+# process_text_file, and the Found and report_down sheets it wrote with the
+# clock at BENCH_CLOCK
+@pytest.fixture(scope='module')
+def fixture_dir(tmp_path_factory):
+    fixture_dir = tmp_path_factory.mktemp('fixture')
+    generate_fixtures(os.fspath(fixture_dir), atm_count=120, history_rows=300, problem_count=60, seed=3)
+    return fixture_dir
+
+def load_expected(name):
+    with open(FIXTURES / name, encoding='utf-8') as file:
+        return json.load(file)
+
+def parse_fixture(fixture_dir):
+    atm_directory = AtmDirectory.from_excel(os.fspath(fixture_dir / 'info.xlsx'), os.fspath(fixture_dir / '.refcache'))
+    return atm_directory, process_text_file(os.fspath(fixture_dir / 'report.txt'), atm_directory)
+
+# The original rows had no CANDIDATES column
+def original_row(record):
+    row = record.to_row()
+    row.pop("CANDIDATES", None)
+    return row
+
+def test_parsed_records_match_the_original_parser(fixture_dir):
+    _, (problems, not_found, above_ten_percent) = parse_fixture(fixture_dir)
+
+    assert {
+        "problems": [original_row(record) for record in problems],
+        "not_found": [original_row(record) for record in not_found],
+        "above_ten_percent": [original_row(record) for record in above_ten_percent]
+    } == load_expected('report_records.json')
+
+def test_messages_match_the_original_assembly(fixture_dir, tmp_path, monkeypatch):
+    monkeypatch.delenv('PIC_FDS', raising=False)
+    atm_directory, (problems, not_found, above_ten_percent) = parse_fixture(fixture_dir)
+    history_df = pd.read_excel(fixture_dir / 'history.xlsx', sheet_name=history_sheet_name(BENCH_CLOCK))
+
+    # Suppression, snapshots, incidents and the cash forecast are off by default
+    message_run = create_messages_and_save_to_excel(
+        problems, not_found, above_ten_percent, atm_directory, None, history_df, now=BENCH_CLOCK,
+        options=MessageOptions(history_path=os.fspath(tmp_path / 'history.xlsx'))
+    )
+
+    expected = load_expected('messages.json')
+    assert [
+        {"PIC_NAME": message["PIC_NAME"], "PHONE": message["PHONE"], "Message": message["Message"]}
+        for message in message_run.messages
+    ] == expected["messages"]
+    assert message_run.report_down_message == expected["report_down"]
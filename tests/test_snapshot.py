@@ -0,0 +1,77 @@
+import os
+import random
+import shutil
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from benchmark import BENCH_CLOCK, generate_fixtures
+from history_store import HistoryStore, history_sheet_name
+from report_parser import AtmDirectory, process_text_file
+from sms import MessageOptions, create_messages_and_save_to_excel, load_history
+from snapshot import ReportSnapshot
+
+MONTH = history_sheet_name(BENCH_CLOCK)
+
+@pytest.fixture(scope='module')
+def fixture_dir(tmp_path_factory):
+    fixture_dir = tmp_path_factory.mktemp('fixture')
+    generate_fixtures(os.fspath(fixture_dir), atm_count=60, history_rows=150, problem_count=30, seed=3)
+    return fixture_dir
+
+# One pipeline over its own copy of history, in the store or in the workbook
+class Pipeline:
+    def __init__(self, fixture_dir, run_dir, mode, snapshot):
+        os.makedirs(run_dir)
+        self.history_path = os.fspath(run_dir / 'history.xlsx')
+        shutil.copy(fixture_dir / 'history.xlsx', self.history_path)
+        self.store = None
+        if mode == 'store':
+            self.store = HistoryStore(os.fspath(run_dir / 'history.db'))
+            self.store.import_excel(self.history_path)
+        self.snapshot = ReportSnapshot(os.fspath(run_dir / 'snapshot.db')) if snapshot else None
+
+    def run(self, problems, atm_directory, now):
+        create_messages_and_save_to_excel(
+            problems, [], [], atm_directory, None, None, self.store, now=now,
+            options=MessageOptions(snapshot=self.snapshot, history_path=self.history_path)
+        )
+
+    def history(self):
+        if self.store is not None:
+            return self.store.load_month(MONTH)
+        return load_history(BENCH_CLOCK, self.history_path)
+
+# Each report keeps some of the last report's problems and brings back or adds
+# others, so keys go new, persist, resolve and return
+def report_sequence(problems, seed, length=6):
+    rng = random.Random(seed)
+    current = rng.sample(problems, len(problems) // 2)
+    for _ in range(length):
+        kept = [problem for problem in current if rng.random() < 0.7]
+        added = rng.sample(problems, rng.randint(0, len(problems) // 3))
+        current = kept + [problem for problem in added if problem not in kept]
+        rng.shuffle(current)
+        yield list(current)
+
+# The snapshot only narrows which history rows the reconcile looks at, so
+# history must come out the same as reconciling against all of it
+@pytest.mark.parametrize('mode', ['store', 'workbook'])
+@pytest.mark.parametrize('seed', range(6))
+def test_snapshot_delta_leaves_history_as_the_full_reconcile(fixture_dir, tmp_path, mode, seed, capsys):
+    atm_directory = AtmDirectory.from_excel(os.fspath(fixture_dir / 'info.xlsx'), os.fspath(tmp_path / '.refcache'))
+    problems, _, _ = process_text_file(os.fspath(fixture_dir / 'report.txt'), atm_directory)
+    full = Pipeline(fixture_dir, tmp_path / 'full', mode, snapshot=False)
+    delta = Pipeline(fixture_dir, tmp_path / 'delta', mode, snapshot=True)
+
+    for step, report in enumerate(report_sequence(problems, seed)):
+        now = BENCH_CLOCK + timedelta(minutes=20 * step)
+        full.run(report, atm_directory, now)
+        delta.run(report, atm_directory, now)
+
+        history = delta.history()
+        pd.testing.assert_frame_equal(history, full.history())
+        # The snapshot kept up, so the next run takes the delta again
+        assert delta.snapshot.history_rows == len(history)
+    assert "reconciling against all of it" not in capsys.readouterr().out
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from suppression import SuppressionCache, parse_ttl_overrides
+
+NOW = datetime(2024, 10, 15, 9, 0)
+DOWN = ("PIC 1", 10000007, "Problem Down", "Down Node")
+HARDWARE = ("PIC 1", 10000007, "Problem Hardware", "Card Reader Fault")
+
+def open_cache(tmp_path, **kwargs):
+    return SuppressionCache(str(tmp_path / 'suppression.db'), **kwargs)
+
+def test_a_recorded_problem_is_quiet_until_its_ttl_runs_out(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.record([(DOWN, 1)], NOW)
+
+    assert cache.filter([(DOWN, 1)], NOW + timedelta(minutes=59)) == (set(), 1)
+    # Problem Down keeps quiet for 60 minutes
+    assert cache.filter([(DOWN, 1)], NOW + timedelta(minutes=60)) == ({DOWN}, 0)
+
+def test_ttl_follows_the_problem_type_and_overrides(tmp_path):
+    cache = open_cache(tmp_path, ttl_minutes={"Problem Hardware": 30})
+    cache.record([(DOWN, 1), (HARDWARE, 1)], NOW)
+
+    assert cache.filter([(DOWN, 1), (HARDWARE, 1)], NOW + timedelta(minutes=45)) == ({HARDWARE}, 1)
+    assert cache.ttl_seconds("Unknown type") == 240 * 60
+
+def test_filtering_alone_remembers_nothing(tmp_path):
+    cache = open_cache(tmp_path)
+
+    assert cache.filter([(DOWN, 1)], NOW) == ({DOWN}, 0)
+    assert cache.filter([(DOWN, 1)], NOW) == ({DOWN}, 0)
+    assert cache.count() == 0
+
+def test_crossing_an_escalation_level_sends_again(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.record([(DOWN, 3)], NOW)
+    later = NOW + timedelta(minutes=10)
+
+    assert cache.filter([(DOWN, 4)], later) == (set(), 1)
+    assert cache.filter([(DOWN, 5)], later) == ({DOWN}, 0)
+
+    # Once sent at 5, the next escalation is at 10
+    cache.record([(DOWN, 5)], later)
+    assert cache.filter([(DOWN, 9)], later) == (set(), 1)
+    assert cache.filter([(DOWN, 10)], later) == ({DOWN}, 0)
+
+def test_keys_are_compared_as_text(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.record([(DOWN, 1)], NOW)
+
+    # ID_ATM read back from Excel as a string is the same problem
+    assert cache.filter([(("PIC 1", "10000007", "Problem Down", "Down Node"), 1)], NOW) == (set(), 1)
+
+def test_expired_entries_are_evicted(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.record([(DOWN, 1), (HARDWARE, 1)], NOW)
+
+    assert cache.evict_expired(NOW + timedelta(minutes=90)) == 1
+    assert cache.count() == 1
+    # filter evicts on its way
+    cache.filter([], NOW + timedelta(hours=4))
+    assert cache.count() == 0
+
+def test_entries_survive_reopening(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.record([(DOWN, 1)], NOW)
+    cache.close()
+
+    assert open_cache(tmp_path).filter([(DOWN, 1)], NOW) == (set(), 1)
+
+def test_ttl_overrides_parse_type_equals_minutes():
+    assert parse_ttl_overrides(["Problem Down=15", "ATM Warning=720"]) == {"Problem Down": 15.0, "ATM Warning": 720.0}
+    with pytest.raises(ValueError):
+        parse_ttl_overrides(["Problem Down"])
@@ -0,0 +1,48 @@
+import os
+
+import pandas as pd
+
+from benchmark import BENCH_CLOCK, generate_fixtures
+from history_store import history_sheet_name
+from report_parser import AtmDirectory, process_text_file
+from sms import MessageOptions, create_messages_and_save_to_excel, load_history
+
+# Without a history store the workbook is history itself; a run must only
+# ever replace the sheet of its own month
+def run_on_workbook(fixture_dir, now):
+    atm_directory = AtmDirectory.from_excel(os.fspath(fixture_dir / 'info.xlsx'), os.fspath(fixture_dir / '.refcache'))
+    problems, not_found, above_ten_percent = process_text_file(os.fspath(fixture_dir / 'report.txt'), atm_directory)
+    history_path = os.fspath(fixture_dir / 'history.xlsx')
+    return create_messages_and_save_to_excel(
+        problems, not_found, above_ten_percent, atm_directory, None, load_history(now, history_path), now=now,
+        options=MessageOptions(history_path=history_path)
+    )
+
+def fixture_with_an_older_month(tmp_path):
+    generate_fixtures(os.fspath(tmp_path), atm_count=60, history_rows=50, problem_count=30, seed=5)
+    september = pd.DataFrame({"NAMA_ATM": ["ATM Lama"], "PERMASALAHAN": ["Down Node"]})
+    with pd.ExcelWriter(tmp_path / 'history.xlsx', mode='a') as writer:
+        september.to_excel(writer, sheet_name="September 2024", index=False)
+    return september
+
+def test_a_run_keeps_the_other_months(tmp_path):
+    september = fixture_with_an_older_month(tmp_path)
+    october_rows = len(pd.read_excel(tmp_path / 'history.xlsx', sheet_name=history_sheet_name(BENCH_CLOCK)))
+
+    message_run = run_on_workbook(tmp_path, BENCH_CLOCK)
+
+    sheets = pd.read_excel(tmp_path / 'history.xlsx', sheet_name=None)
+    assert list(sheets) == [history_sheet_name(BENCH_CLOCK), "September 2024"]
+    assert len(sheets[history_sheet_name(BENCH_CLOCK)]) == len(message_run.history_df) > october_rows
+    pd.testing.assert_frame_equal(sheets["September 2024"], september)
+
+def test_a_new_month_gets_its_own_sheet(tmp_path):
+    fixture_with_an_older_month(tmp_path)
+    november = BENCH_CLOCK.replace(month=11)
+    assert load_history(november, os.fspath(tmp_path / 'history.xlsx')).empty
+
+    run_on_workbook(tmp_path, november)
+
+    sheets = pd.read_excel(tmp_path / 'history.xlsx', sheet_name=None)
+    assert list(sheets) == [history_sheet_name(BENCH_CLOCK), "September 2024", "November 2024"]
+    assert len(sheets["November 2024"]) > 0
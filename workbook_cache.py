@@ -0,0 +1,30 @@
+import hashlib
+import os
+import pickle
+
+from atomic_file import atomic_write
+
+# Whatever build() makes of the workbook at path, pickled under cache_dir and
+# reused for as long as the workbook's mtime and size stay the same. `tag`
+# tells apart the different things cached for one workbook.
+def cached_for_workbook(path, tag, build, cache_dir='.refcache'):
+    file_stat = os.stat(path)
+    absolute_path = os.path.abspath(path)
+    key = (absolute_path, file_stat.st_mtime_ns, file_stat.st_size, tag)
+    digest = hashlib.sha1(repr((absolute_path, tag)).encode('utf-8')).hexdigest()[:12]
+    cache_path = os.path.join(cache_dir, f"{os.path.basename(path)}.{digest}.pkl")
+
+    try:
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached['key'] == key:
+            return cached['value']
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+
+    value = build()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with atomic_write(cache_path, 'wb') as file:
+        pickle.dump({'key': key, 'value': value}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return value